@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Runs several WebChain nodes on localhost and measures how quickly the blocks published by one of them reach the others.
+
+Every node is a uvicorn process serving poc:app with its own chain directory. Only the first node publishes, the
+rest learn its blocks through gossip and polling. The heads of all nodes are polled while the first node publishes,
+the latency of a block is the time between the first node and another node reaching its height.
+"""
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import mean, quantiles
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+from typing import Dict, List
+
+import httpx
+
+WEB_CHAIN_DIR = Path(__file__).resolve().parent.parent / 'web_chain'
+BASE_PORT = 8600
+POLL_INTERVAL = 0.05
+STARTUP_TIMEOUT = 60
+
+
+def start_node(ix: int, urls: List[str], directory: Path, publishers: int) -> subprocess.Popen:
+    port = BASE_PORT + ix
+    env = dict(os.environ,
+               WEBCHAIN_CHAIN_DIR=str(directory / 'chain'),
+               WEBCHAIN_DOCUMENT_DIR=str(directory / 'files'),
+               WEBCHAIN_NODE_URL=urls[ix],
+               WEBCHAIN_PEERS=','.join(urls),
+               WEBCHAIN_PUBLISHERS=str(publishers if ix == 0 else 0),
+               WEBCHAIN_MINING_WORKERS='1',
+               WEBCHAIN_SIGNING_WORKERS='1',
+               WEBCHAIN_SYNC_INTERVAL='1')
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'poc:app', '--port', str(port), '--log-level', 'warning'],
+                            cwd=WEB_CHAIN_DIR, env=env)
+
+
+def wait_until_up(client: httpx.Client, url: str):
+    deadline = monotonic() + STARTUP_TIMEOUT
+    while monotonic() < deadline:
+        try:
+            client.get(f'{url}/chain/head').raise_for_status()
+            return
+        except httpx.HTTPError:
+            sleep(0.2)
+    raise TimeoutError(f'{url} did not start')
+
+
+def simulate(num_nodes: int, duration: float, publishers: int) -> Dict[str, float]:
+    urls = [f'http://127.0.0.1:{BASE_PORT + ix}' for ix in range(num_nodes)]
+    with TemporaryDirectory() as directory, httpx.Client(timeout=5.0) as client:
+        nodes = [start_node(ix, urls, Path(directory) / str(ix), publishers) for ix in range(num_nodes)]
+        try:
+            for url in urls:
+                wait_until_up(client, url)
+            # time each node first reached each height
+            reached: List[Dict[int, float]] = [{} for _ in urls]
+            start = monotonic()
+            while monotonic() - start < duration:
+                for ix, url in enumerate(urls):
+                    height = client.get(f'{url}/chain/head').json()['height']
+                    now = monotonic()
+                    for h in range(len(reached[ix]) + 1, height + 1):
+                        reached[ix][h] = now
+                sleep(POLL_INTERVAL)
+        finally:
+            for node in nodes:
+                node.terminate()
+            for node in nodes:
+                node.wait()
+
+    latencies = [reached[ix][h] - t for h, t in reached[0].items() for ix in range(1, num_nodes) if h in reached[ix]]
+    blocks = len(reached[0])
+    return {
+        'nodes': num_nodes,
+        'blocks': blocks,
+        'mean_latency_ms': mean(latencies) * 1_000 if latencies else 0.0,
+        'p95_latency_ms': quantiles(latencies, n=20)[-1] * 1_000 if len(latencies) > 1 else 0.0,
+        'blocks_per_second': blocks / duration,
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to publish for on each run')
+    parser.add_argument('--publishers', type=int, default=3, help='publishing threads on the first node')
+    args = parser.parse_args()
+
+    print('nodes, blocks, mean_latency_ms, p95_latency_ms, blocks_per_second')
+    for n in args.nodes:
+        result = simulate(n, args.duration, args.publishers)
+        print(', '.join(f'{v:.1f}' if isinstance(v, float) else str(v) for v in result.values()))
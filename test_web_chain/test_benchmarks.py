@@ -0,0 +1,99 @@
+from itertools import count
+
+import pytest
+from fastapi.testclient import TestClient
+from fastecdsa import keys, curve
+from fastecdsa.curve import P256
+from fastecdsa.keys import export_key
+
+import poc
+from blocks import RootBlock, Block
+from chain_state import ChainState
+from chain_utils import sha256_hash_block, doc_id
+from document_cache import ByteLRUCache
+from document_store import DocumentStore
+from entries import RootEntry, DocumentPublishEntry
+from validate import parse_public_key, verify_signature
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+
+
+def _entry_chain(length: int) -> DocumentPublishEntry:
+    entry = RootEntry.get_instance()
+    for i in range(length):
+        entry = DocumentPublishEntry(entry, i.to_bytes(length=32, byteorder='big'), BYTES_32)
+    return entry
+
+
+@pytest.mark.parametrize('length', [1_000, 10_000])
+def test_benchmark_hash_entry_chain(benchmark, length):
+    """
+    Hashing the tail of a chain of entries whose hashes are not yet known, as after loading a chain
+    """
+    benchmark.group = 'sha256_hash_entry'
+    benchmark.extra_info['entries'] = length
+    hash_value = benchmark.pedantic(lambda tail: tail.sha256_hash, setup=lambda: ((_entry_chain(length),), {}),
+                                    rounds=5)
+    assert len(hash_value) == 32
+
+
+@pytest.mark.parametrize('difficulty', [8, 12, 16])
+def test_benchmark_hash_block(benchmark, difficulty):
+    """
+    Mining one block, every run mines the same sequence of timestamped blocks so the number of attempts is repeatable
+    """
+    benchmark.group = 'sha256_hash_block'
+    benchmark.extra_info['difficulty'] = difficulty
+    root = RootBlock.get_instance()
+    entries = [DocumentPublishEntry(root.entries[-1], BYTES_32, BYTES_32)]
+    timestamps = count(1)
+
+    def setup():
+        return (Block(root, entries, difficulty=difficulty, timestamp=next(timestamps)), None), {}
+
+    nonce, hash_value = benchmark.pedantic(sha256_hash_block, setup=setup, rounds=20)
+    assert hash_value[0] == 0
+
+
+@pytest.fixture(scope='module', params=[10, 1_000, 10_000])
+def served_chain(request, tmp_path_factory):
+    """
+    A chain of request.param blocks with the document of the first block stored, served by the PoC app
+    """
+    state = ChainState()
+    block = state.tail
+    for i in range(request.param):
+        block = Block(block, [DocumentPublishEntry(block.entries[-1], i.to_bytes(length=32, byteorder='big'),
+                                                   BYTES_32)], difficulty=0)
+        state.tail = block
+    store = DocumentStore(tmp_path_factory.mktemp('documents'))
+    first = (0).to_bytes(length=32, byteorder='big')
+    store.put(first, 'x' * 4096)
+    return request.param, state, store, first.hex()
+
+
+def test_benchmark_get_document(benchmark, served_chain):
+    length, state, store, d = served_chain
+    benchmark.group = 'get_document'
+    benchmark.extra_info['blocks'] = length
+    client = TestClient(poc.create_app(poc.Node(state, store, ByteLRUCache())))
+
+    response = benchmark(client.get, '/', params={'doc_id': d})
+    assert response.status_code == 200
+
+
+def test_benchmark_verify_signatures(benchmark):
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    pem = export_key(public_key, P256).encode('utf8')
+    documents = [(doc_id(f'document {i}', private_key).hex(), f'document {i}') for i in range(32)]
+    benchmark.group = 'validate'
+    benchmark.extra_info['documents'] = len(documents)
+
+    def verify_all():
+        key = parse_public_key(pem)
+        return sum(verify_signature(d, contents, key.x, key.y) for d, contents in documents)
+
+    assert benchmark(verify_all) == len(documents)
+    # no stats are kept when the suite runs with --benchmark-disable
+    if benchmark.stats:
+        benchmark.extra_info['documents_per_second'] = len(documents) / benchmark.stats.stats.mean
@@ -0,0 +1,76 @@
+from blocks import RootBlock, Block
+from chain_index import ChainIndex
+from entries import RootEntry, DocumentPublishEntry, DocumentUpdateEntry, HostLocationEntry
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+BYTES_64 = (1234567890).to_bytes(length=64, byteorder='big')
+IP_ADDRESS = bytes([127, 0, 0, 1])
+
+
+def test_chain_index():
+    index = ChainIndex()
+    host = HostLocationEntry(previous_entry=RootEntry.get_instance(), ipaddress=IP_ADDRESS, public_key=BYTES_64)
+    block_1 = Block(previous_block=RootBlock.get_instance(), entries=[host], nonce=None)
+    index.add_block(block_1, 1)
+    assert len(index) == 0
+    assert index.location(BYTES_64) is host
+
+    doc_ids = [i.to_bytes(length=32, byteorder='big') for i in range(3)]
+    previous_entry = host
+    entries = []
+    for d in doc_ids:
+        previous_entry = DocumentPublishEntry(previous_entry=previous_entry, doc_id=d, public_key=BYTES_32)
+        entries.append(previous_entry)
+    block_2 = Block(previous_block=block_1, entries=entries)
+    index.add_block(block_2, 2)
+
+    assert len(index) == 3
+    for d, entry in zip(doc_ids, entries):
+        assert d in index
+        record = index.lookup(d)
+        assert record.entry is entry
+        assert record.block is block_2
+        assert record.height == 2
+        assert record.public_key == BYTES_32
+    assert index.lookup(BYTES_64) is None
+
+
+def test_chain_index_versions():
+    index = ChainIndex(max_cached_histories=1)
+    doc_ids = [i.to_bytes(length=32, byteorder='big') for i in range(4)]
+    publish = DocumentPublishEntry(previous_entry=RootEntry.get_instance(), doc_id=doc_ids[0], public_key=BYTES_32)
+    update = DocumentUpdateEntry(publish, doc_ids[0], doc_ids[1], BYTES_32)
+    block_1 = Block(previous_block=RootBlock.get_instance(), entries=[publish, update])
+    index.add_block(block_1, 1)
+
+    assert index.history(doc_ids[0]) == (doc_ids[0], doc_ids[1])
+    assert index.history(doc_ids[1]) is index.history(doc_ids[0])
+    assert index.latest_version(doc_ids[0]) == doc_ids[1]
+    assert index.history(doc_ids[3]) == ()
+    assert index.latest_version(doc_ids[3]) is None
+
+    # a committed version replaces the cached history
+    update = DocumentUpdateEntry(update, doc_ids[1], doc_ids[2], BYTES_32)
+    orphan = DocumentUpdateEntry(update, doc_ids[3], doc_ids[3], BYTES_32)
+    index.add_block(Block(previous_block=block_1, entries=[update, orphan]), 2)
+    assert index.history(doc_ids[0]) == tuple(doc_ids[:3])
+    assert index.latest_version(doc_ids[1]) == doc_ids[2]
+    # an update of a document that is not on the chain starts its own history
+    assert index.history(doc_ids[3]) == (doc_ids[3],)
+
+
+def test_chain_index_branched_versions():
+    index = ChainIndex()
+    doc_ids = [i.to_bytes(length=32, byteorder='big') for i in range(3)]
+    publish = DocumentPublishEntry(previous_entry=RootEntry.get_instance(), doc_id=doc_ids[0], public_key=BYTES_32)
+    first = DocumentUpdateEntry(publish, doc_ids[0], doc_ids[1], BYTES_32)
+    block_1 = Block(previous_block=RootBlock.get_instance(), entries=[publish, first])
+    index.add_block(block_1, 1)
+    assert index.history(doc_ids[1]) == (doc_ids[0], doc_ids[1])
+
+    # the first version is replaced a second time, each branch keeps its own history
+    second = DocumentUpdateEntry(first, doc_ids[0], doc_ids[2], BYTES_32)
+    index.add_block(Block(previous_block=block_1, entries=[second]), 2)
+    assert index.history(doc_ids[1]) == (doc_ids[0], doc_ids[1])
+    assert index.history(doc_ids[2]) == (doc_ids[0], doc_ids[2])
+    assert index.latest_version(doc_ids[0]) == doc_ids[2]
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+from blocks import Block
+from chain_reader import ChainReader
+from chain_state import ChainState
+from chain_store import ChainStore
+from document_db import DocumentDatabase
+from entries import DocumentPublishEntry, DocumentUpdateEntry
+from shared_head import SharedHead, Head, HeadPublisher, HEAD_FILE, SEQUENCE
+from sync import materialize_fork
+from validate import verify_inclusion
+from wire import decode_stream, encode_record_stream, encode_stream
+from test_web_chain.test_sync import extend, stream, BYTES_32, OTHER_32
+
+UPDATED_32 = (2).to_bytes(length=32, byteorder='big')
+
+
+def _owner(directory: Path):
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store, database=DocumentDatabase(directory / 'index.sqlite3'))
+    head = SharedHead(directory / HEAD_FILE, writable=True)
+    HeadPublisher(state, store, head)
+    return state, store, head
+
+
+def _reader(directory: Path) -> ChainReader:
+    return ChainReader(directory, DocumentDatabase(directory / 'index.sqlite3'), SharedHead(directory / HEAD_FILE))
+
+
+def test_shared_head(tmpdir):
+    directory = Path(tmpdir)
+    state, store, head = _owner(directory)
+    reader_head = SharedHead(directory / HEAD_FILE)
+    assert reader_head.read() == (1, 0, state.tail.sha256_hash, 0)
+    extend(state, 3)
+    assert reader_head.read() == (1, 3, state.tail.sha256_hash, state.work)
+    store.close()
+    head.close()
+
+    # a restarted owner starts a new generation, its store may have dropped blocks
+    _, store, head = _owner(directory)
+    assert reader_head.read().generation == 2
+    assert reader_head.read().height == 3
+    store.close()
+    head.close()
+
+
+def test_shared_head_after_killed_owner(tmpdir):
+    path = Path(tmpdir) / HEAD_FILE
+    head = SharedHead(path, writable=True)
+    head.write(Head(1, 3, BYTES_32, 7))
+    # the owner was killed between making the sequence odd and even again
+    SEQUENCE.pack_into(head._map, 0, SEQUENCE.unpack_from(head._map, 0)[0] + 1)
+    head.close()
+
+    head = SharedHead(path, writable=True)
+    assert head.read() == (1, 3, BYTES_32, 7)
+    head.close()
+
+
+def test_chain_reader(tmpdir):
+    directory = Path(tmpdir)
+    state, store, _ = _owner(directory)
+    reader = _reader(directory)
+    assert reader.view()[1].height == 0
+    assert reader.lookup(BYTES_32) is None
+
+    extend(state, 20)
+    tail = state.tail
+    state.compare_and_swap(tail, Block(tail, [DocumentUpdateEntry(tail.entries[-1], BYTES_32, UPDATED_32, BYTES_32)]))
+    head, chain = reader.view()
+    # the segments are read without the owner closing or syncing the store
+    assert head.height == chain.height == 21
+    assert chain.tail.sha256_hash == state.tail.sha256_hash
+    assert reader.lookup(UPDATED_32).height == 21
+    assert [(v.doc_id, v.height) for v in reader.history(BYTES_32)] == [(BYTES_32.hex(), 20), (UPDATED_32.hex(), 21)]
+    assert verify_inclusion(reader.proof(UPDATED_32.hex()).dict(), UPDATED_32.hex())
+    records = list(decode_stream(encode_record_stream(reader.record_bodies(5, 8), 5)))
+    assert [r.sha256_hash for r in records] == [state.block(h).sha256_hash for h in (5, 6, 7)]
+
+    # the reader follows the owner onto a fork with more work
+    other = ChainState()
+    assert other.adopt(materialize_fork(other, list(decode_stream([stream(state, *range(1, 11))]))))
+    extend(other, 15, OTHER_32)
+    assert state.adopt(materialize_fork(state, list(decode_stream([stream(other, *range(11, 26))]))))
+    head, chain = reader.view()
+    assert head.generation == 2
+    assert head.height == chain.height == 25
+    assert chain.tail.sha256_hash == other.tail.sha256_hash
+    assert reader.lookup(UPDATED_32) is None
+    assert reader.lookup(OTHER_32).height == 25
+    assert [r.sha256_hash for r in decode_stream(encode_record_stream(reader.record_bodies(24, None), 24))] == \
+        [other.block(24).sha256_hash, other.block(25).sha256_hash]
+    store.close()
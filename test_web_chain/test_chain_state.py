@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from blocks import RootBlock, Block
+from chain_state import ChainState, mine_and_commit
+from entries import DocumentPublishEntry
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+
+
+def test_compare_and_swap():
+    state = ChainState()
+    root = RootBlock.get_instance()
+    block_1 = Block(root, [DocumentPublishEntry(root.entries[-1], BYTES_32, BYTES_32)])
+    block_2 = Block(root, [DocumentPublishEntry(root.entries[-1], BYTES_32, BYTES_32)])
+
+    assert state.compare_and_swap(root, block_1)
+    assert state.tail is block_1
+    assert not state.compare_and_swap(root, block_2)
+    assert state.tail is block_1
+    assert state.height == 1
+    assert state.commits == 1
+    assert state.conflicts == 1
+
+
+def test_mine_and_commit_rebases_on_conflict():
+    state = ChainState()
+    calls = []
+
+    def build_entries(previous):
+        calls.append(previous)
+        if len(calls) == 1:
+            # another miner commits while this block is being mined
+            root = RootBlock.get_instance()
+            assert state.compare_and_swap(root, Block(root, [DocumentPublishEntry(previous, BYTES_32, BYTES_32)]))
+        return [DocumentPublishEntry(previous, BYTES_32, BYTES_32)]
+
+    block, retries = mine_and_commit(state, build_entries)
+    assert retries == 1
+    assert state.tail is block
+    assert state.height == 2
+    assert state.conflicts == 1
+    assert calls[1] is block.previous_block.entries[-1]
+    assert block.entries[0].previous_entry is calls[1]
+
+
+def fork(parent, num_blocks: int, doc_id: bytes):
+    blocks = []
+    for _ in range(num_blocks):
+        parent = Block(parent, [DocumentPublishEntry(parent.entries[-1], doc_id, BYTES_32)])
+        blocks.append(parent)
+    return blocks
+
+
+def test_adopt_fork_with_more_work():
+    state = ChainState()
+    root = RootBlock.get_instance()
+    main = fork(root, 2, BYTES_32)
+    for block in main:
+        assert state.compare_and_swap(state.tail, block)
+    other_doc_id = (1).to_bytes(length=32, byteorder='big')
+    appended = []
+    state.add_listener(lambda block, height: appended.append(height))
+
+    # equal work does not switch chains
+    assert not state.adopt(fork(root, 2, other_doc_id))
+    assert state.tail is main[-1]
+
+    longer = fork(main[0], 2, other_doc_id)
+    assert state.adopt(longer)
+    assert state.tail is longer[-1]
+    assert state.height == 3
+    assert state.block(2) is longer[0]
+    assert state.height_of(main[1].sha256_hash) is None
+    assert state.height_of(longer[-1].sha256_hash) == 3
+    assert state.work == 3 * 2 ** longer[0].difficulty
+    assert state.index.lookup(other_doc_id).height == 3
+    assert appended == [2, 3]
+
+
+def test_adopt_rejects_unknown_parent():
+    state = ChainState()
+    detached = fork(RootBlock.get_instance(), 2, BYTES_32)
+    with pytest.raises(ValueError):
+        state.adopt(detached[1:])
+
+
+# prints the share of mine_and_commit's time that was counted as mining
+MINED_IN_TIMED_REGION = """
+from threading import current_thread
+from time import perf_counter
+from chain_state import ChainState, mine_and_commit, MINING_SECONDS
+from difficulty import FixedDifficulty
+from entries import DocumentPublishEntry
+state = ChainState(difficulty=FixedDifficulty(16))
+start = perf_counter()
+mine_and_commit(state, lambda previous: [DocumentPublishEntry(previous, bytes(32), bytes(32))])
+print(MINING_SECONDS.value((current_thread().name,)) / (perf_counter() - start))
+"""
+
+
+def test_mine_and_commit_mines_without_asserts():
+    # asserts are stripped under -O, the block must still be mined inside the region MINING_SECONDS times
+    web_chain = Path(__file__).parent.parent / 'web_chain'
+    result = subprocess.run([sys.executable, '-O', '-c', MINED_IN_TIMED_REGION], capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': str(web_chain)}, check=True)
+    assert float(result.stdout) > 0.5
@@ -0,0 +1,169 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from threading import Event
+
+import pytest
+
+from blocks import Block
+from chain_state import ChainState, mine_and_commit
+from chain_store import ChainStore, encode_block, decode_block, SEGMENT_HEADER, SEGMENT_SUFFIX
+from entries import DocumentPublishEntry, DocumentUpdateEntry, HostLocationEntry
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+BYTES_64 = (1234567890).to_bytes(length=64, byteorder='big')
+IP_ADDRESS = bytes([127, 0, 0, 1])
+
+
+def fill_chain(state: ChainState, num_blocks: int):
+    mine_and_commit(state, lambda previous: [HostLocationEntry(previous, IP_ADDRESS, BYTES_64)])
+    for i in range(num_blocks - 1):
+        doc_id = i.to_bytes(length=32, byteorder='big')
+
+        def build_entries(previous):
+            publish = DocumentPublishEntry(previous, doc_id, BYTES_32)
+            return [publish, DocumentUpdateEntry(publish, doc_id, BYTES_32, BYTES_32)]
+        mine_and_commit(state, build_entries)
+
+
+def test_encode_decode_block(tmpdir):
+    state = ChainState()
+    fill_chain(state, 2)
+    encoded = encode_block(state.tail)
+    record, offset = decode_block(encoded)
+    assert offset == len(encoded)
+    assert record.sha256_hash == state.tail.sha256_hash
+    assert record.previous_hash == state.tail.previous_block.sha256_hash
+    assert record.nonce == state.tail.nonce
+    assert [e.sha256_hash for e in record.entries] == [e.sha256_hash for e in state.tail.entries]
+    assert record.entries[1].fields == ((0).to_bytes(length=32, byteorder='big'), BYTES_32, BYTES_32)
+
+    with pytest.raises(ValueError):
+        decode_block(encoded[:-1])
+    corrupt = bytearray(encoded)
+    corrupt[10] ^= 0xff
+    with pytest.raises(ValueError):
+        decode_block(corrupt)
+
+
+def test_chain_store_reload(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store)
+    fill_chain(state, 4)
+    store.close()
+    assert len(store.segments()) > 1
+
+    reloaded_store = ChainStore(directory, segment_size=512)
+    assert reloaded_store.height == 4
+    reloaded = ChainState(reloaded_store)
+    assert reloaded.height == 4
+    assert reloaded.tail.sha256_hash == state.tail.sha256_hash
+    assert reloaded.tail.nonce == state.tail.nonce
+    assert len(reloaded.index) == len(state.index)
+
+    # appending after a restart continues the chain where it left off
+    fill_chain(reloaded, 1)
+    reloaded_store.close()
+    assert ChainState(ChainStore(directory, segment_size=512)).tail.sha256_hash == reloaded.tail.sha256_hash
+
+
+def test_chain_store_truncates_torn_record(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory)
+    state = ChainState(store)
+    fill_chain(state, 3)
+    store.close()
+
+    segment, = store.segments()
+    size = segment.stat().st_size
+    os.truncate(segment, size - 5)
+
+    recovered = ChainStore(directory)
+    assert recovered.height == 2
+    assert ChainState(recovered).tail.sha256_hash == state.tail.previous_block.sha256_hash
+    assert segment.stat().st_size < size - 5
+
+
+def test_idle_store_is_synced(tmpdir, monkeypatch):
+    synced = Event()
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.set() or fsync(fd))
+    store = ChainStore(Path(tmpdir), fsync_every=100, fsync_interval=0.1)
+    state = ChainState(store)
+    block = Block(state.tail, [HostLocationEntry(state.tail.entries[-1], IP_ADDRESS, BYTES_64)])
+    block.nonce  # mined up front, the block is appended right after the store is synced
+    store.sync()
+    synced.clear()
+    assert state.compare_and_swap(state.tail, block)
+    assert not synced.is_set()
+    # no block is appended after this one, it is synced anyway
+    assert synced.wait(timeout=5)
+    store.close()
+
+
+@pytest.mark.parametrize('header', [b'', b'WEBCH', bytes(SEGMENT_HEADER.size)], ids=['empty', 'partial', 'zeroed'])
+def test_chain_store_rewrites_torn_header(tmpdir, header):
+    directory = Path(tmpdir)
+    # a crash while the first segment was created, before or while its header was written
+    (directory / f'{1:012d}{SEGMENT_SUFFIX}').write_bytes(header)
+    assert ChainStore(directory).height == 0
+
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store)
+    fill_chain(state, 3)
+    store.close()
+    # the same crash when the store rolled over to its next segment
+    (directory / f'{store.height + 1:012d}{SEGMENT_SUFFIX}').write_bytes(header)
+    recovered = ChainStore(directory, segment_size=512)
+    assert recovered.height == 3
+    reloaded = ChainState(recovered)
+    fill_chain(reloaded, 1)
+    recovered.close()
+    assert ChainStore(directory, segment_size=512).height == reloaded.height
+
+
+def test_chain_store_truncate(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store)
+    fill_chain(state, 6)
+    num_segments = len(store.segments())
+
+    store.truncate(2)
+    assert store.height == 2
+    assert len(store.segments()) < num_segments
+    assert [r.sha256_hash for r in store.records()] == [state.block(h).sha256_hash for h in (1, 2)]
+
+    # appends continue from the truncated height and survive a reload
+    store.append(state.block(3))
+    store.close()
+    reloaded = ChainState(ChainStore(directory, segment_size=512))
+    assert reloaded.height == 3
+    assert reloaded.tail.sha256_hash == state.block(3).sha256_hash
+
+
+# a block mined at the default difficulty, rebuilt with the next nonce and the hash that nonce gives
+UNMINED_RECORD = """
+from blocks import Block, RootBlock
+from chain_store import decode_block_body, encode_block_body, materialize_block
+from entries import DocumentPublishEntry
+root = RootBlock.get_instance()
+entries = [DocumentPublishEntry(root.entries[-1], bytes(32), bytes(32))]
+mined = Block(root, entries)
+unmined = Block(root, entries, nonce=mined.nonce + 1, timestamp=mined.timestamp)
+record = decode_block_body(encode_block_body(mined))._replace(nonce=unmined.nonce, sha256_hash=unmined.sha256_hash)
+try:
+    materialize_block(record, root)
+except ValueError:
+    print('rejected')
+"""
+
+
+def test_proof_of_work_checked_without_asserts():
+    # asserts are stripped under -O, the proof of work of received blocks must still be checked
+    web_chain = Path(__file__).parent.parent / 'web_chain'
+    result = subprocess.run([sys.executable, '-O', '-c', UNMINED_RECORD], capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': str(web_chain)}, check=True)
+    assert result.stdout.strip() == 'rejected'
@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+from zlib import crc32
+
+import pytest
+
+from chain_state import ChainState
+from chain_store import ChainStore, SEGMENT_HEADER, RECORD_LENGTH, RECORD_CRC
+from chain_validator import ChainValidator
+from entries import RootEntry, DocumentPublishEntry
+from mapped_chain import MappedChain
+from test_web_chain.test_chain_store import fill_chain, BYTES_32
+
+
+def test_chain_validator_incremental(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory)
+    state = ChainState(store)
+    fill_chain(state, 2)
+
+    validator = ChainValidator()
+    assert validator.validate(state.tail) == 2
+    assert validator.verified_hash == state.tail.sha256_hash
+
+    fill_chain(state, 1)
+    store.sync()
+    chain = MappedChain(directory)
+    # only the new block is walked, the walk stops at the verified block even though it is a different object
+    assert validator.validate(chain.tail) == 3
+    assert validator.verified_hash == state.tail.sha256_hash
+
+    with ChainValidator(workers=2, chunk_size=1) as parallel:
+        assert parallel.validate(chain.tail) == 3
+    store.close()
+
+
+def test_chain_validator_detects_tampering(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory)
+    fill_chain(ChainState(store), 2)
+    store.close()
+
+    segment, = store.segments()
+    data = bytearray(segment.read_bytes())
+    first_length, = RECORD_LENGTH.unpack_from(data, SEGMENT_HEADER.size)
+    offset = SEGMENT_HEADER.size + RECORD_LENGTH.size + first_length + RECORD_CRC.size
+    length, = RECORD_LENGTH.unpack_from(data, offset)
+    body_start = offset + RECORD_LENGTH.size
+    # flip the last byte of the last field in the second block and keep the record checksum valid
+    data[body_start + length - 1] ^= 0xff
+    RECORD_CRC.pack_into(data, body_start + length, crc32(data[body_start:body_start + length]))
+    segment.write_bytes(bytes(data))
+
+    validator = ChainValidator()
+    with pytest.raises(ValueError, match='height 2'):
+        validator.validate(MappedChain(directory).tail)
+    assert validator.verified_height == 1
+
+
+def test_entry_hash_does_not_recurse():
+    entry = RootEntry.get_instance()
+    for _ in range(sys.getrecursionlimit() * 2):
+        entry = DocumentPublishEntry(entry, BYTES_32, BYTES_32)
+    assert len(entry.sha256_hash) == 32
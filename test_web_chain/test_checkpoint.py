@@ -0,0 +1,201 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from fastecdsa import keys, curve
+
+from api import inclusion_proof
+from blocks import Block
+from chain_state import ChainState, mine_and_commit
+from chain_store import ChainStore
+from checkpoint import Checkpoint, Checkpointer, checkpoints, latest_checkpoint, load_signing_key
+from difficulty import FixedDifficulty
+from document_db import DocumentDatabase
+from document_store import DocumentStore
+from entries import DocumentPublishEntry
+from mapped_chain import MappedChain
+from poc import Node, create_app
+from sync import materialize_fork
+from validate import verify_inclusion
+from wire import decode_stream, encode_stream
+from test_web_chain.test_chain_store import fill_chain, BYTES_32, BYTES_64, IP_ADDRESS
+
+
+def _doc_id(i: int) -> bytes:
+    return i.to_bytes(length=32, byteorder='big')
+
+
+def _node(directory: Path, checkpoint=None, store=None) -> ChainState:
+    store = ChainStore(directory / 'chain', segment_size=512) if store is None else store
+    return ChainState(store, FixedDifficulty(8), DocumentDatabase(directory / 'index.sqlite3'), checkpoint)
+
+
+def test_checkpoint_every_interval(tmpdir):
+    directory = Path(tmpdir)
+    private_key, public_key = load_signing_key(directory / 'key.pem')
+    assert load_signing_key(directory / 'key.pem') == (private_key, public_key)
+    state = _node(directory)
+    checkpointer = Checkpointer(state, directory / 'checkpoints', private_key, interval=2, keep=2)
+    fill_chain(state, 7)
+    checkpointer.close()
+
+    assert [p.name for p in checkpoints(directory / 'checkpoints')] == ['000000000004.ckpt', '000000000006.ckpt']
+    checkpoint = latest_checkpoint(directory / 'checkpoints', [public_key])
+    assert checkpoint.height == 6
+    assert checkpoint.header.block_hash == state.block(6).sha256_hash
+    assert checkpoint.work == 6 * 2 ** 8
+    assert list(checkpoint.locations()) == [(BYTES_64, IP_ADDRESS), (BYTES_32, None)]
+    # the document published at height 7 is not in the snapshot taken at height 6
+    assert sorted(d for d, _, _, _ in checkpoint.documents()) == sorted([_doc_id(i) for i in range(5)] + [BYTES_32])
+
+    _, other_key = keys.gen_keypair(curve.P256)
+    assert latest_checkpoint(directory / 'checkpoints', [other_key]) is None
+
+
+def test_tampered_checkpoint(tmpdir):
+    directory = Path(tmpdir)
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    state = _node(directory)
+    fill_chain(state, 3)
+    path = Checkpointer(state, directory / 'checkpoints', private_key).checkpoint().result()
+    assert Checkpoint(path).verify([public_key])
+
+    data = bytearray(path.read_bytes())
+    data[100] ^= 0xff
+    path.write_bytes(bytes(data))
+    assert not Checkpoint(path).verify([public_key])
+    path.write_bytes(bytes(data[:20]))
+    with pytest.raises(ValueError):
+        Checkpoint(path)
+    assert latest_checkpoint(directory / 'checkpoints', [public_key]) is None
+
+
+def test_bootstrap_from_checkpoint(tmpdir):
+    source_dir, node_dir = Path(tmpdir) / 'source', Path(tmpdir) / 'node'
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    source = _node(source_dir)
+    fill_chain(source, 4)
+    path = Checkpointer(source, source_dir / 'checkpoints', private_key).checkpoint().result()
+    mine_and_commit(source, lambda previous: [DocumentPublishEntry(previous, _doc_id(9), BYTES_32)])
+
+    store = ChainStore(node_dir / 'chain', segment_size=512)
+    node = _node(node_dir, Checkpoint(path), store)
+    assert node.height == node.base_height == 4
+    assert node.tail.sha256_hash == source.block(4).sha256_hash
+    assert node.work == 4 * 2 ** 8
+    assert node.lookup(_doc_id(1)).height == 3
+    assert node.database.location(BYTES_64) == IP_ADDRESS
+    with pytest.raises(IndexError):
+        node.block(3)
+
+    # only the blocks after the checkpoint are needed
+    assert node.adopt(materialize_fork(node, list(decode_stream(encode_stream([source.block(5)], 5)))))
+    assert node.tail.sha256_hash == source.tail.sha256_hash
+    assert node.lookup(_doc_id(9)).height == 5
+    assert node.index.lookup(_doc_id(9)) is not None
+    assert node.index.lookup(_doc_id(1)) is None
+    mine_and_commit(node, lambda previous: [DocumentPublishEntry(previous, _doc_id(10), BYTES_32)])
+    store.close()
+    node.database.close()
+
+    # a restart loads the checkpoint and the blocks stored after it
+    restarted = _node(node_dir, Checkpoint(path))
+    assert restarted.height == 6
+    assert restarted.tail.sha256_hash == node.tail.sha256_hash
+    assert restarted.lookup(_doc_id(10)).height == 6
+    assert restarted.lookup(_doc_id(1)).height == 3
+
+
+def test_proof_after_checkpoint(tmpdir):
+    source_dir, node_dir = Path(tmpdir) / 'source', Path(tmpdir) / 'node'
+    private_key, _ = keys.gen_keypair(curve.P256)
+    source = _node(source_dir)
+    fill_chain(source, 4)
+    path = Checkpointer(source, source_dir / 'checkpoints', private_key).checkpoint().result()
+    mine_and_commit(source, lambda previous: [DocumentPublishEntry(previous, _doc_id(9), BYTES_32)])
+    store = ChainStore(node_dir / 'chain', segment_size=512)
+    node = _node(node_dir, Checkpoint(path), store)
+    assert node.adopt(materialize_fork(node, list(decode_stream(encode_stream([source.block(5)], 5)))))
+    store.close()
+
+    # the first stored block links back to the checkpoint's tail block, which the segment headers record
+    assert ChainStore(node_dir / 'chain').base_block.sha256_hash == source.block(4).sha256_hash
+    chain = MappedChain(node_dir / 'chain')
+    block = chain.block(5)
+    assert block.previous_block.sha256_hash == source.block(4).sha256_hash
+    assert block.entries[0].previous_entry.sha256_hash == source.block(4).entries[-1].sha256_hash
+    proof = inclusion_proof(_doc_id(9).hex(), block.entries[0], None, block, 0, 5)
+    assert verify_inclusion(proof.dict(), _doc_id(9).hex())
+    node.database.close()
+
+
+def test_restart_from_own_checkpoint(tmpdir):
+    directory = Path(tmpdir)
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    store = ChainStore(directory / 'chain', segment_size=512)
+    state = _node(directory, store=store)
+    checkpointer = Checkpointer(state, directory / 'checkpoints', private_key, interval=4)
+    fill_chain(state, 5)
+    checkpointer.close()
+    store.close()
+    state.database.close()
+
+    # every stored block is loaded again, only the ones above the checkpoint are verified
+    restarted = _node(directory, latest_checkpoint(directory / 'checkpoints', [public_key]))
+    assert restarted.base_height == 0
+    assert restarted.height == 5
+    assert [restarted.block(h).sha256_hash for h in range(1, 6)] == [state.block(h).sha256_hash for h in range(1, 6)]
+    assert restarted.index.lookup(_doc_id(0)).height == state.index.lookup(_doc_id(0)).height
+    # a fresh peer syncs from the first block
+    response = TestClient(create_app(Node(restarted, DocumentStore(directory / 'documents')))).get(
+        '/chain/blocks', params={'start': 1})
+    assert response.status_code == 200
+    assert len(materialize_fork(ChainState(difficulty=FixedDifficulty(8)),
+                                list(decode_stream([response.content])))) == 5
+
+
+def test_fork_below_checkpoint(tmpdir):
+    directory = Path(tmpdir)
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    store = ChainStore(directory / 'chain', segment_size=512)
+    state = _node(directory, store=store)
+    checkpointer = Checkpointer(state, directory / 'checkpoints', private_key, interval=4)
+    fill_chain(state, 4)
+    checkpointer.close()
+    assert [p.name for p in checkpoints(directory / 'checkpoints')] == ['000000000004.ckpt']
+
+    # a single block with more work than blocks 2 to 4 together
+    fork = Block(state.block(1), [DocumentPublishEntry(state.block(1).entries[-1], _doc_id(9), BYTES_32)],
+                 difficulty=12)
+    assert state.adopt([fork])
+    assert checkpoints(directory / 'checkpoints') == []
+    store.close()
+    state.database.close()
+
+    restarted = _node(directory, latest_checkpoint(directory / 'checkpoints', [public_key]))
+    assert restarted.height == 2
+    assert restarted.tail.sha256_hash == fork.sha256_hash
+    assert restarted.lookup(_doc_id(9)).height == 2
+
+
+def test_checkpoint_not_on_stored_chain(tmpdir):
+    source_dir, node_dir = Path(tmpdir) / 'source', Path(tmpdir) / 'node'
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    source = _node(source_dir)
+    fill_chain(source, 3)
+    path = Checkpointer(source, source_dir / 'checkpoints', private_key).checkpoint().result()
+
+    store = ChainStore(node_dir / 'chain', segment_size=512)
+    node = _node(node_dir, store=store)
+    mine_and_commit(node, lambda previous: [DocumentPublishEntry(previous, _doc_id(9), BYTES_32)])
+    mine_and_commit(node, lambda previous: [DocumentPublishEntry(previous, _doc_id(10), BYTES_32)])
+    store.close()
+    node.database.close()
+
+    # the store is kept rather than replaced by a checkpoint of another chain
+    store = ChainStore(node_dir / 'chain', segment_size=512)
+    assert latest_checkpoint(source_dir / 'checkpoints', [public_key], store) is None
+    with pytest.raises(ValueError):
+        _node(node_dir, Checkpoint(path), store)
+    assert store.height == 2
+    assert len(store.segments()) == 1
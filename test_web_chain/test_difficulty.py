@@ -0,0 +1,67 @@
+import pytest
+
+from blocks import RootBlock, Block
+from chain_state import ChainState, mine_and_commit
+from chain_utils import validate_block_hash, MIN_BLOCK_HASH_LEADING_ZEROS
+from difficulty import FixedDifficulty, RetargetingDifficulty
+from entries import DocumentPublishEntry
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+
+
+def _chain(intervals_ms, difficulty):
+    block = RootBlock.get_instance()
+    timestamp = 1_000_000
+    for interval in intervals_ms:
+        block = Block(block, [DocumentPublishEntry(block.entries[-1], BYTES_32, BYTES_32)], nonce=None,
+                      difficulty=difficulty, timestamp=timestamp)
+        timestamp += interval
+    return block
+
+
+def test_block_records_difficulty():
+    root = RootBlock.get_instance()
+    block = Block(root, [DocumentPublishEntry(root.entries[-1], BYTES_32, BYTES_32)], difficulty=4)
+    assert block.difficulty == 4
+    assert validate_block_hash(block.sha256_hash, 4)
+    assert block.timestamp > 0
+
+    # the difficulty and timestamp are part of the hash
+    same = Block(root, block.entries, difficulty=4, timestamp=block.timestamp)
+    assert same.sha256_hash == block.sha256_hash
+    assert Block(root, block.entries, difficulty=4, timestamp=block.timestamp + 1).sha256_hash != block.sha256_hash
+
+
+def test_validate_block_hash_range():
+    assert validate_block_hash(bytes(32), 64)
+    for difficulty in (-1, 65):
+        with pytest.raises(AssertionError):
+            validate_block_hash(bytes(32), difficulty)
+
+
+def test_retargeting_difficulty():
+    controller = RetargetingDifficulty(target_interval_ms=1_000, window=8, initial=12, minimum=8, max_step=2)
+    assert controller.next_difficulty(RootBlock.get_instance()) == 12
+
+    # blocks on target keep the difficulty
+    assert controller.next_difficulty(_chain([1_000] * 8, 10)) == 10
+    # blocks 4 times too fast add 2 bits, 16 times too fast are held to max_step
+    assert controller.next_difficulty(_chain([250] * 8, 10)) == 12
+    assert controller.next_difficulty(_chain([60] * 8, 10)) == 12
+    # blocks 2 times too slow remove a bit
+    assert controller.next_difficulty(_chain([2_000] * 8, 10)) == 9
+    assert RetargetingDifficulty(minimum=10).next_difficulty(_chain([10_000] * 8, 10)) == 10
+
+
+def test_difficulty_has_a_minimum():
+    for make in (lambda: FixedDifficulty(MIN_BLOCK_HASH_LEADING_ZEROS - 1),
+                 lambda: RetargetingDifficulty(minimum=0, initial=MIN_BLOCK_HASH_LEADING_ZEROS)):
+        with pytest.raises(AssertionError):
+            make()
+
+
+def test_mine_and_commit_uses_next_difficulty():
+    state = ChainState(difficulty=FixedDifficulty(9))
+    block, _ = mine_and_commit(state, lambda previous: [DocumentPublishEntry(previous, BYTES_32, BYTES_32)])
+    assert block.difficulty == 9
+    assert state.next_difficulty(block) == 9
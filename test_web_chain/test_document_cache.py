@@ -0,0 +1,19 @@
+from document_cache import ByteLRUCache
+
+
+def test_byte_lru_cache():
+    cache = ByteLRUCache(max_bytes=10, max_item_bytes=6)
+    assert cache.put(b'a', b'aaaa')
+    assert cache.put(b'b', b'bbbb')
+    assert not cache.put(b'c', b'c' * 7)
+    assert b'c' not in cache
+    assert cache.size == 8
+
+    assert cache.get(b'a') == b'aaaa'
+    # b is now the least recently used and is evicted to make room
+    assert cache.put(b'd', b'dddd')
+    assert b'b' not in cache
+    assert cache.get(b'b') is None
+    assert cache.size == 8
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from blocks import Block
+from chain_state import ChainState, mine_and_commit
+from chain_store import ChainStore
+from difficulty import FixedDifficulty
+from document_db import DocumentDatabase
+from entries import DocumentPublishEntry, DocumentUpdateEntry, HostLocationEntry
+from test_web_chain.test_chain_store import fill_chain, BYTES_32, BYTES_64, IP_ADDRESS
+
+
+def _doc_id(i: int) -> bytes:
+    return i.to_bytes(length=32, byteorder='big')
+
+
+def _publish_versions(state: ChainState):
+    def build_entries(previous):
+        host = HostLocationEntry(previous, IP_ADDRESS, BYTES_64)
+        publish = DocumentPublishEntry(host, _doc_id(1), BYTES_32)
+        return [host, publish, DocumentUpdateEntry(publish, _doc_id(1), _doc_id(2), BYTES_32)]
+    mine_and_commit(state, build_entries)
+    mine_and_commit(state, lambda previous: [DocumentUpdateEntry(previous, _doc_id(2), _doc_id(3), BYTES_32)])
+
+
+def test_document_database(tmpdir):
+    database = DocumentDatabase(Path(tmpdir) / 'index.sqlite3')
+    state = ChainState(difficulty=FixedDifficulty(8), database=database)
+    _publish_versions(state)
+
+    assert database.height == 2
+    assert len(database) == 3
+    row = database.lookup(_doc_id(2))
+    assert row.previous_doc_id == _doc_id(1)
+    assert row.height == 1
+    assert row.public_key == BYTES_32
+    assert row.ip_address is None
+    assert database.lookup(_doc_id(4)) is None
+    assert state.lookup(_doc_id(3)).height == 2
+    assert database.location(BYTES_64) == IP_ADDRESS
+    assert database.previous_versions(_doc_id(3)) == [_doc_id(3), _doc_id(2), _doc_id(1)]
+    assert database.previous_versions(_doc_id(3), max_versions=2) == [_doc_id(3), _doc_id(2)]
+    assert database.previous_versions(_doc_id(4)) == []
+
+    # every thread reads through its own connection
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        rows = list(pool.map(database.lookup, [_doc_id(i % 3 + 1) for i in range(32)]))
+    assert all(row is not None for row in rows)
+    database.close()
+
+
+def test_document_database_follows_chain_store(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory / 'chain')
+    database = DocumentDatabase(directory / 'index.sqlite3')
+    state = ChainState(store, FixedDifficulty(8), database)
+    fill_chain(state, 3)
+    store.close()
+
+    # reopening replays only the blocks the database is missing
+    reopened = DocumentDatabase(directory / 'index.sqlite3')
+    assert ChainState(ChainStore(directory / 'chain'), FixedDifficulty(8), reopened).height == 3
+    assert len(reopened) == 3
+
+    # a database ahead of the store drops the documents of the lost blocks
+    assert ChainState(difficulty=FixedDifficulty(8), database=reopened).height == 0
+    assert reopened.height == 0
+    assert len(reopened) == 0
+
+
+def test_branched_history(tmpdir):
+    database = DocumentDatabase(Path(tmpdir) / 'index.sqlite3')
+    state = ChainState(difficulty=FixedDifficulty(8), database=database)
+    _publish_versions(state)
+    # the second version is replaced a second time
+    mine_and_commit(state, lambda previous: [DocumentUpdateEntry(previous, _doc_id(2), _doc_id(4), BYTES_32)])
+
+    assert database.history(_doc_id(3)) == [_doc_id(1), _doc_id(2), _doc_id(3)]
+    assert database.history(_doc_id(4)) == [_doc_id(1), _doc_id(2), _doc_id(4)]
+    assert database.history(_doc_id(1)) == [_doc_id(1), _doc_id(2), _doc_id(4)]
+    # the in-memory index finds the same histories
+    for i in range(1, 5):
+        assert list(state.index.history(_doc_id(i))) == database.history(_doc_id(i))
+    database.close()
+
+
+def test_chain_state_caches_database_histories(tmpdir, monkeypatch):
+    database = DocumentDatabase(Path(tmpdir) / 'index.sqlite3')
+    state = ChainState(difficulty=FixedDifficulty(8), database=database)
+    _publish_versions(state)
+    reads = []
+    history = database.history
+    monkeypatch.setattr(database, 'history', lambda doc_id: reads.append(doc_id) or history(doc_id))
+
+    assert state.history(_doc_id(1)) == (_doc_id(1), _doc_id(2), _doc_id(3))
+    assert state.history(_doc_id(1)) == (_doc_id(1), _doc_id(2), _doc_id(3))
+    assert reads == [_doc_id(1)]
+
+    # a later version makes the cached history end elsewhere
+    mine_and_commit(state, lambda previous: [DocumentUpdateEntry(previous, _doc_id(3), _doc_id(4), BYTES_32)])
+    assert state.history(_doc_id(1)) == (_doc_id(1), _doc_id(2), _doc_id(3), _doc_id(4))
+
+    # a fork without that version drops it again
+    parent, fork = state.block(2), []
+    for i in (5, 6):
+        parent = Block(parent, [DocumentPublishEntry(parent.entries[-1], _doc_id(i), BYTES_32)], difficulty=8)
+        fork.append(parent)
+    assert state.adopt(fork)
+    assert state.history(_doc_id(1)) == (_doc_id(1), _doc_id(2), _doc_id(3))
+    assert len(reads) == 3
+    database.close()
+
+
+def test_database_written_without_chain_lock(tmpdir, monkeypatch):
+    database = DocumentDatabase(Path(tmpdir) / 'index.sqlite3')
+    state = ChainState(difficulty=FixedDifficulty(8), database=database)
+    locked = []
+    add_block = database.add_block
+    monkeypatch.setattr(database, 'add_block', lambda *args: locked.append(state.lock.locked()) or add_block(*args))
+    _publish_versions(state)
+
+    assert locked == [False, False]
+    assert database.height == 2
+    database.close()
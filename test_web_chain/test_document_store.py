@@ -0,0 +1,31 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from document_store import DocumentStore, SHARD_DEPTH
+
+
+def test_document_store(tmpdir):
+    store = DocumentStore(Path(tmpdir))
+    with pytest.raises(IndexError):
+        store.sample()
+
+    doc_ids = [i.to_bytes(length=70, byteorder='big') for i in range(50)]
+    for d in doc_ids:
+        assert d not in store
+        store.put(d, f'document {d.hex()}')
+    store.put(doc_ids[0], b'replaced')
+
+    for d in doc_ids[1:]:
+        assert store.exists(d)
+        assert store.get(d) == f'document {d.hex()}'.encode('utf8')
+        assert len(store.path(d).relative_to(tmpdir).parts) == SHARD_DEPTH + 1
+    assert store.get(doc_ids[0]) == b'replaced'
+    with pytest.raises(FileNotFoundError):
+        store.get(b'missing')
+
+    assert sorted(store) == sorted(doc_ids)
+    assert store.sample() in doc_ids
+    # documents are spread over shard directories rather than one flat directory
+    assert len(os.listdir(tmpdir)) > 1
@@ -94,3 +94,25 @@ def test_host_location_entry():
     assert entry_2.sha256_hash != entry_1.sha256_hash
     assert entry_2.public_key == BYTES_32
     assert entry_2.ipaddress == IP_ADDRESS
+
+
+def test_entries_are_compact():
+    public_key = BYTES_32[:16] + BYTES_32[16:]
+    assert public_key is not BYTES_32
+    entry_1 = DocumentPublishEntry(previous_entry=RootEntry.get_instance(), public_key=BYTES_32, doc_id=BYTES_32)
+    entry_2 = DocumentUpdateEntry(previous_entry=entry_1, public_key=public_key, doc_id=BYTES_32,
+                                  previous_doc_id=BYTES_32)
+    entry_3 = HostLocationEntry(previous_entry=entry_2, public_key=BYTES_32 + BYTES_32, ipaddress=IP_ADDRESS)
+    for entry in (RootEntry.get_instance(), entry_1, entry_2, entry_3):
+        assert not hasattr(entry, '__dict__')
+        with pytest.raises(AttributeError):
+            entry.unknown_attribute = 1
+
+    # publishers reuse a single public key, every entry references the same bytes object
+    assert entry_2.public_key is entry_1.public_key
+
+
+def test_interned_bytes_are_bounded():
+    for i in range(MAX_INTERNED + 1):
+        intern_bytes(i.to_bytes(32, 'big'))
+    assert intern_bytes.cache_info().currsize == MAX_INTERNED
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+from blocks import RootBlock
+from chain_index import ChainIndex
+from chain_state import ChainState
+from chain_store import ChainStore, SEGMENT_HEADER, SEGMENT_SUFFIX
+from entries import BaseDocumentEntry
+from mapped_chain import MappedChain, MappedDocumentPublishEntry, MappedDocumentUpdateEntry, MappedHostLocationEntry
+from test_web_chain.test_chain_store import fill_chain, BYTES_32, BYTES_64, IP_ADDRESS
+from test_web_chain.test_sync import extend, OTHER_32
+
+
+def test_mapped_chain(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store)
+    fill_chain(state, 3)
+    store.sync()
+
+    chain = MappedChain(directory)
+    assert chain.height == 3
+    assert chain.block(0) is RootBlock.get_instance()
+    assert chain.tail.sha256_hash == state.tail.sha256_hash
+    assert isinstance(chain.tail.sha256_hash, memoryview)
+
+    block = state.tail
+    mapped = chain.tail
+    while block is not RootBlock.get_instance():
+        assert mapped.sha256_hash == block.sha256_hash
+        assert mapped.nonce == block.nonce
+        assert [e.sha256_hash for e in mapped.entries] == [e.sha256_hash for e in block.entries]
+        assert mapped.entries[0].previous_entry.sha256_hash == block.entries[0].previous_entry.sha256_hash
+        block, mapped = block.previous_block, mapped.previous_block
+    assert mapped is RootBlock.get_instance()
+
+    host = chain.block(1).entries[0]
+    assert isinstance(host, MappedHostLocationEntry)
+    assert host.ipaddress == IP_ADDRESS
+    assert host.public_key == BYTES_64
+    assert host.previous_entry is RootBlock.get_instance().entries[-1]
+    publish, update = chain.block(2).entries
+    assert isinstance(publish, MappedDocumentPublishEntry) and isinstance(update, MappedDocumentUpdateEntry)
+    assert isinstance(update, BaseDocumentEntry)
+    assert publish.doc_id == (0).to_bytes(length=32, byteorder='big')
+    assert update.previous_doc_id == publish.doc_id
+    assert update.doc_id == BYTES_32
+    assert update.public_key == BYTES_32
+
+    fill_chain(state, 2)
+    store.sync()
+    chain.refresh()
+    assert chain.height == 5
+    assert chain.tail.sha256_hash == state.tail.sha256_hash
+
+    index = ChainIndex()
+    for height, mapped in enumerate(chain.blocks(), start=1):
+        index.add_block(mapped, height)
+    assert index.lookup(BYTES_32).height == 5
+    store.close()
+
+
+def test_refresh_after_fork(tmpdir):
+    directory = Path(tmpdir)
+    store = ChainStore(directory, segment_size=512)
+    state = ChainState(store)
+    fill_chain(state, 3)
+    store.sync()
+    chain = MappedChain(directory)
+    old_tail = chain.tail
+    old_hash = bytes(state.tail.sha256_hash)
+
+    # the store replaces its segments when the chain switches to a fork branching off after the first block
+    fork = ChainState()
+    assert fork.compare_and_swap(fork.tail, state.block(1))
+    extend(fork, 3, OTHER_32)
+    assert state.adopt([fork.block(h) for h in (2, 3, 4)])
+    store.sync()
+    chain.refresh()
+    assert chain.height == 4
+    assert [bytes(b.sha256_hash) for b in chain.blocks()] == [bytes(fork.block(h).sha256_hash) for h in range(1, 5)]
+    # a block read before the fork still reads the segment it was mapped from
+    assert old_tail.sha256_hash == old_hash
+    store.close()
+
+
+def test_refresh_before_segments_are_written(tmpdir):
+    directory = Path(tmpdir) / 'chain'
+    chain = MappedChain(directory)
+    assert chain.height == 0
+
+    # the writer has created the first segment, its header is not written or not on disk yet
+    directory.mkdir()
+    segment = directory / f'{1:012d}{SEGMENT_SUFFIX}'
+    segment.touch()
+    chain.refresh()
+    assert chain.height == 0
+    segment.write_bytes(bytes(SEGMENT_HEADER.size))
+    chain.refresh()
+    assert chain.height == 0
+    segment.unlink()
+
+    store = ChainStore(directory, segment_size=512)
+    fill_chain(ChainState(store), 3)
+    store.close()
+    (directory / f'{4:012d}{SEGMENT_SUFFIX}').touch()
+    chain.refresh()
+    assert chain.height == 3
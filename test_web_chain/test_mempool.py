@@ -0,0 +1,68 @@
+from time import monotonic
+
+from chain_state import ChainState
+from entries import DocumentPublishEntry
+from mempool import Mempool, BlockSealer
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+
+
+def publish_factory(doc_id: bytes):
+    return lambda previous: DocumentPublishEntry(previous, doc_id, BYTES_32)
+
+
+def test_mempool_batches_by_size():
+    mempool = Mempool(max_entries=2, max_wait_ms=60_000)
+    futures = mempool.submit_many(publish_factory(BYTES_32) for _ in range(5))
+    assert len(mempool) == 5
+    assert [f for _, f in mempool.take()] == futures[:2]
+    assert [f for _, f in mempool.take()] == futures[2:4]
+    mempool.close()
+    assert [f for _, f in mempool.take()] == futures[4:]
+    assert mempool.take() == []
+
+
+def test_mempool_batches_by_latency():
+    mempool = Mempool(max_entries=100, max_wait_ms=50)
+    future = mempool.submit(publish_factory(BYTES_32))
+    start = monotonic()
+    assert [f for _, f in mempool.take()] == [future]
+    assert monotonic() - start >= 0.04
+
+
+def test_block_sealer():
+    state = ChainState()
+    mempool = Mempool(max_entries=3, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+    doc_ids = [i.to_bytes(length=32, byteorder='big') for i in range(7)]
+    futures = mempool.submit_many(publish_factory(d) for d in doc_ids)
+    sealer.start()
+    blocks = [f.result() for f in futures]
+    mempool.close()
+    sealer.join()
+
+    assert sealer.blocks_sealed == 3
+    assert sealer.entries_sealed == 7
+    assert state.height == 3
+    assert [len(b.entries) for b in dict.fromkeys(blocks)] == [3, 3, 1]
+    for d, block in zip(doc_ids, blocks):
+        record = state.index.lookup(d)
+        assert record.block is block
+        assert record.entry in block.entries
+
+
+def test_block_sealer_survives_failed_batch():
+    state = ChainState()
+    mempool = Mempool(max_entries=1, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+
+    def failing(previous):
+        raise ValueError('invalid entry')
+    failed = mempool.submit(failing)
+    sealed = mempool.submit(publish_factory(BYTES_32))
+    sealer.start()
+    assert isinstance(failed.exception(), ValueError)
+    assert sealed.result() is state.tail
+    mempool.close()
+    sealer.join()
+    assert sealer.blocks_sealed == 1
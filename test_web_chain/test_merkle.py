@@ -0,0 +1,24 @@
+import pytest
+
+from merkle import MerkleTree, merkle_root, proof_root, EMPTY_ROOT
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 13])
+def test_merkle_proofs(size):
+    values = [i.to_bytes(length=32, byteorder='big') for i in range(size)]
+    tree = MerkleTree(values)
+    assert tree.root == merkle_root(values)
+    for ix, value in enumerate(values):
+        proof = tree.proof(ix)
+        assert len(proof) <= (size - 1).bit_length()
+        assert proof_root(value, proof) == tree.root
+        assert proof_root(b'another value', proof) != tree.root
+    with pytest.raises(IndexError):
+        tree.proof(size)
+
+
+def test_merkle_root_distinguishes_sequences():
+    a, b, c = (bytes([i]) * 32 for i in range(3))
+    assert merkle_root([a, b, c]) != merkle_root([a, b, c, c])
+    assert merkle_root([a, b]) != merkle_root([b, a])
+    assert merkle_root([]) == EMPTY_ROOT
@@ -0,0 +1,52 @@
+from threading import Event, Thread
+
+from metrics import Counter, Histogram, Gauge, Registry, SamplingProfiler
+
+
+def test_render_metrics():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', 'Requests served', ('status',)))
+    latency = registry.register(Histogram('latency_seconds', 'Request latency', buckets=(0.1, 1.0)))
+    registry.register(Gauge('height', 'Chain height', lambda: 3))
+
+    requests.inc(labels=('200',))
+    requests.inc(2, labels=('404',))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{status="200"} 1' in lines
+    assert 'requests_total{status="404"} 2' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+    assert 'latency_seconds_sum 5.55' in lines
+    assert 'height 3.0' in lines
+    assert latency.count() == 3
+
+
+def test_sampling_profiler():
+    stop = Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1_000))
+
+    thread = Thread(target=busy_loop)
+    thread.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    assert profiler.running
+    while profiler.samples < 20:
+        stop.wait(0.01)
+    report = profiler.stop()
+    stop.set()
+    thread.join()
+
+    assert not profiler.running
+    assert 'busy_loop' in report
+    stack, count = report.splitlines()[0].rsplit(' ', 1)
+    assert int(count) > 0
@@ -0,0 +1,24 @@
+from hashlib import sha256
+
+from blocks import RootBlock, Block
+from chain_utils import search_nonce, block_hash_payload, validate_block_hash, MIN_INT
+from entries import RootEntry, DocumentPublishEntry
+from mining import ParallelMiner
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+
+
+def test_parallel_miner():
+    entry = DocumentPublishEntry(previous_entry=RootEntry.get_instance(), doc_id=BYTES_32, public_key=BYTES_32)
+    serial_block = Block(previous_block=RootBlock.get_instance(), entries=[entry], timestamp=1)
+    payload = block_hash_payload(serial_block)
+
+    with ParallelMiner(workers=2, chunk_size=2 ** 12) as miner:
+        nonce, hash_value = miner.search(payload)
+        assert (nonce, hash_value) == search_nonce(sha256(payload), MIN_INT, nonce + 1)
+        assert validate_block_hash(hash_value)
+        assert miner.search(payload, MIN_INT, nonce) is None
+
+        parallel_block = Block(previous_block=RootBlock.get_instance(), entries=[entry], miner=miner, timestamp=1)
+        assert parallel_block.sha256_hash == serial_block.sha256_hash
+        assert parallel_block.nonce == serial_block.nonce
@@ -0,0 +1,50 @@
+from hashlib import sha256
+
+import pytest
+
+from chain_utils import search_nonce, MIN_INT, NONCE_BATCH_SIZE
+
+PAYLOAD = (1234567890).to_bytes(length=32, byteorder='big') * 4
+# no hash in the range meets this difficulty, so every kernel does exactly NUM_ATTEMPTS attempts
+UNREACHABLE_DIFFICULTY = 64
+NUM_ATTEMPTS = 2 ** 17
+
+
+def reference_search_nonce(hash_builder, start: int, stop: int, difficulty: int):
+    """
+    The mining loop before it was batched, kept to check and measure the batched kernel against
+    """
+    for nonce in range(start, stop):
+        _hash_builder = hash_builder.copy()
+        _hash_builder.update(nonce.to_bytes(length=8, byteorder='big', signed=True))
+        hash_value = _hash_builder.digest()
+        zero_byte_length = difficulty // 8
+        if any(hash_value[i] != 0 for i in range(zero_byte_length)):
+            continue
+        zero_bit_length = difficulty % 8
+        if (hash_value[zero_byte_length] >> (8 - zero_bit_length)) == 0:
+            return nonce, hash_value
+    return None
+
+
+@pytest.mark.parametrize('start', [MIN_INT, -NONCE_BATCH_SIZE - 7, NONCE_BATCH_SIZE - 5, 0])
+@pytest.mark.parametrize('difficulty', [0, 3, 8, 12])
+def test_search_nonce_matches_reference(start, difficulty):
+    hash_builder = sha256(PAYLOAD)
+    stop = start + 2 * NONCE_BATCH_SIZE
+    assert search_nonce(hash_builder, start, stop, difficulty) == \
+           reference_search_nonce(hash_builder, start, stop, difficulty)
+    # a range ending inside a batch is not searched past its end
+    found, _ = search_nonce(hash_builder, start, stop, difficulty)
+    assert search_nonce(hash_builder, start, found, difficulty) is None
+
+
+@pytest.mark.parametrize('kernel', [search_nonce, reference_search_nonce], ids=['batched', 'reference'])
+def test_benchmark_mining_kernel(benchmark, kernel):
+    benchmark.group = 'mining kernel'
+    benchmark.extra_info['attempts'] = NUM_ATTEMPTS
+    result = benchmark.pedantic(kernel, args=(sha256(PAYLOAD), 0, NUM_ATTEMPTS, UNREACHABLE_DIFFICULTY), rounds=3)
+    assert result is None
+    # no stats are kept when the suite runs with --benchmark-disable
+    if benchmark.stats:
+        benchmark.extra_info['hashes_per_second'] = NUM_ATTEMPTS / benchmark.stats.stats.mean
@@ -1,7 +1,23 @@
+import os
 from pathlib import Path
 
+from fastapi.testclient import TestClient
+
+from chain_state import ChainState, mine_and_commit
+from entries import DocumentPublishEntry
+from publisher_thread import WebChainThread
+from web_chain import poc
 from web_chain.blocks import RootBlock
-from web_chain.poc import WebChainThread, ChainState
+from web_chain.document_cache import ByteLRUCache
+from web_chain.document_db import DocumentDatabase
+from web_chain.document_store import DocumentStore
+from web_chain.mempool import Mempool, BlockSealer
+from web_chain.write_behind import DocumentWriter
+from test_web_chain.test_chain_state import fork
+
+
+def _client(state, document_store, **kwargs) -> TestClient:
+    return TestClient(poc.create_app(poc.Node(state, document_store, **kwargs)))
 
 
 def test_chain_thread(tmpdir):
@@ -11,3 +27,285 @@ def test_chain_thread(tmpdir):
     thread.join()
 
     assert state.tail is not RootBlock.get_instance()
+
+
+def test_chain_state_index(tmpdir):
+    state = ChainState()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=2)
+    thread.start()
+    thread.join()
+
+    assert state.height == 3
+    assert len(state.index) == 2
+    for d in DocumentStore(Path(tmpdir)):
+        record = state.index.lookup(d)
+        assert record is not None
+        assert record.height > 1
+        assert record.block.entries[-1] is record.entry
+
+
+def test_chain_thread_mempool(tmpdir):
+    state = ChainState()
+    mempool = Mempool(max_entries=8, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+    sealer.start()
+    threads = [WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=3, mempool=mempool)
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    mempool.close()
+    sealer.join()
+
+    assert sealer.entries_sealed == 8
+    assert state.height == sealer.blocks_sealed
+    assert len(state.index) == 6
+
+
+def test_get_document(tmpdir):
+    state = ChainState()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=1)
+    thread.start()
+    thread.join()
+    store = DocumentStore(Path(tmpdir))
+    doc_id, = store
+    d = doc_id.hex()
+    document_cache = ByteLRUCache(max_bytes=4096, max_item_bytes=1024)
+    client = _client(state, store, document_cache=document_cache)
+    contents = store.get(doc_id).decode('utf8')
+
+    response = client.get('/', params={'doc_id': d})
+    assert response.status_code == 200
+    assert response.text == contents
+    assert response.headers['ETag'] == d
+    assert response.headers['X-Public-Key'] == thread.public_key_pem.hex()
+    assert document_cache.misses == 1
+
+    # served from the cache once the file is gone
+    os.remove(store.path(doc_id))
+    assert client.get('/', params={'doc_id': d}).text == contents
+    assert document_cache.hits == 1
+
+    response = client.get('/', params={'doc_id': d}, headers={'If-None-Match': f'"{d}"'})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == d
+
+    response = client.get('/', params={'doc_id': '<script>'})
+    assert response.status_code == 404
+    assert '&lt;script&gt;' in response.text
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    metrics = response.text.splitlines()
+    assert 'webchain_index_lookups_total{result="miss"} 1' in metrics
+    assert 'webchain_chain_height 2.0' in metrics
+    assert any(line.startswith('webchain_mining_attempts_total{thread=') for line in metrics)
+    assert 'webchain_document_read_seconds_count 1' in metrics
+
+
+def test_get_document_streams_large_files(tmpdir):
+    state = ChainState()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=1)
+    thread.start()
+    thread.join()
+    store = DocumentStore(Path(tmpdir))
+    doc_id, = store
+    contents = 'x' * (3 * poc.STREAM_CHUNK_SIZE)
+    store.put(doc_id, contents)
+    document_cache = ByteLRUCache(max_bytes=4096, max_item_bytes=1024)
+
+    response = _client(state, store, document_cache=document_cache).get('/', params={'doc_id': doc_id.hex()})
+    assert response.status_code == 200
+    assert response.text == contents
+    assert len(document_cache) == 0
+
+
+def test_chain_thread_write_behind(tmpdir):
+    state = ChainState()
+    store = DocumentStore(Path(tmpdir))
+    writer = DocumentWriter(store)
+    mempool = Mempool(max_entries=4, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+    writer.start()
+    sealer.start()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=3, mempool=mempool,
+                            writer=writer)
+    thread.start()
+    thread.join()
+    writer.close()
+    mempool.close()
+    sealer.join()
+
+    assert writer.documents_written == 3
+    assert len(state.index) == 3
+    for d in store:
+        assert d in state.index
+
+
+def test_chain_thread_full_mempool_does_not_stall_the_writer(tmpdir):
+    state = ChainState()
+    store = DocumentStore(Path(tmpdir))
+    writer = DocumentWriter(store)
+    # the host location fills the mempool, the thread blocks publishing its first document
+    mempool = Mempool(max_entries=1, max_pending=1)
+    sealer = BlockSealer(state, mempool)
+    writer.start()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=3, mempool=mempool,
+                            writer=writer)
+    thread.start()
+    try:
+        assert writer.submit(bytes(32), 'other').result(timeout=5) is not None
+        sealer.start()
+        thread.join()
+    finally:
+        # unblocks whoever waits for the mempool when the writer did stall
+        mempool.close()
+    if sealer.is_alive():
+        sealer.join()
+    writer.close()
+
+    assert len(state.index) == 3
+
+
+def test_publish_documents(tmpdir):
+    state = ChainState(database=DocumentDatabase(Path(tmpdir) / 'index.sqlite3'))
+    store = DocumentStore(Path(tmpdir) / 'documents')
+    mempool = Mempool(max_entries=8, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+    sealer.start()
+    node = poc.Node(state, store, mempool=mempool)
+    client = TestClient(poc.create_app(node))
+
+    documents = [f'document {i}' for i in range(20)]
+    try:
+        response = client.post('/documents', json={'documents': documents})
+    finally:
+        mempool.close()
+        sealer.join()
+    assert response.status_code == 200
+    published = response.json()['documents']
+    assert len(published) == 20
+    # 20 documents are sealed into 3 blocks of at most 8 entries rather than 20 blocks
+    assert sealer.blocks_sealed == 3
+    assert {p['height'] for p in published} == {1, 2, 3}
+    for contents, p in zip(documents, published):
+        response = client.get('/', params={'doc_id': p['doc_id']})
+        assert response.text == contents
+        assert response.headers['X-Public-Key'] == node.publisher_public_key_pem.hex()
+
+    assert client.post('/documents', json={'documents': []}).json() == {'documents': []}
+
+
+def test_publish_documents_dropped_by_reorg(tmpdir):
+    state = ChainState()
+    compare_and_swap = state.compare_and_swap
+
+    def then_reorg(expected_tail, block):
+        # a peer's longer chain replaces the block the documents were sealed into as soon as it is committed
+        committed = compare_and_swap(expected_tail, block)
+        if committed:
+            assert state.adopt(fork(state.block(0), 2, (1).to_bytes(length=32, byteorder='big')))
+        return committed
+
+    state.compare_and_swap = then_reorg
+    mempool = Mempool(max_entries=8, max_wait_ms=50)
+    sealer = BlockSealer(state, mempool)
+    sealer.start()
+    client = _client(state, DocumentStore(Path(tmpdir)), mempool=mempool)
+    try:
+        response = client.post('/documents', json={'documents': ['document']})
+    finally:
+        mempool.close()
+        sealer.join()
+    assert response.status_code == 409
+
+
+def test_get_versions(tmpdir):
+    # poc imports its modules by name, the entries must be the classes its index checks for
+    from entries import DocumentUpdateEntry
+    state = ChainState()
+    doc_ids = [i.to_bytes(length=32, byteorder='big') for i in range(3)]
+    public_key = (1234567890).to_bytes(length=32, byteorder='big')
+
+    def build_entries(previous):
+        publish = DocumentPublishEntry(previous, doc_ids[0], public_key)
+        return [publish, DocumentUpdateEntry(publish, doc_ids[0], doc_ids[1], public_key)]
+    mine_and_commit(state, build_entries)
+    mine_and_commit(state, lambda previous: [DocumentUpdateEntry(previous, doc_ids[1], doc_ids[2], public_key)])
+    client = _client(state, DocumentStore(Path(tmpdir)))
+
+    response = client.get('/versions', params={'doc_id': doc_ids[1].hex()})
+    assert response.status_code == 200
+    assert response.json() == {
+        'doc_id': doc_ids[1].hex(),
+        'latest': {'doc_id': doc_ids[2].hex(), 'height': 2},
+        'versions': [{'doc_id': doc_ids[0].hex(), 'height': 1}, {'doc_id': doc_ids[1].hex(), 'height': 1},
+                     {'doc_id': doc_ids[2].hex(), 'height': 2}],
+    }
+    response = client.get('/versions/latest', params={'doc_id': doc_ids[0].hex()})
+    assert response.json() == {'doc_id': doc_ids[2].hex(), 'height': 2}
+    assert client.get('/versions', params={'doc_id': 'not hex'}).status_code == 404
+    assert client.get('/versions/latest', params={'doc_id': (7).to_bytes(32, 'big').hex()}).status_code == 404
+
+
+def test_get_proof(tmpdir):
+    from validate import verify_inclusion
+
+    state = ChainState()
+    thread = WebChainThread(chain_state=state, storage_dir=Path(tmpdir), num_blocks_to_gen=1)
+    thread.start()
+    thread.join()
+    doc_id, = DocumentStore(Path(tmpdir))
+    d = doc_id.hex()
+    client = _client(state, DocumentStore(Path(tmpdir)))
+
+    response = client.get('/proof', params={'doc_id': d})
+    assert response.status_code == 200
+    proof = response.json()
+    assert proof['height'] == 2
+    assert proof['block_hash'] == state.tail.sha256_hash.hex()
+    assert verify_inclusion(proof, d)
+    assert not verify_inclusion(proof, (7).to_bytes(32, 'big').hex())
+    assert not verify_inclusion(dict(proof, public_key=(7).to_bytes(32, 'big').hex()), d)
+    assert not verify_inclusion(dict(proof, timestamp=proof['timestamp'] + 1), d)
+    assert client.get('/proof', params={'doc_id': 'not hex'}).status_code == 404
+
+
+def test_chain_blocks(tmpdir):
+    from sync import PeerSync
+    from wire import decode_stream
+
+    source = ChainState()
+    for _ in range(3):
+        mine_and_commit(source, lambda previous: [DocumentPublishEntry(previous, previous.sha256_hash, bytes(32))])
+    state = ChainState()
+    client = _client(source, DocumentStore(Path(tmpdir)), peer_sync=PeerSync(state, []))
+
+    head = client.get('/chain/head').json()
+    assert head == {'height': 3, 'hash': source.tail.sha256_hash.hex(), 'work': source.work}
+    response = client.get('/chain/blocks', params={'start': 2, 'stop': 10})
+    assert response.headers['Content-Type'] == 'application/octet-stream'
+    assert [r.sha256_hash for r in decode_stream([response.content])] == [source.block(h).sha256_hash for h in (2, 3)]
+    assert client.get('/chain/blocks', params={'start': 0}).status_code == 400
+
+    # blocks posted by a peer are appended to this node's chain
+    blocks = client.get('/chain/blocks', params={'start': 1}).content
+    response = client.post('/chain/blocks', content=blocks)
+    assert response.text == 'appended'
+    assert state.tail.sha256_hash == source.tail.sha256_hash
+
+
+def test_import_creates_nothing(tmp_path, monkeypatch):
+    monkeypatch.setenv('WEBCHAIN_CHAIN_DIR', str(tmp_path / 'chain'))
+    monkeypatch.setenv('WEBCHAIN_PUBLISHERS', '0')
+    monkeypatch.setenv('WEBCHAIN_MINING_WORKERS', '1')
+    monkeypatch.setenv('WEBCHAIN_SIGNING_WORKERS', '1')
+    app = poc.create_app()
+    assert not (tmp_path / 'chain').exists()
+
+    # the node is built from the environment when the server starts
+    with TestClient(app) as client:
+        assert client.get('/chain/head').json()['height'] == 0
+    assert (tmp_path / 'chain' / 'index.sqlite3').exists()
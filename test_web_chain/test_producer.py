@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from chain_state import ChainState
+from chain_utils import public_key_bytes
+from document_store import DocumentStore
+from entries import DocumentPublishEntry, HostLocationEntry
+from mempool import Mempool, BlockSealer
+from producer import Producer, ProducerGroup
+from write_behind import DocumentWriter
+
+
+def _published(state: ChainState):
+    return [e for h in range(1, state.height + 1) for e in state.block(h).entries
+            if isinstance(e, DocumentPublishEntry)]
+
+
+def _run(state: ChainState, mempool: Mempool, coroutine):
+    sealer = BlockSealer(state, mempool)
+    sealer.start()
+    try:
+        return asyncio.run(coroutine)
+    finally:
+        mempool.close()
+        sealer.join()
+
+
+def test_producer(tmpdir):
+    state = ChainState()
+    mempool = Mempool(max_entries=4, max_wait_ms=20)
+    document_store = DocumentStore(Path(tmpdir))
+    writer = DocumentWriter(document_store)
+    writer.start()
+    with ThreadPoolExecutor(max_workers=2) as signing_executor:
+        producers = [Producer(document_store, mempool, signing_executor, writer, num_documents=5, max_in_flight=2)
+                     for _ in range(2)]
+
+        async def produce():
+            await asyncio.gather(*(p.run() for p in producers))
+
+        _run(state, mempool, produce())
+    writer.close()
+
+    assert [p.published for p in producers] == [5, 5]
+    hosts = [e for h in range(1, state.height + 1) for e in state.block(h).entries if isinstance(e, HostLocationEntry)]
+    assert len(hosts) == 2
+    # hosts publish their public key, the x then the y coordinate of its point
+    assert sorted(h.public_key for h in hosts) == sorted(public_key_bytes(p.public_key) for p in producers)
+    assert all(p.public_key_bytes[:32] == p.public_key.x.to_bytes(32, 'little') for p in producers)
+    published = _published(state)
+    assert len(published) == 10
+    # every document is committed, and on disk, by the time its producer returns
+    for entry in published:
+        assert state.lookup(entry.doc_id) is not None
+        assert document_store.path(entry.doc_id).exists()
+
+
+def test_full_mempool_does_not_stall_the_writer(tmpdir):
+    state = ChainState()
+    # the host location fills the mempool, nothing is sealed until the writer has been checked
+    mempool = Mempool(max_entries=1, max_pending=1)
+    document_store = DocumentStore(Path(tmpdir))
+    writer = DocumentWriter(document_store)
+    writer.start()
+    sealer = BlockSealer(state, mempool)
+    with ThreadPoolExecutor(max_workers=1) as signing_executor:
+        producer = Producer(document_store, mempool, signing_executor, writer, num_documents=3, max_in_flight=4)
+
+        async def produce():
+            task = asyncio.create_task(producer.run())
+            while producer.published < 3:
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(asyncio.wrap_future(writer.submit(bytes(32), 'other')), timeout=5)
+            sealer.start()
+            await task
+
+        try:
+            asyncio.run(produce())
+        finally:
+            # unblocks whoever waits for the mempool when the writer did stall
+            mempool.close()
+    if sealer.is_alive():
+        sealer.join()
+    writer.close()
+
+    assert len(_published(state)) == 3
+
+
+def test_producer_group_stops_gracefully(tmpdir):
+    state = ChainState()
+    mempool = Mempool(max_entries=8, max_wait_ms=20)
+    document_store = DocumentStore(Path(tmpdir))
+    with ThreadPoolExecutor(max_workers=2) as signing_executor:
+        group = ProducerGroup([Producer(document_store, mempool, signing_executor, max_in_flight=4)
+                               for _ in range(3)])
+
+        async def produce():
+            await group.start()
+            await asyncio.sleep(0.5)
+            await group.stop()
+
+        _run(state, mempool, produce())
+
+    published = _published(state)
+    assert len(published) == sum(p.published for p in group.producers) > 0
+    assert all(state.lookup(e.doc_id) is not None for e in published)
+
+
+def test_producer_group_cancels_after_timeout(tmpdir):
+    state = ChainState()
+    # nothing seals the mempool's entries, producers block waiting for their commits
+    mempool = Mempool(max_entries=8, max_wait_ms=20)
+    with ThreadPoolExecutor(max_workers=1) as signing_executor:
+        producer = Producer(DocumentStore(Path(tmpdir)), mempool, signing_executor, max_in_flight=2)
+        group = ProducerGroup([producer], shutdown_timeout=0.2)
+
+        async def produce():
+            await group.start()
+            await asyncio.sleep(0.2)
+            await group.stop()
+
+        asyncio.run(produce())
+    mempool.close()
+
+    # backpressure held the producer at max_in_flight entries waiting to be committed, its host location and a document
+    assert producer.published == 1
+    assert state.height == 0
@@ -0,0 +1,147 @@
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+from blocks import RootBlock, Block
+from chain_state import ChainState
+from chain_utils import MIN_BLOCK_HASH_LEADING_ZEROS
+from entries import DocumentPublishEntry
+from chain_store import frame_record
+from document_store import DocumentStore
+from poc import Node, create_app
+from sync import PeerSync, materialize_fork
+from wire import encode_stream, decode_stream, STREAM_HEADER, STREAM_MAGIC, STREAM_VERSION
+
+BYTES_32 = (1234567890).to_bytes(length=32, byteorder='big')
+OTHER_32 = (1).to_bytes(length=32, byteorder='big')
+
+
+def extend(state: ChainState, num_blocks: int, doc_id: bytes = BYTES_32):
+    for _ in range(num_blocks):
+        tail = state.tail
+        assert state.compare_and_swap(tail, Block(tail, [DocumentPublishEntry(tail.entries[-1], doc_id, BYTES_32)]))
+
+
+def stream(state: ChainState, *heights: int) -> bytes:
+    return b''.join(encode_stream([state.block(h) for h in heights], heights[0]))
+
+
+def test_materialize_fork():
+    state = ChainState()
+    extend(state, 3)
+    blocks = [state.block(h) for h in (1, 2, 3)]
+    records = list(decode_stream([stream(state, 1, 2, 3)]))
+    assert [r.sha256_hash for r in records] == [b.sha256_hash for b in blocks]
+
+    other = ChainState()
+    materialized = materialize_fork(other, records)
+    assert [b.sha256_hash for b in materialized] == [b.sha256_hash for b in blocks]
+    assert materialized[0].previous_block is RootBlock.get_instance()
+
+
+def test_receive_gossip():
+    sender, receiver = ChainState(), ChainState()
+    sync = PeerSync(receiver, [])
+    extend(sender, 2)
+
+    assert sync.receive(stream(sender, 2)) == 'unknown parent'
+    assert sync.receive(stream(sender, 1)) == 'appended'
+    assert sync.receive(stream(sender, 2)) == 'appended'
+    assert sync.receive(stream(sender, 2)) == 'known'
+    assert receiver.height == 2
+    assert receiver.tail.sha256_hash == sender.tail.sha256_hash
+    assert receiver.index.lookup(BYTES_32) is not None
+
+    corrupt = bytearray(stream(sender, 1))
+    corrupt[-1] ^= 0xff
+    assert sync.receive(bytes(corrupt)) == 'invalid'
+
+
+def test_receive_fork():
+    a, b = ChainState(), ChainState()
+    sync = PeerSync(a, [])
+    extend(a, 2)
+    extend(b, 3, OTHER_32)
+    fork = stream(b, 1, 2, 3)
+
+    # b's chain has more work so a switches to it, a shorter fork is ignored
+    assert sync.receive(stream(b, 1)) == 'ignored'
+    assert sync.receive(fork) == 'adopted'
+    assert a.tail.sha256_hash == b.tail.sha256_hash
+    assert a.index.lookup(BYTES_32) is None
+    assert a.index.lookup(OTHER_32).height == 3
+
+
+def test_receive_short_record():
+    sender, receiver = ChainState(), ChainState()
+    sync = PeerSync(receiver, [])
+    extend(sender, 1)
+    # a well framed record whose body is shorter than the block header
+    short = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, 1) + frame_record(b'\x00' * 8)
+    assert sync.receive(short) == 'invalid'
+
+
+def test_poll_survives_failing_peer():
+    sync = PeerSync(ChainState(), ['http://a', 'http://b'], poll_interval=0)
+    polled = []
+
+    async def sync_with(peer):
+        polled.append(peer)
+        if peer == 'http://a':
+            raise RuntimeError('unexpected reply')
+        return False
+    sync.sync_with = sync_with
+
+    async def poll_twice():
+        poller = asyncio.create_task(sync._poll())
+        while len(polled) < 4:
+            await asyncio.sleep(0)
+        poller.cancel()
+    asyncio.run(asyncio.wait_for(poll_twice(), timeout=5))
+    assert polled[:4] == ['http://a', 'http://b', 'http://a', 'http://b']
+
+
+def test_receive_syncs_only_with_configured_peers(monkeypatch):
+    sender, receiver = ChainState(), ChainState()
+    sync = PeerSync(receiver, ['http://peer'])
+    scheduled = []
+    monkeypatch.setattr(sync, 'is_alive', lambda: True)
+    monkeypatch.setattr(sync, 'sync_with', lambda peer: peer)
+    monkeypatch.setattr(asyncio, 'run_coroutine_threadsafe', lambda coroutine, loop: scheduled.append(coroutine))
+    extend(sender, 2)
+
+    assert sync.receive(stream(sender, 2), 'http://169.254.169.254') == 'unknown parent'
+    assert sync.receive(stream(sender, 2), 'http://peer/') == 'unknown parent'
+    assert scheduled == ['http://peer']
+
+
+def test_materialize_fork_checks_difficulty():
+    sender = ChainState()
+    extend(sender, 1)
+    tail = sender.tail
+    # mined at the minimum difficulty, the receiver's controller asks for more
+    assert sender.compare_and_swap(tail, Block(tail, [DocumentPublishEntry(tail.entries[-1], BYTES_32, BYTES_32)],
+                                               difficulty=MIN_BLOCK_HASH_LEADING_ZEROS))
+    receiver = ChainState()
+    records = list(decode_stream([stream(sender, 1, 2)]))
+    with pytest.raises(ValueError):
+        materialize_fork(receiver, records)
+    assert len(materialize_fork(receiver, records[:1])) == 1
+
+
+def test_sync_with_fetches_the_fork_in_batches(tmpdir):
+    peer, node = ChainState(), ChainState()
+    extend(peer, 7)
+    extend(node, 2, OTHER_32)
+    sync = PeerSync(node, ['http://peer'], batch_size=2)
+    app = create_app(Node(peer, DocumentStore(Path(tmpdir))))
+    sync._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    try:
+        assert sync.loop.run_until_complete(sync.sync_with('http://peer'))
+    finally:
+        sync.loop.run_until_complete(sync._client.aclose())
+        sync.loop.close()
+    assert node.height == peer.height
+    assert node.tail.sha256_hash == peer.tail.sha256_hash
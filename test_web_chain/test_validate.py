@@ -0,0 +1,126 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+
+from fastecdsa import keys, curve
+from fastecdsa.curve import P256
+from fastecdsa.keys import export_key
+
+from chain_utils import doc_id
+from entries import MAX_INTERNED
+from validate import parse_public_key, verify_signature, verify_batch
+
+
+def test_verify_signature():
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    pem = export_key(public_key, P256).encode('utf8')
+    parsed = parse_public_key(pem)
+    assert parsed == public_key
+    assert parse_public_key(pem[:10] + pem[10:]) is parsed
+
+    d = doc_id('contents', private_key).hex()
+    assert verify_signature(d, 'contents', parsed.x, parsed.y)
+    assert not verify_signature(d, 'tampered contents', parsed.x, parsed.y)
+
+
+def test_verify_batch():
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    pem_hex = export_key(public_key, P256).encode('utf8').hex()
+    documents = {doc_id(f'document {i}', private_key).hex(): f'document {i}' for i in range(20)}
+    bad = doc_id('original', private_key).hex()
+    documents[bad] = 'tampered'
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            contents = documents[parse_qs(urlparse(self.path).query)['doc_id'][0]].encode('utf8')
+            self.send_response(200)
+            self.send_header('X-Public-Key', pem_hex)
+            self.send_header('Content-Length', str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        verified, failed, elapsed = verify_batch(f'http://127.0.0.1:{server.server_port}', documents, 4, 2)
+    finally:
+        server.shutdown()
+    assert verified == 20
+    assert failed == 1
+    assert elapsed > 0
+
+
+def test_verify_batch_bounds_documents_in_flight():
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    pem_hex = export_key(public_key, P256).encode('utf8').hex()
+    documents = {doc_id(f'document {i}', private_key).hex(): f'document {i}' for i in range(30)}
+    taken, served, ahead = [0], [0], []
+
+    def doc_ids():
+        for d in documents:
+            taken[0] += 1
+            yield d
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ahead.append(taken[0] - served[0])
+            served[0] += 1
+            contents = documents[parse_qs(urlparse(self.path).query)['doc_id'][0]].encode('utf8')
+            self.send_response(200)
+            self.send_header('X-Public-Key', pem_hex)
+            self.send_header('Content-Length', str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        verified, failed, _ = verify_batch(f'http://127.0.0.1:{server.server_port}', doc_ids(), 2, 1, max_in_flight=3)
+    finally:
+        server.shutdown()
+    assert (verified, failed) == (30, 0)
+    # documents are drawn as others complete, never all of them up front
+    assert max(ahead) <= 3
+
+
+def test_verify_batch_counts_unreadable_documents_as_failed():
+    private_key, public_key = keys.gen_keypair(curve.P256)
+    pem_hex = export_key(public_key, P256).encode('utf8').hex()
+    documents = {doc_id(f'document {i}', private_key).hex(): f'document {i}' for i in range(5)}
+    # an empty DER sequence is served but is not a signature
+    documents['3000'] = 'malformed'
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            contents = documents.get(parse_qs(urlparse(self.path).query)['doc_id'][0])
+            if contents is None:
+                self.send_error(404)
+                return
+            contents = contents.encode('utf8')
+            self.send_response(200)
+            self.send_header('X-Public-Key', pem_hex)
+            self.send_header('Content-Length', str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    missing = doc_id('missing', private_key).hex()
+    try:
+        verified, failed, _ = verify_batch(f'http://127.0.0.1:{server.server_port}', [*documents, missing], 2, 1)
+    finally:
+        server.shutdown()
+    assert (verified, failed) == (5, 2)
+
+
+def test_parse_public_key_cache_is_bounded():
+    assert parse_public_key.cache_info().maxsize == MAX_INTERNED
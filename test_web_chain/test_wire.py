@@ -0,0 +1,75 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from chain_state import ChainState
+from chain_store import ChainStore, RECORD_LENGTH
+from wire import StreamDecoder, decode_stream, encode_stream, export_store, import_stream, STREAM_HEADER, \
+    STREAM_MAGIC, STREAM_VERSION
+from test_web_chain.test_chain_store import fill_chain
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_decode_stream_in_any_chunk_size():
+    state = ChainState()
+    fill_chain(state, 3)
+    data = b''.join(encode_stream((state.block(h) for h in (1, 2, 3)), 1))
+    for size in (1, 7, len(data)):
+        records = list(decode_stream(_chunks(data, size)))
+        assert [r.sha256_hash for r in records] == [state.block(h).sha256_hash for h in (1, 2, 3)]
+
+    decoder = StreamDecoder()
+    decoder.feed(data[:-1])
+    assert decoder.start == 1
+    with pytest.raises(ValueError):
+        decoder.close()
+    with pytest.raises(ValueError):
+        list(decode_stream([b'not a stream' * 2]))
+
+
+def test_decoder_rejects_oversized_records():
+    decoder = StreamDecoder(max_record_size=64)
+    header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, 1)
+    # rejected from its length alone, before the body is buffered
+    with pytest.raises(ValueError):
+        decoder.feed(header + RECORD_LENGTH.pack(65))
+    assert StreamDecoder(max_record_size=64).feed(header + RECORD_LENGTH.pack(64)) == []
+
+
+def test_export_import(tmpdir):
+    source_store = ChainStore(Path(tmpdir) / 'source', segment_size=512)
+    state = ChainState(source_store)
+    fill_chain(state, 5)
+    source_store.sync()
+
+    exported = BytesIO()
+    assert export_store(source_store, exported, 1, 4) == 3
+    store = ChainStore(Path(tmpdir) / 'imported', segment_size=512)
+    assert import_stream(_chunks(exported.getvalue(), 100), store) == 3
+
+    exported = BytesIO()
+    export_store(source_store, exported, 4)
+    with pytest.raises(ValueError):
+        # the stream has to continue from the end of the store
+        import_stream([exported.getvalue()], ChainStore(Path(tmpdir) / 'empty'))
+    assert import_stream([exported.getvalue()], store) == 2
+    store.close()
+
+    imported = ChainState(ChainStore(Path(tmpdir) / 'imported', segment_size=512))
+    assert imported.height == 5
+    assert imported.tail.sha256_hash == state.tail.sha256_hash
+
+
+def test_import_rejects_invalid_blocks(tmpdir):
+    state = ChainState()
+    fill_chain(state, 2)
+    # a valid record of a block that does not extend the root block
+    data = b''.join(encode_stream([state.block(2)], 1))
+    store = ChainStore(Path(tmpdir))
+    with pytest.raises(ValueError, match='does not extend'):
+        import_stream([data], store)
+    assert store.height == 0
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from document_store import DocumentStore
+from write_behind import DocumentWriter
+
+
+def test_document_writer(tmpdir):
+    store = DocumentStore(Path(tmpdir))
+    writer = DocumentWriter(store, max_queue=8, max_batch=4)
+    doc_ids = [i.to_bytes(length=70, byteorder='big') for i in range(20)]
+    writer.start()
+    futures = [writer.submit(d, f'document {i}') for i, d in enumerate(doc_ids)]
+    paths = [f.result() for f in futures]
+    assert writer.queue_depth == 0
+    writer.close()
+
+    for i, (d, path) in enumerate(zip(doc_ids, paths)):
+        assert path == store.path(d)
+        assert store.get(d) == f'document {i}'.encode('utf8')
+    assert writer.documents_written == 20
+    assert 5 <= writer.flushes <= 20
+    assert 0 < writer.mean_flush_latency <= writer.max_flush_latency
+    assert not writer.is_alive()
+
+
+def test_document_writer_failure(tmpdir):
+    blocker = Path(tmpdir) / 'blocker'
+    blocker.write_text('not a directory')
+    writer = DocumentWriter(DocumentStore(blocker))
+    writer.start()
+    future = writer.submit(b'doc', 'contents')
+    assert future.exception() is not None
+    writer.close()
@@ -0,0 +1,132 @@
+from html import escape
+from pathlib import Path
+from typing import AsyncIterator, Final, List, Optional
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import BaseModel
+
+from blocks import BaseBlock
+from document_cache import ByteLRUCache
+from document_store import DocumentStore
+from entries import BaseDocumentEntry
+from metrics import Histogram
+
+# responses served both by the node owning the chain, poc, and by its read workers, reader
+
+STREAM_CHUNK_SIZE: Final[int] = 64 * 2 ** 10
+METRICS_CONTENT_TYPE: Final[str] = 'text/plain; version=0.0.4; charset=utf-8'
+
+NOT_FOUND_PREFIX: Final[str] = '''<!DOCTYPE html>
+        <html lang=en>
+        <title>404 Unable to locate document</title>
+        <p>The requested document id <code>'''
+NOT_FOUND_SUFFIX: Final[str] = '''</code> was not found in WebChain</p>
+        '''
+
+
+class PublishRequest(BaseModel):
+    documents: List[str]
+
+
+class PublishedDocument(BaseModel):
+    doc_id: str
+    height: int
+
+
+class PublishResponse(BaseModel):
+    documents: List[PublishedDocument]
+
+
+class MerkleProofStep(BaseModel):
+    hash: str
+    left: bool
+
+
+class InclusionProof(BaseModel):
+    doc_id: str
+    previous_doc_id: Optional[str]
+    public_key: str
+    previous_entry_hash: str
+    position: int
+    proof: List[MerkleProofStep]
+    height: int
+    block_hash: str
+    previous_block_hash: str
+    difficulty: int
+    timestamp: int
+    nonce: int
+
+
+class ChainHead(BaseModel):
+    height: int
+    hash: str
+    work: int
+
+
+class VersionHistory(BaseModel):
+    doc_id: str
+    latest: PublishedDocument
+    versions: List[PublishedDocument]
+
+
+def not_found(doc_id: str) -> HTMLResponse:
+    return HTMLResponse(NOT_FOUND_PREFIX + escape(doc_id) + NOT_FOUND_SUFFIX, status_code=404)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/').strip('"') == etag:
+            return True
+    return False
+
+
+async def stream_file(path: Path) -> AsyncIterator[bytes]:
+    with await run_in_threadpool(open, path, 'rb') as f:
+        while chunk := await run_in_threadpool(f.read, STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+async def document_response(doc_id: str, found_doc_id: bytes, public_key: bytes, request: Request,
+                            document_store: DocumentStore, document_cache: ByteLRUCache,
+                            read_seconds: Histogram) -> Response:
+    """
+    The contents of a document found in the index, from the cache, read whole or streamed when too large to cache.
+    Reads are timed in the read_seconds of the app serving them
+    """
+    headers = {'Cache-Control': 'public, max-age=31557600, immutable', 'ETag': doc_id,
+               'X-Public-Key': public_key.hex()}
+    # documents never change, a client holding this doc_id already has the current contents
+    if etag_matches(request.headers.get('If-None-Match'), doc_id):
+        return Response(status_code=304, headers=headers)
+
+    contents = document_cache.get(found_doc_id)
+    if contents is not None:
+        return HTMLResponse(contents, headers=headers)
+
+    path = document_store.path(found_doc_id)
+    try:
+        size = (await run_in_threadpool(path.stat)).st_size
+        if size > document_cache.max_item_bytes:
+            return StreamingResponse(stream_file(path), media_type='text/html', headers=headers)
+        with read_seconds.time():
+            contents = await run_in_threadpool(path.read_bytes)
+    except FileNotFoundError:
+        return not_found(doc_id)
+    document_cache.put(found_doc_id, contents)
+    return HTMLResponse(contents, headers=headers)
+
+
+def inclusion_proof(doc_id: str, entry: BaseDocumentEntry, previous_doc_id: Optional[bytes], block: BaseBlock,
+                    position: int, height: int) -> InclusionProof:
+    return InclusionProof(
+        doc_id=doc_id, previous_doc_id=None if previous_doc_id is None else previous_doc_id.hex(),
+        public_key=entry.public_key.hex(), previous_entry_hash=entry.previous_entry.sha256_hash.hex(),
+        position=position,
+        proof=[MerkleProofStep(hash=h.hex(), left=left) for h, left in block.merkle_tree.proof(position)],
+        height=height, block_hash=block.sha256_hash.hex(), previous_block_hash=block.previous_block.sha256_hash.hex(),
+        difficulty=block.difficulty, timestamp=block.timestamp, nonce=block.nonce)
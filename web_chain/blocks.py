@@ -1,11 +1,14 @@
 from abc import ABC, abstractmethod
+from time import time
 from typing import Iterable, Final, Tuple, Optional
 
-from chain_utils import sha256_hash_block
-from entries import BaseEntry, RootEntry
+from chain_utils import sha256_hash_block, BLOCK_HASH_LEADING_ZEROS, MAX_BLOCK_HASH_LEADING_ZEROS
+from merkle import MerkleTree
+from entries import BaseEntry, RootEntry, CheckpointEntry
 
 
 class BaseBlock(ABC):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -27,20 +30,64 @@ class BaseBlock(ABC):
     def nonce(self) -> int:
         ...
 
+    @property
+    @abstractmethod
+    def difficulty(self) -> int:
+        """
+        Number of leading zero bits the block hash must have
+        """
+        ...
 
-class Block(BaseBlock):
+    @property
+    @abstractmethod
+    def timestamp(self) -> int:
+        """
+        Milliseconds since the epoch when the block was created
+        """
+        ...
+
+    @property
+    def merkle_tree(self) -> MerkleTree:
+        """
+        Merkle tree over the entry hashes, its root is part of the block hash
+        """
+        return MerkleTree([bytes(entry.sha256_hash) for entry in self.entries])
 
-    def __init__(self, previous_block: 'BaseBlock', entries: Iterable[BaseEntry], nonce: Optional[int] = None):
+
+class Block(BaseBlock):
+    __slots__ = ('_entries', '_previous_block', '_sha256_hash', '_nonce', '_miner', '_difficulty', '_timestamp',
+                 '_merkle_tree')
+
+    def __init__(self, previous_block: 'BaseBlock', entries: Iterable[BaseEntry], nonce: Optional[int] = None,
+                 miner: Optional['mining.ParallelMiner'] = None, difficulty: int = BLOCK_HASH_LEADING_ZEROS,
+                 timestamp: Optional[int] = None, sha256_hash: Optional[bytes] = None):
+        """
+        sha256_hash is only given for a block whose hash was verified before, with its nonce, it is not recomputed
+        """
         self._entries: Final[Tuple[BaseEntry]] = tuple(i for i in entries)
         assert len(self._entries) > 0, 'must be at least one entry in a block'
+        assert sha256_hash is None or nonce is not None
         self._previous_block: Final[BaseBlock] = previous_block
-        self._sha256_hash: Optional[bytes] = None
+        self._sha256_hash: Optional[bytes] = sha256_hash
         self._nonce: Optional[int] = nonce
+        self._miner: Optional['mining.ParallelMiner'] = miner
+        assert 0 <= difficulty <= MAX_BLOCK_HASH_LEADING_ZEROS
+        self._difficulty: Final[int] = difficulty
+        self._timestamp: Final[int] = int(time() * 1_000) if timestamp is None else timestamp
+        self._merkle_tree: Optional[MerkleTree] = None
 
     @property
     def sha256_hash(self) -> bytes:
         if self._sha256_hash is None:
-            self._nonce, self._sha256_hash = sha256_hash_block(self, self._nonce)
+            # hash known blocks oldest first rather than recursing through previous_block
+            pending = []
+            previous = self._previous_block
+            while isinstance(previous, Block) and previous._sha256_hash is None and previous._nonce is not None:
+                pending.append(previous)
+                previous = previous._previous_block
+            for previous in reversed(pending):
+                previous.sha256_hash
+            self._nonce, self._sha256_hash = sha256_hash_block(self, self._nonce, self._miner)
         return self._sha256_hash
 
     @property
@@ -57,8 +104,23 @@ class Block(BaseBlock):
             self.sha256_hash  # causes nonce to be calculated
         return self._nonce
 
+    @property
+    def difficulty(self) -> int:
+        return self._difficulty
+
+    @property
+    def timestamp(self) -> int:
+        return self._timestamp
+
+    @property
+    def merkle_tree(self) -> MerkleTree:
+        if self._merkle_tree is None:
+            self._merkle_tree = super().merkle_tree
+        return self._merkle_tree
+
 
 class RootBlock(BaseBlock):
+    __slots__ = ()
     _SHA_256_HASH: Final[bytes] = (0).to_bytes(length=32, byteorder='big', signed=False)
     _INSTANCE: Optional['RootBlock'] = None
 
@@ -92,3 +154,52 @@ class RootBlock(BaseBlock):
     @property
     def nonce(self) -> int:
         return 0
+
+    @property
+    def difficulty(self) -> int:
+        return 0
+
+    @property
+    def timestamp(self) -> int:
+        return 0
+
+
+class CheckpointBlock(BaseBlock):
+    __slots__ = ('_sha256_hash', '_nonce', '_difficulty', '_timestamp', '_entries')
+
+    """
+    Stands in for the tail block of a checkpoint, a chain bootstrapped from the checkpoint is built on top of it.
+    Only the header and the hash of the last entry are known, the blocks before it are not loaded
+    """
+
+    def __init__(self, sha256_hash: bytes, nonce: int, difficulty: int, timestamp: int, entry_hash: bytes):
+        self._sha256_hash: Final[bytes] = sha256_hash
+        self._nonce: Final[int] = nonce
+        self._difficulty: Final[int] = difficulty
+        self._timestamp: Final[int] = timestamp
+        self._entries: Final[Tuple[BaseEntry]] = CheckpointEntry(entry_hash),
+
+    @property
+    def previous_block(self) -> 'BaseBlock':
+        # nothing before the checkpoint is loaded, walks back along the chain stop at the root block
+        return RootBlock.get_instance()
+
+    @property
+    def entries(self) -> Tuple[BaseEntry]:
+        return self._entries
+
+    @property
+    def sha256_hash(self) -> bytes:
+        return self._sha256_hash
+
+    @property
+    def nonce(self) -> int:
+        return self._nonce
+
+    @property
+    def difficulty(self) -> int:
+        return self._difficulty
+
+    @property
+    def timestamp(self) -> int:
+        return self._timestamp
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Final, List, NamedTuple, Optional, Tuple
+
+from blocks import BaseBlock
+from entries import BaseDocumentEntry, DocumentUpdateEntry, HostLocationEntry
+
+MAX_VERSIONS: Final[int] = 10_000
+DEFAULT_MAX_CACHED_HISTORIES: Final[int] = 4_096
+
+
+class DocumentRecord(NamedTuple):
+    entry: BaseDocumentEntry
+    block: BaseBlock
+    height: int
+    position: int
+
+    @property
+    def doc_id(self) -> bytes:
+        return self.entry.doc_id
+
+    @property
+    def public_key(self) -> bytes:
+        return self.entry.public_key
+
+
+def follow_versions(doc_id: bytes, link: Callable[[bytes], Optional[bytes]],
+                    max_versions: int = MAX_VERSIONS) -> List[bytes]:
+    """
+    doc_id followed by the versions reached through link one hop at a time. Stops at a version already reached, as
+    nothing on the chain stops an update from naming a later version, or itself, as its previous version
+    """
+    versions = [doc_id]
+    seen = {doc_id}
+    while len(versions) < max_versions:
+        linked = link(versions[-1])
+        if linked is None or linked in seen:
+            break
+        versions.append(linked)
+        seen.add(linked)
+    return versions
+
+
+class ChainIndex:
+    """
+    Lookup tables maintained as blocks are appended to the chain so that reads never walk previous_entry.
+
+    Version links are kept in both directions: each version knows the version it replaced and the latest version that
+    replaced it. A document replaced more than once branches, so a history is read forward to the latest version and
+    then back through the versions that one replaced, which always leads through the document asked for. Histories
+    are cached by their latest version, a version committed later makes them end elsewhere rather than go stale
+    """
+
+    def __init__(self, max_cached_histories: int = DEFAULT_MAX_CACHED_HISTORIES):
+        self._documents: Final[Dict[bytes, DocumentRecord]] = {}
+        self._locations: Final[Dict[bytes, HostLocationEntry]] = {}
+        self._previous_version: Final[Dict[bytes, bytes]] = {}
+        self._next_version: Final[Dict[bytes, bytes]] = {}
+        self.max_cached_histories: Final[int] = max_cached_histories
+        self._histories: Final[OrderedDict] = OrderedDict()
+        self._histories_lock: Final[Lock] = Lock()
+
+    def add_block(self, block: BaseBlock, height: int):
+        for position, entry in enumerate(block.entries):
+            if isinstance(entry, BaseDocumentEntry):
+                if isinstance(entry, DocumentUpdateEntry):
+                    self._link_version(entry.previous_doc_id, entry.doc_id)
+                self._documents[entry.doc_id] = DocumentRecord(entry, block, height, position)
+            elif isinstance(entry, HostLocationEntry):
+                self._locations[entry.public_key] = entry
+
+    def _link_version(self, previous_doc_id: bytes, doc_id: bytes):
+        if previous_doc_id not in self._documents:
+            return  # replaces a document that is not on the chain, the update starts its own history
+        self._previous_version[doc_id] = previous_doc_id
+        self._next_version[previous_doc_id] = doc_id
+
+    def history(self, doc_id: bytes) -> Tuple[bytes, ...]:
+        """
+        Every version of the document, oldest first, or an empty tuple if doc_id is not on the chain
+        """
+        if doc_id not in self._documents:
+            return ()
+        latest = follow_versions(doc_id, self._next_version.get)[-1]
+        with self._histories_lock:
+            versions = self._histories.get(latest)
+            if versions is not None:
+                self._histories.move_to_end(latest)
+                return versions
+        versions = tuple(reversed(follow_versions(latest, self._previous_version.get)))
+        with self._histories_lock:
+            self._histories[latest] = versions
+            if len(self._histories) > self.max_cached_histories:
+                self._histories.popitem(last=False)
+        return versions
+
+    def latest_version(self, doc_id: bytes) -> Optional[bytes]:
+        versions = self.history(doc_id)
+        return versions[-1] if versions else None
+
+    def lookup(self, doc_id: bytes) -> Optional[DocumentRecord]:
+        return self._documents.get(doc_id)
+
+    def location(self, public_key: bytes) -> Optional[HostLocationEntry]:
+        return self._locations.get(public_key)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, doc_id: bytes) -> bool:
+        return doc_id in self._documents
@@ -0,0 +1,97 @@
+from pathlib import Path
+from threading import Lock
+from typing import Final, Iterator, List, Optional, Tuple
+
+from api import InclusionProof, PublishedDocument, inclusion_proof
+from document_db import DocumentDatabase, DocumentRow
+from entries import BaseDocumentEntry
+from mapped_chain import MappedChain, MappedDocumentUpdateEntry
+from metrics import counter
+from shared_head import SharedHead, Head
+
+REMAPS: Final = counter('webchain_reader_remaps_total', 'Segments mapped again after the chain switched to a fork')
+
+
+class ChainReader:
+    """
+    Read-only view of a chain owned by another process, for read workers that hold no chain of their own.
+
+    The owner publishes its tail to the shared head and the reader serves what is at or below it: blocks are read from
+    the memory-mapped segments, documents from the database, which is in WAL mode so reading never blocks the owner.
+    Nothing committed above the published head is served, so a worker never answers with a document whose block it
+    cannot read yet
+    """
+
+    def __init__(self, chain_dir: Path, database: DocumentDatabase, head: SharedHead):
+        self.chain_dir: Final[Path] = chain_dir
+        self.database: Final[DocumentDatabase] = database
+        self.head: Final[SharedHead] = head
+        self._lock: Final[Lock] = Lock()
+        self._generation: int = head.read().generation
+        self._chain: MappedChain = MappedChain(chain_dir)
+
+    def view(self) -> Tuple[Head, MappedChain]:
+        """
+        The published head and a chain reaching it. Blocks, once obtained, stay readable after the chain moves on
+        """
+        head = self.head.read()
+        with self._lock:
+            chain = self._chain
+            if head.generation == self._generation and head.height > chain.height:
+                chain.refresh()
+            if head.generation != self._generation or not self._reaches(chain, head):
+                # blocks were removed, the segments the reader mapped were replaced. The old maps are released along
+                # with the last block read from them
+                REMAPS.inc()
+                chain = self._chain = MappedChain(self.chain_dir)
+                self._generation = head.generation
+            return head, chain
+
+    @staticmethod
+    def _reaches(chain: MappedChain, head: Head) -> bool:
+        if head.height == chain.base_height:
+            return True
+        return head.height <= chain.height and bytes(chain.block(head.height).sha256_hash) == head.block_hash
+
+    def lookup(self, doc_id: bytes, height: Optional[int] = None) -> Optional[DocumentRow]:
+        """
+        The document if it is in a block at or below height, the published head by default
+        """
+        height = self.head.read().height if height is None else height
+        row = self.database.lookup(doc_id)
+        return row if row is not None and row.height <= height else None
+
+    def history(self, doc_id: bytes) -> List[PublishedDocument]:
+        height = self.head.read().height
+        versions = []
+        for version in self.database.history(doc_id):
+            row = self.lookup(version, height)
+            if row is None:
+                break
+            versions.append(PublishedDocument(doc_id=version.hex(), height=row.height))
+        return versions
+
+    def proof(self, doc_id: str) -> Optional[InclusionProof]:
+        head, chain = self.view()
+        row = self.lookup(bytes.fromhex(doc_id), head.height)
+        if row is None:
+            return None
+        block = chain.block(row.height)
+        for position, entry in enumerate(block.entries):
+            if isinstance(entry, BaseDocumentEntry) and entry.doc_id == row.doc_id:
+                previous_doc_id = entry.previous_doc_id if isinstance(entry, MappedDocumentUpdateEntry) else None
+                return inclusion_proof(doc_id, entry, previous_doc_id, block, position, row.height)
+        return None
+
+    def record_bodies(self, start: int, stop: Optional[int]) -> Iterator[bytes]:
+        """
+        Encoded blocks [start, stop) up to the head published when the range is requested
+        """
+        head, chain = self.view()
+        stop = head.height + 1 if stop is None else min(stop, head.height + 1)
+        for height in range(start, stop):
+            yield bytes(chain.block(height).record_body)
+
+    def close(self):
+        self.head.close()
+        self.database.close()
@@ -0,0 +1,321 @@
+from collections import OrderedDict, deque
+from functools import partial
+from threading import Lock, current_thread
+from time import perf_counter
+from typing import Final, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from blocks import RootBlock, BaseBlock, Block
+from chain_index import ChainIndex, DocumentRecord, DEFAULT_MAX_CACHED_HISTORIES
+from chain_utils import MIN_INT
+from difficulty import DifficultyController, FixedDifficulty
+from entries import BaseEntry, DocumentUpdateEntry
+from metrics import counter, histogram
+
+LOCK_WAIT_SECONDS: Final = histogram('webchain_chain_lock_wait_seconds', 'Time spent waiting for ChainState.lock')
+MINING_ATTEMPTS: Final = counter('webchain_mining_attempts_total', 'Nonces tried while mining blocks', ('thread',))
+MINING_SECONDS: Final = counter('webchain_mining_seconds_total', 'Time spent mining blocks', ('thread',))
+
+
+class ChainState:
+
+    def __init__(self, store: Optional['chain_store.ChainStore'] = None,
+                 difficulty: Optional[DifficultyController] = None,
+                 database: Optional['document_db.DocumentDatabase'] = None,
+                 checkpoint: Optional['checkpoint.Checkpoint'] = None):
+        self._lock: Final[Lock] = Lock()
+        self._tail: BaseBlock = RootBlock.get_instance()
+        self._height: int = 0
+        self._index: ChainIndex = ChainIndex()
+        # blocks, cumulative work and heights of the current chain from base_height, the root block or a checkpoint
+        self._base_height: int = 0
+        self._blocks: Final[List[BaseBlock]] = [self._tail]
+        self._work: Final[List[int]] = [0]
+        self._heights: Final[Dict[bytes, int]] = {bytes(self._tail.sha256_hash): 0}
+        self._listeners: Final[List[Callable[[BaseBlock, int], None]]] = []
+        self._rewind_listeners: Final[List[Callable[[int], None]]] = []
+        self._commits: int = 0
+        self._conflicts: int = 0
+        self._store: Final[Optional['chain_store.ChainStore']] = store
+        self._difficulty: Final[DifficultyController] = FixedDifficulty() if difficulty is None else difficulty
+        self._database: Final[Optional['document_db.DocumentDatabase']] = database
+        # database writes queued in commit order while the chain lock is held, made by write_database once it is not
+        self._database_writes: Final[deque] = deque()
+        self._database_lock: Final[Lock] = Lock()
+        # histories read from the database by doc_id, dropped once an update or a rewind is written to it
+        self._histories: Final[OrderedDict] = OrderedDict()
+        self._histories_lock: Final[Lock] = Lock()
+        self._histories_generation: int = 0
+        verified_height = 0
+        if checkpoint is not None:
+            if store is not None and not checkpoint.extends(store):
+                raise ValueError(f'checkpoint at {checkpoint.height} is not on the stored chain')
+            if store is not None and store.base_height == 0 and store.height >= checkpoint.height:
+                # a node restarting from its own checkpoint still has every block, the blocks up to the checkpoint
+                # are loaded without being verified again so they can still be served, proven and synced from
+                verified_height = checkpoint.height
+            else:
+                self._start_from(checkpoint)
+        if store is not None:
+            # only an empty store is below a checkpoint that extends it
+            if store.height < self._height:
+                store.reset(self._height, self._tail)
+            # only the blocks after the checkpoint are verified
+            for block in store.load(self._tail, self._height, verified_height):
+                self._append(block)
+        self.write_database()
+        if database is not None and database.height > self._height:
+            # the database is committed before the store is synced, blocks lost from the store are dropped from it
+            database.truncate(self._height)
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def index(self) -> ChainIndex:
+        return self._index
+
+    @property
+    def base_height(self) -> int:
+        """
+        Height of the first block held in memory, the checkpoint the chain was loaded from or 0
+        """
+        return self._base_height
+
+    @property
+    def database(self) -> Optional['document_db.DocumentDatabase']:
+        return self._database
+
+    @property
+    def work(self) -> int:
+        """
+        Expected number of hashes needed to mine the chain, the fork with the most work is the chain that is followed
+        """
+        return self._work[-1]
+
+    def block(self, height: int) -> BaseBlock:
+        if height < self._base_height:
+            raise IndexError(f'block {height} is before the checkpoint at {self._base_height}')
+        return self._blocks[height - self._base_height]
+
+    def height_of(self, block_hash: bytes) -> Optional[int]:
+        """
+        Height of the block with this hash if it is on the current chain
+        """
+        return self._heights.get(bytes(block_hash))
+
+    def add_listener(self, listener: Callable[[BaseBlock, int], None]):
+        """
+        listener is called with every block appended after this call and its height, while the chain lock is held
+        """
+        self._listeners.append(listener)
+
+    def add_rewind_listener(self, listener: Callable[[int], None]):
+        """
+        listener is called with the fork height when the chain switches to a fork, before the blocks above it are
+        removed, while the chain lock is held
+        """
+        self._rewind_listeners.append(listener)
+
+    @property
+    def commits(self) -> int:
+        return self._commits
+
+    @property
+    def conflicts(self) -> int:
+        return self._conflicts
+
+    @property
+    def tail(self) -> BaseBlock:
+        return self._tail
+
+    def next_difficulty(self, tail: BaseBlock) -> int:
+        """
+        Difficulty of the block mined on top of tail
+        """
+        return self._difficulty.next_difficulty(tail)
+
+    def expected_difficulty(self, previous: BaseBlock, height: int) -> Optional[int]:
+        """
+        Difficulty a block received at height on top of previous must have, None when it cannot be known because the
+        blocks it is computed from reach back past the checkpoint the chain was loaded from
+        """
+        if self._base_height > 0 and height - self._base_height <= self._difficulty.window:
+            return None
+        return self._difficulty.next_difficulty(previous)
+
+    @tail.setter
+    def tail(self, block: BaseBlock):
+        assert block.previous_block is self.tail
+        if self._store is not None:
+            self._store.append(block)
+        self._append(block)
+        for listener in self._listeners:
+            listener(block, self._height)
+
+    def lookup(self, doc_id: bytes) -> Optional[Union[DocumentRecord, 'document_db.DocumentRow']]:
+        """
+        Finds a document in the database when there is one, otherwise in the in-memory index
+        """
+        if self._database is not None:
+            return self._database.lookup(doc_id)
+        return self._index.lookup(doc_id)
+
+    def history(self, doc_id: bytes) -> Sequence[bytes]:
+        """
+        Every version of the document, oldest first, from the database when there is one, otherwise from the in-memory
+        index. Histories read from the database are cached, the most recently read ones are kept
+        """
+        if self._database is None:
+            return self._index.history(doc_id)
+        with self._histories_lock:
+            versions = self._histories.get(doc_id)
+            if versions is not None:
+                self._histories.move_to_end(doc_id)
+                return versions
+            generation = self._histories_generation
+        versions = tuple(self._database.history(doc_id))
+        with self._histories_lock:
+            # a history read while an update or a rewind was being written may already be stale
+            if versions and generation == self._histories_generation:
+                self._histories[doc_id] = versions
+                if len(self._histories) > DEFAULT_MAX_CACHED_HISTORIES:
+                    self._histories.popitem(last=False)
+        return versions
+
+    def _forget_histories(self):
+        with self._histories_lock:
+            self._histories_generation += 1
+            self._histories.clear()
+
+    def write_database(self):
+        """
+        Writes the blocks committed so far to the database, in commit order. Called after the chain lock is released,
+        so a slow disk delays the committing thread but never the commits of others
+        """
+        with self._database_lock:
+            while self._database_writes:
+                self._database_writes.popleft()()
+
+    def with_database(self, callback: Callable[['document_db.DocumentDatabase'], None]):
+        """
+        Calls callback with the database, None without one, from write_database once the blocks committed before this
+        call are written and before any committed after it. Called while the chain lock is held, the database is then
+        at the tail
+        """
+        self._database_writes.append(partial(callback, self._database))
+
+    def _append(self, block: BaseBlock):
+        self._index.add_block(block, self._height + 1)
+        if self._database is not None:
+            self._database_writes.append(partial(self._database.add_block, block, self._height + 1))
+            if any(isinstance(entry, DocumentUpdateEntry) for entry in block.entries):
+                # the histories through the versions it replaces now end elsewhere
+                self._database_writes.append(self._forget_histories)
+        self._height += 1
+        self._tail = block
+        self._blocks.append(block)
+        self._work.append(self._work[-1] + 2 ** block.difficulty)
+        self._heights[bytes(block.sha256_hash)] = self._height
+
+    def compare_and_swap(self, expected_tail: BaseBlock, block: BaseBlock) -> bool:
+        """
+        Appends block only if the tail is still expected_tail, the block must already be mined
+        """
+        start = perf_counter()
+        with self._lock:
+            LOCK_WAIT_SECONDS.observe(perf_counter() - start)
+            if self._tail is not expected_tail:
+                self._conflicts += 1
+                return False
+            self.tail = block
+            self._commits += 1
+        self.write_database()
+        return True
+
+    def adopt(self, blocks: Sequence[BaseBlock]) -> bool:
+        """
+        Switches to the fork ending with blocks if it has more work than the current chain. The first block must
+        extend a block of the current chain, blocks above that block are dropped along with their documents.
+
+        Entries of the dropped blocks are not published again. Returns True if the fork was adopted
+        """
+        with self._lock:
+            fork_height = self.height_of(blocks[0].previous_block.sha256_hash)
+            if fork_height is None or self.block(fork_height) is not blocks[0].previous_block:
+                raise ValueError('fork does not extend the current chain')
+            work = self._work[fork_height - self._base_height] + sum(2 ** block.difficulty for block in blocks)
+            if work <= self.work:
+                return False
+            if fork_height < self._height:
+                self._rewind(fork_height)
+            for block in blocks:
+                self.tail = block
+            self._commits += len(blocks)
+        self.write_database()
+        return True
+
+    def _rewind(self, height: int):
+        for listener in self._rewind_listeners:
+            listener(height)
+        if self._store is not None:
+            self._store.truncate(height)
+        if self._database is not None:
+            self._database_writes.append(partial(self._database.truncate, height))
+            self._database_writes.append(self._forget_histories)
+        keep = height - self._base_height + 1
+        for block in self._blocks[keep:]:
+            del self._heights[bytes(block.sha256_hash)]
+        del self._blocks[keep:]
+        del self._work[keep:]
+        # documents cannot be removed from the index one by one, it is rebuilt from the blocks that remain
+        self._index = ChainIndex()
+        for ix, block in enumerate(self._blocks[1:], start=self._base_height + 1):
+            self._index.add_block(block, ix)
+        self._height = height
+        self._tail = self._blocks[-1]
+
+    def _start_from(self, checkpoint: 'checkpoint.Checkpoint'):
+        """
+        Continues the chain from a verified checkpoint. Its index snapshot is restored into the database unless the
+        database already reaches it, the in-memory index only holds the documents of later blocks
+        """
+        if self._database is None:
+            raise ValueError('a checkpoint is restored into the document database')
+        anchor = checkpoint.block()
+        self._tail = self._blocks[0] = anchor
+        self._height = self._base_height = checkpoint.height
+        self._work[0] = checkpoint.work
+        self._heights.clear()
+        self._heights[bytes(anchor.sha256_hash)] = checkpoint.height
+        if self._database.height < checkpoint.height:
+            self._database.restore(checkpoint.height, checkpoint.locations(), checkpoint.documents())
+
+
+def mine_and_commit(chain_state: ChainState, build_entries: Callable[[BaseEntry], List[BaseEntry]],
+                    miner: Optional['mining.ParallelMiner'] = None) -> Tuple[Block, int]:
+    """
+    Mines a block on a snapshot of the tail without holding the chain lock and commits it with compare_and_swap.
+
+    build_entries is given the last entry of the snapshot and returns the entries of the new block, it is called
+    again to rebase the entries whenever another block was committed while mining.
+    Returns the committed block and the number of times it had to be re-mined
+    """
+    retries = 0
+    labels = (current_thread().name,)
+    while True:
+        tail = chain_state.tail
+        block = Block(tail, build_entries(tail.entries[-1]), miner=miner, difficulty=chain_state.next_difficulty(tail))
+        start = perf_counter()
+        # mined here, outside the chain lock, reading the nonce searches for it
+        nonce = block.nonce
+        MINING_SECONDS.inc(perf_counter() - start, labels)
+        # nonces are searched upwards from MIN_INT
+        MINING_ATTEMPTS.inc(nonce - MIN_INT + 1, labels)
+        if chain_state.compare_and_swap(tail, block):
+            return block, retries
+        retries += 1
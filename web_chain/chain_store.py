@@ -0,0 +1,478 @@
+import os
+from pathlib import Path
+from struct import Struct
+from threading import Lock, Timer
+from time import monotonic
+from typing import Final, Iterator, List, NamedTuple, Optional, Tuple, BinaryIO
+from zlib import crc32
+
+from blocks import BaseBlock, Block, CheckpointBlock, RootBlock
+from chain_utils import MIN_BLOCK_HASH_LEADING_ZEROS, MAX_BLOCK_HASH_LEADING_ZEROS, validate_block_hash
+from entries import BaseEntry, DocumentPublishEntry, DocumentUpdateEntry, HostLocationEntry
+from metrics import histogram
+
+SEGMENT_MAGIC: Final[bytes] = b'WEBCHAIN'
+SEGMENT_VERSION: Final[int] = 4
+SEGMENT_SUFFIX: Final[str] = '.seg'
+
+# magic, version, reserved, height of the first block in the segment, then the block the store continues from, the
+# root block or the tail block of a checkpoint: its hash, nonce, difficulty, timestamp and the hash of its last entry
+SEGMENT_HEADER: Final[Struct] = Struct('>8sHHQ32sqBq32s')
+# length of the record body, the body is followed by its crc32
+RECORD_LENGTH: Final[Struct] = Struct('>I')
+RECORD_CRC: Final[Struct] = Struct('>I')
+# block hash, previous block hash, nonce, difficulty, timestamp in milliseconds, number of entries
+BLOCK_HEADER: Final[Struct] = Struct('>32s32sqBqI')
+# entry kind, entry hash
+ENTRY_HEADER: Final[Struct] = Struct('>B32s')
+FIELD_LENGTH: Final[Struct] = Struct('>H')
+
+PUBLISH_ENTRY: Final[int] = 1
+UPDATE_ENTRY: Final[int] = 2
+HOST_LOCATION_ENTRY: Final[int] = 3
+
+DEFAULT_SEGMENT_SIZE: Final[int] = 64 * 2 ** 20
+DEFAULT_FSYNC_EVERY: Final[int] = 64
+DEFAULT_FSYNC_INTERVAL: Final[float] = 1.0
+COPY_CHUNK_SIZE: Final[int] = 2 ** 20
+
+SYNC_SECONDS: Final = histogram('webchain_chain_store_sync_seconds', 'Time spent flushing and fsyncing a segment')
+
+
+class EntryRecord(NamedTuple):
+    kind: int
+    sha256_hash: bytes
+    fields: Tuple[bytes, ...]
+
+
+class BlockRecord(NamedTuple):
+    sha256_hash: bytes
+    previous_hash: bytes
+    nonce: int
+    difficulty: int
+    timestamp: int
+    entries: Tuple[EntryRecord, ...]
+
+
+def entry_fields(entry: BaseEntry) -> Tuple[int, Tuple[bytes, ...]]:
+    if isinstance(entry, DocumentUpdateEntry):
+        return UPDATE_ENTRY, (entry.previous_doc_id, entry.doc_id, entry.public_key)
+    if isinstance(entry, DocumentPublishEntry):
+        return PUBLISH_ENTRY, (entry.doc_id, entry.public_key)
+    if isinstance(entry, HostLocationEntry):
+        return HOST_LOCATION_ENTRY, (entry.ipaddress, entry.public_key)
+    raise ValueError(f'Unable to encode entry of type {type(entry).__name__}')
+
+
+def encode_block(block: BaseBlock) -> bytes:
+    """
+    Encodes a block as a length prefixed, crc32 suffixed record
+    """
+    return frame_record(encode_block_body(block))
+
+
+def frame_record(body: bytes) -> bytes:
+    return RECORD_LENGTH.pack(len(body)) + body + RECORD_CRC.pack(crc32(body))
+
+
+def encode_block_body(block: BaseBlock) -> bytes:
+    parts = [BLOCK_HEADER.pack(block.sha256_hash, block.previous_block.sha256_hash, block.nonce,
+                                 block.difficulty, block.timestamp, len(block.entries))]
+    for entry in block.entries:
+        kind, fields = entry_fields(entry)
+        parts.append(ENTRY_HEADER.pack(kind, entry.sha256_hash))
+        for field in fields:
+            parts.append(FIELD_LENGTH.pack(len(field)))
+            parts.append(field)
+    return b''.join(parts)
+
+
+def decode_block(buffer, offset: int = 0) -> Tuple[BlockRecord, int]:
+    """
+    Decodes the record starting at offset, returns the record and the offset of the next record.
+    Raises ValueError if the record is truncated or its checksum does not match
+    """
+    if offset + RECORD_LENGTH.size > len(buffer):
+        raise ValueError('truncated record length')
+    length, = RECORD_LENGTH.unpack_from(buffer, offset)
+    start = offset + RECORD_LENGTH.size
+    end = start + length
+    if end + RECORD_CRC.size > len(buffer):
+        raise ValueError('truncated record')
+    body = memoryview(buffer)[start:end]
+    if crc32(body) != RECORD_CRC.unpack_from(buffer, end)[0]:
+        raise ValueError('record checksum mismatch')
+    return decode_block_body(body), end + RECORD_CRC.size
+
+
+def read_records(f: BinaryIO, offset: int) -> Iterator[Tuple[bytes, int]]:
+    """
+    Reads the records of f one at a time from offset, the file position, and yields each body with the offset of the
+    next record. Stops at the end of the file or at a torn or corrupt record
+    """
+    while True:
+        prefix = f.read(RECORD_LENGTH.size)
+        if len(prefix) < RECORD_LENGTH.size:
+            return
+        length, = RECORD_LENGTH.unpack(prefix)
+        rest = f.read(length + RECORD_CRC.size)
+        if len(rest) < length + RECORD_CRC.size:
+            return
+        body = rest[:length]
+        if crc32(body) != RECORD_CRC.unpack_from(rest, length)[0]:
+            return
+        offset += RECORD_LENGTH.size + len(rest)
+        yield body, offset
+
+
+def decode_block_body(body) -> BlockRecord:
+    block_hash, previous_hash, nonce, difficulty, timestamp, num_entries = BLOCK_HEADER.unpack_from(body, 0)
+    position = BLOCK_HEADER.size
+    entries = []
+    for _ in range(num_entries):
+        kind, entry_hash = ENTRY_HEADER.unpack_from(body, position)
+        position += ENTRY_HEADER.size
+        fields = []
+        for _ in range(3 if kind == UPDATE_ENTRY else 2):
+            field_length, = FIELD_LENGTH.unpack_from(body, position)
+            position += FIELD_LENGTH.size
+            fields.append(bytes(body[position:position + field_length]))
+            position += field_length
+        entries.append(EntryRecord(kind, entry_hash, tuple(fields)))
+    return BlockRecord(block_hash, previous_hash, nonce, difficulty, timestamp, tuple(entries))
+
+
+def materialize_entry(record: EntryRecord, previous_entry: BaseEntry, verified: bool = False) -> BaseEntry:
+    sha256_hash = record.sha256_hash if verified else None
+    if record.kind == PUBLISH_ENTRY:
+        return DocumentPublishEntry(previous_entry, *record.fields, sha256_hash=sha256_hash)
+    if record.kind == UPDATE_ENTRY:
+        return DocumentUpdateEntry(previous_entry, *record.fields, sha256_hash=sha256_hash)
+    if record.kind == HOST_LOCATION_ENTRY:
+        return HostLocationEntry(previous_entry, *record.fields, sha256_hash=sha256_hash)
+    raise ValueError(f'Unknown entry kind {record.kind}')
+
+
+def materialize_block(record: BlockRecord, previous_block: BaseBlock, verified: bool = False) -> Block:
+    """
+    Rebuilds a block from its record, the hashes are recomputed from the stored nonce so no mining takes place. The
+    hashes of a verified record, one a checkpoint of this node vouches for, are taken from the record instead
+    """
+    if record.previous_hash != previous_block.sha256_hash:
+        raise ValueError('block does not extend the previous block')
+    previous_entry = previous_block.entries[-1]
+    entries = []
+    for entry_record in record.entries:
+        previous_entry = materialize_entry(entry_record, previous_entry, verified)
+        if not verified and previous_entry.sha256_hash != entry_record.sha256_hash:
+            raise ValueError('entry hash mismatch')
+        entries.append(previous_entry)
+    if verified:
+        return Block(previous_block, entries, nonce=record.nonce, difficulty=record.difficulty,
+                     timestamp=record.timestamp, sha256_hash=record.sha256_hash)
+    if not MIN_BLOCK_HASH_LEADING_ZEROS <= record.difficulty <= MAX_BLOCK_HASH_LEADING_ZEROS:
+        raise ValueError(f'block difficulty {record.difficulty} is out of range')
+    block = Block(previous_block, entries, nonce=record.nonce, difficulty=record.difficulty,
+                  timestamp=record.timestamp)
+    try:
+        block_hash = block.sha256_hash
+    except AssertionError:
+        raise ValueError('block hash does not meet its difficulty')
+    # checked again without an assert, asserts are stripped under python -O
+    if not validate_block_hash(block_hash, record.difficulty):
+        raise ValueError('block hash does not meet its difficulty')
+    if block_hash != record.sha256_hash:
+        raise ValueError('block hash mismatch')
+    return block
+
+
+def _truncate_segment(segment: Path, end: int):
+    """
+    Replaces segment with a copy of its first end bytes. A segment is never shrunk in place: other processes may have
+    it mapped, and reading a page past the end of a mapped file kills the process. They keep the old file until they
+    unmap it
+    """
+    partial = segment.with_suffix('.partial')
+    with open(segment, 'rb') as source, open(partial, 'wb') as target:
+        remaining = end
+        while remaining:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            target.write(chunk)
+            remaining -= len(chunk)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(partial, segment)
+
+
+def segment_header(first_height: int, base_block: BaseBlock) -> bytes:
+    return SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, first_height, base_block.sha256_hash,
+                               base_block.nonce, base_block.difficulty, base_block.timestamp,
+                               base_block.entries[-1].sha256_hash)
+
+
+def read_base_block(buffer) -> BaseBlock:
+    """
+    The block the segments continue from, as recorded in a segment header. Blocks stored after a checkpoint link back
+    to its tail block, which is not stored itself
+    """
+    _, _, _, _, block_hash, nonce, difficulty, timestamp, entry_hash = SEGMENT_HEADER.unpack_from(buffer, 0)
+    if block_hash == RootBlock.get_instance().sha256_hash:
+        return RootBlock.get_instance()
+    return CheckpointBlock(block_hash, nonce, difficulty, timestamp, entry_hash)
+
+
+def _rewrite_header(segment: Path, first_height: int, base_block: BaseBlock):
+    """
+    Replaces segment with one holding only its header, written again when a crash tore it
+    """
+    partial = segment.with_suffix('.partial')
+    with open(partial, 'wb') as f:
+        f.write(segment_header(first_height, base_block))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, segment)
+
+
+class ChainStore:
+    """
+    Append-only segment files holding every block after the root block.
+
+    Appends are buffered and fsync'd every fsync_every blocks or fsync_interval seconds, whichever comes first, so a
+    crash can lose the blocks appended since the last sync. A store that stops being appended to is still synced
+    fsync_interval seconds after the first block it has not synced. A record torn by a crash is detected by its checksum and
+    truncated when the store is opened, a torn segment header is written again. Every segment header records the block
+the store continues from, so the tail block of a checkpoint is known even though it is not stored.
+    """
+
+    def __init__(self, directory: Path, segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 fsync_every: int = DEFAULT_FSYNC_EVERY, fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        self.directory: Final[Path] = directory
+        self.segment_size: Final[int] = segment_size
+        self.fsync_every: Final[int] = fsync_every
+        self.fsync_interval: Final[float] = fsync_interval
+        self._file: Optional[BinaryIO] = None
+        self._unsynced: int = 0
+        self._last_sync: float = monotonic()
+        # the file is synced from the timer's thread as well as the appending one
+        self._lock: Final[Lock] = Lock()
+        self._sync_timer: Optional[Timer] = None
+        self._height: int = 0
+        self._base_block: BaseBlock = RootBlock.get_instance()
+
+        directory.mkdir(parents=True, exist_ok=True)
+        segments = self.segments()
+        if segments:
+            self._height = self._recover(segments[-1])
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def base_height(self) -> int:
+        """
+        Height of the block before the first stored one, 0 unless the store continues from a checkpoint
+        """
+        segments = self.segments()
+        return self._first_height(segments[0]) - 1 if segments else self._height
+
+    @property
+    def base_block(self) -> BaseBlock:
+        """
+        The block at base_height, the root block or the tail block of the checkpoint the store continues from
+        """
+        return self._base_block
+
+    def segments(self) -> List[Path]:
+        return sorted(p for p in self.directory.iterdir() if p.suffix == SEGMENT_SUFFIX)
+
+    def records(self, start: int = 1) -> Iterator[BlockRecord]:
+        for body in self.record_bodies(start):
+            yield decode_block_body(body)
+
+    def record_bodies(self, start: int = 1, stop: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields the encoded blocks from height start up to stop, one record at a time. Segments that end below start
+        are not read
+        """
+        segments = self.segments()
+        first_heights = [self._first_height(segment) for segment in segments]
+        for ix, segment in enumerate(segments):
+            if ix + 1 < len(segments) and first_heights[ix + 1] <= start:
+                continue
+            with open(segment, 'rb') as f:
+                self._read_header(f.read(SEGMENT_HEADER.size))
+                for height, (body, _) in enumerate(read_records(f, SEGMENT_HEADER.size), start=first_heights[ix]):
+                    if stop is not None and height >= stop:
+                        return
+                    if height >= start:
+                        yield body
+
+    def block_hash(self, height: int) -> Optional[bytes]:
+        """
+        Hash of the stored block at height, None if it is not in the segments. The hash of the block just before the
+        first stored one, a checkpoint the store continues from, is read from the first block
+        """
+        segments = self.segments()
+        if segments and height == self._first_height(segments[0]) - 1:
+            for body in self.record_bodies(height + 1, height + 2):
+                return BLOCK_HEADER.unpack_from(body, 0)[1]
+        for body in self.record_bodies(height, height + 1):
+            return BLOCK_HEADER.unpack_from(body, 0)[0]
+        return None
+
+    def load(self, previous_block: Optional[BaseBlock] = None, height: int = 0,
+             verified_height: int = 0) -> Iterator[Block]:
+        """
+        Yields every stored block above height in height order, linked back to previous_block, the block at height.
+        By default every block is loaded and linked back to the root block. Blocks up to verified_height, a checkpoint
+        of this node, are not verified again
+        """
+        if previous_block is None:
+            previous_block = RootBlock.get_instance()
+        for ix, record in enumerate(self.records(height + 1), start=height + 1):
+            previous_block = materialize_block(record, previous_block, verified=ix <= verified_height)
+            yield previous_block
+
+    def append(self, block: BaseBlock):
+        self.append_record(encode_block(block))
+
+    def append_record(self, record: bytes):
+        """
+        Appends an encoded block, the caller has verified that it extends the stored tail
+        """
+        with self._lock:
+            if self._file is None:
+                self._open_segment(self._height + 1)
+            self._file.write(record)
+            self._height += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            elif self._sync_timer is None:
+                # without further appends nothing else would sync the block
+                self._sync_timer = Timer(self.fsync_interval, self.sync)
+                self._sync_timer.name = 'chain-store-sync'
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+            if self._file.tell() >= self.segment_size:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def truncate(self, height: int):
+        """
+        Removes every block above height, used when the chain switches to a fork with more work
+        """
+        if height >= self._height:
+            return
+        self.close()
+        for segment in reversed(self.segments()):
+            first_height = self._first_height(segment)
+            if first_height > height:
+                segment.unlink()
+                continue
+            end = SEGMENT_HEADER.size
+            for ix, (_, offset) in enumerate(self._read_segment(segment)):
+                if first_height + ix > height:
+                    break
+                end = offset
+            _truncate_segment(segment, end)
+            self._open_segment(first_height)
+            break
+        self._height = height
+
+    def reset(self, height: int, base_block: BaseBlock):
+        """
+        Removes every segment and continues the store from base_block at height, used when a node bootstraps from a
+        checkpoint the store does not reach
+        """
+        self.close()
+        for segment in self.segments():
+            segment.unlink()
+        self._height = height
+        self._base_block = base_block
+
+    def flush(self):
+        """
+        Hands the buffered appends to the OS without waiting for them to be durable, so they can be read by other
+        processes mapping the segments
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _sync(self):
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        if self._file is not None and self._unsynced:
+            with SYNC_SECONDS.time():
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = monotonic()
+
+    def _open_segment(self, first_height: int):
+        path = self.directory / f'{first_height:012d}{SEGMENT_SUFFIX}'
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(segment_header(first_height, self._base_block))
+
+    def _first_height(self, segment: Path) -> int:
+        with open(segment, 'rb') as f:
+            return self._read_header(f.read(SEGMENT_HEADER.size))
+
+    @staticmethod
+    def _read_header(buffer) -> int:
+        magic, version, _, first_height = SEGMENT_HEADER.unpack_from(buffer, 0)[:4]
+        if magic != SEGMENT_MAGIC:
+            raise ValueError('not a chain segment')
+        if version != SEGMENT_VERSION:
+            raise ValueError(f'unsupported segment version {version}')
+        return first_height
+
+    def _read_segment(self, segment: Path) -> Iterator[Tuple[bytes, int]]:
+        # a torn tail ends the segment, it is removed by _recover when the store is opened
+        with open(segment, 'rb') as f:
+            self._read_header(f.read(SEGMENT_HEADER.size))
+            yield from read_records(f, SEGMENT_HEADER.size)
+
+    def _recover(self, segment: Path) -> int:
+        """
+        Truncates a torn record at the end of the last segment, returns the height of the last complete block. A
+        segment created just before a crash may not have its whole header, the header is written again from the first
+        height in the segment's name and the header of the first segment. A first segment with a torn header holds no
+        blocks and nothing else records the block the store continues from, it is removed and the store is empty
+        """
+        first_segment = self.segments()[0]
+        with open(segment, 'rb') as f:
+            header = f.read(SEGMENT_HEADER.size)
+        if len(header) < SEGMENT_HEADER.size or header.startswith(bytes(len(SEGMENT_MAGIC))):
+            if segment == first_segment:
+                segment.unlink()
+                return 0
+            with open(first_segment, 'rb') as f:
+                _rewrite_header(segment, int(segment.stem), read_base_block(f.read(SEGMENT_HEADER.size)))
+        with open(first_segment, 'rb') as f:
+            self._base_block = read_base_block(f.read(SEGMENT_HEADER.size))
+        first_height = self._first_height(segment)
+        count = 0
+        valid_end = SEGMENT_HEADER.size
+        for _, valid_end in self._read_segment(segment):
+            count += 1
+        if valid_end != segment.stat().st_size:
+            _truncate_segment(segment, valid_end)
+        self._open_segment(first_height)
+        return first_height + count - 1
@@ -1,20 +1,38 @@
 from hashlib import sha256
-from typing import Final, Optional
+from itertools import islice
+from typing import Final, Iterable, List, Literal, Optional, Sequence, Tuple
 
 from fastecdsa import ecdsa
 from fastecdsa.encoding.der import DEREncoder
+from fastecdsa.point import Point
+
+from merkle import merkle_root
 
 PREV_ENTRY_HASH_KEY: Final[bytes] = 'previous_entry_hash'.encode('utf8')
 DOC_ID_KEY: Final[bytes] = 'doc_id'.encode('utf8')
 PEK_KEY: Final[bytes] = 'public_key'.encode('utf8')
 PREV_DOC_ID_KEY: Final[bytes] = 'previous_doc_id'.encode('utf8')
 IP_ADDRESS_KEY: Final[bytes] = 'ip_address'.encode('utf8')
-BLOCK_SEPERATOR: Final[bytes] = ':'.encode('utf8')
+MERKLE_ROOT_KEY: Final[bytes] = 'merkle_root'.encode('utf8')
+DIFFICULTY_KEY: Final[bytes] = 'difficulty'.encode('utf8')
+TIMESTAMP_KEY: Final[bytes] = 'timestamp'.encode('utf8')
+
+INDIANESS: Final[Literal["little"]] = 'little'
 
 MIN_INT = -2 ** 63
 MAX_INT = 2 ** 63 - 1
 
-BLOCK_HASH_LEADING_ZEROS = 18
+BLOCK_HASH_LEADING_ZEROS = 18  # default difficulty of a block
+MIN_BLOCK_HASH_LEADING_ZEROS: Final[int] = 8
+MAX_BLOCK_HASH_LEADING_ZEROS: Final[int] = 64
+
+# a hash has at least d leading zero bits exactly when it is no greater than _HASH_THRESHOLDS[d]
+_HASH_THRESHOLDS: Final[Tuple[bytes, ...]] = tuple(((1 << (256 - d)) - 1).to_bytes(length=32, byteorder='big')
+                                                   for d in range(MAX_BLOCK_HASH_LEADING_ZEROS + 1))
+# the low two bytes of a nonce, searched in batches of NONCE_BATCH_SIZE nonces sharing their high six bytes
+NONCE_BATCH_SIZE: Final[int] = 2 ** 16
+_NONCE_SUFFIXES: Final[Tuple[bytes, ...]] = tuple(i.to_bytes(length=2, byteorder='big')
+                                                  for i in range(NONCE_BATCH_SIZE))
 
 
 def bytes_32_validator(payload: bytes) -> bytes:
@@ -34,75 +52,142 @@ def int_64_bit_validator(value: int):
     return value
 
 
+def public_key_bytes(public_key: Point) -> bytes:
+    """
+    The public key published in a HostLocationEntry, the x then the y coordinate of its point
+    """
+    return public_key.x.to_bytes(32, INDIANESS) + public_key.y.to_bytes(32, INDIANESS)
+
+
 def doc_id(doc_contents: str, private_key) -> bytes:
     doc_hash = sha256(doc_contents.encode('utf8')).digest()
     a, b = ecdsa.sign(doc_hash, private_key)
     return DEREncoder.encode_signature(a, b)
 
 
+def doc_ids(documents: Sequence[str], private_key) -> List[bytes]:
+    """
+    Signs a batch of documents, run in a worker process so a batch is sent and returned in one round trip
+    """
+    return [doc_id(doc_contents, private_key) for doc_contents in documents]
+
+
 def sha256_hash_entry(entry: 'chain.BaseEntry') -> bytes:
     from entries import BaseDocumentEntry, DocumentUpdateEntry, RootEntry, HostLocationEntry
 
     if isinstance(entry, RootEntry):
         return entry.sha256_hash  # fixed hash value for root
 
+    previous_hash = entry.previous_entry.sha256_hash
+    if isinstance(entry, BaseDocumentEntry):
+        previous_doc_id = entry.previous_doc_id if isinstance(entry, DocumentUpdateEntry) else None
+        return sha256_hash_entry_fields(previous_hash, public_key=entry.public_key, doc_id=entry.doc_id,
+                                        previous_doc_id=previous_doc_id)
+    elif isinstance(entry, HostLocationEntry):
+        return sha256_hash_entry_fields(previous_hash, public_key=entry.public_key, ip_address=entry.ipaddress)
+    return sha256_hash_entry_fields(previous_hash)
+
+
+def sha256_hash_entry_fields(previous_hash: bytes, public_key: Optional[bytes] = None, doc_id: Optional[bytes] = None,
+                             previous_doc_id: Optional[bytes] = None, ip_address: Optional[bytes] = None) -> bytes:
+    """
+    Entry hash computed from the hash of the previous entry and the entry's own fields, without needing the entry
+    """
     hash_builder = sha256()
     hash_builder.update(PREV_ENTRY_HASH_KEY)
-    hash_builder.update(entry.previous_entry.sha256_hash)
+    hash_builder.update(previous_hash)
 
-    if isinstance(entry, BaseDocumentEntry):
-        if isinstance(entry, DocumentUpdateEntry):
+    if doc_id is not None:
+        if previous_doc_id is not None:
             hash_builder.update(PREV_DOC_ID_KEY)
-            hash_builder.update(entry.previous_doc_id)
+            hash_builder.update(previous_doc_id)
 
         hash_builder.update(DOC_ID_KEY)
-        hash_builder.update(entry.doc_id)
+        hash_builder.update(doc_id)
         hash_builder.update(PEK_KEY)
-        hash_builder.update(entry.public_key)
-    elif isinstance(entry, HostLocationEntry):
+        hash_builder.update(public_key)
+    elif ip_address is not None:
         hash_builder.update(IP_ADDRESS_KEY)
-        hash_builder.update(entry.ipaddress)
+        hash_builder.update(ip_address)
         hash_builder.update(PEK_KEY)
-        hash_builder.update(entry.public_key)
+        hash_builder.update(public_key)
 
     return hash_builder.digest()
 
 
-def validate_block_hash(hash_value: bytes):
+def validate_block_hash(hash_value: bytes, difficulty: int = BLOCK_HASH_LEADING_ZEROS):
     assert len(hash_value) == 32
-    # number of leading bytes that must be zero
-    zero_byte_length = BLOCK_HASH_LEADING_ZEROS // 8
-    if any(hash_value[i] != 0 for i in range(zero_byte_length)):
-        return False
-
-    # number of bits that must be zero in the leading non-zero byte
-    zero_bit_length = BLOCK_HASH_LEADING_ZEROS % 8
-    if (hash_value[zero_byte_length] >> (8 - zero_bit_length)) == 0:
-        return True
-    return False
+    # a negative difficulty would index the thresholds from the end
+    assert 0 <= difficulty <= MAX_BLOCK_HASH_LEADING_ZEROS
+    return hash_value <= _HASH_THRESHOLDS[difficulty]
 
 
-def sha256_hash_block(block: 'web_chain.blocks.BaseBlock', nonce: Optional[int]):
+def sha256_hash_block(block: 'web_chain.blocks.BaseBlock', nonce: Optional[int],
+                      miner: Optional['mining.ParallelMiner'] = None):
     hash_builder = _init_hash_builder(block)
     if nonce is not None:
-        hash_builder.update(nonce)
+        hash_builder.update(nonce.to_bytes(length=8, byteorder='big', signed=True))
         hash_value = hash_builder.digest()
-        assert validate_block_hash(hash_value)
+        assert validate_block_hash(hash_value, block.difficulty)
         return nonce, hash_value
 
-    for nonce in range(MIN_INT, MAX_INT):
-        _hash_builder = hash_builder.copy()
-        _hash_builder.update(nonce.to_bytes(length=8, byteorder='big', signed=True))
-        hash_value = _hash_builder.digest()
-        if validate_block_hash(hash_value):
-            return nonce, hash_value
-    raise ValueError(f'Unable to find hash value with {BLOCK_HASH_LEADING_ZEROS} leading zeros')
+    if miner is not None:
+        result = miner.search(block_hash_payload(block), difficulty=block.difficulty)
+    else:
+        result = search_nonce(hash_builder, MIN_INT, MAX_INT, block.difficulty)
+    if result is None:
+        raise ValueError(f'Unable to find hash value with {block.difficulty} leading zeros')
+    return result
+
+
+def search_nonce(hash_builder, start: int, stop: int,
+                 difficulty: int = BLOCK_HASH_LEADING_ZEROS) -> Optional[Tuple[int, bytes]]:
+    """
+    Returns the first nonce in [start, stop) that produces a valid block hash, or None if there is no such nonce.
+
+    The high six bytes of the nonce are hashed once per batch, each attempt then only hashes one of the precomputed
+    two byte suffixes and compares the digest against the difficulty threshold
+    """
+    threshold = _HASH_THRESHOLDS[difficulty]
+    nonce = start
+    while nonce < stop:
+        high = nonce >> 16
+        batch_builder = hash_builder.copy()
+        batch_builder.update(high.to_bytes(length=6, byteorder='big', signed=True))
+        copy = batch_builder.copy
+        for suffix in islice(_NONCE_SUFFIXES, nonce & 0xffff, min(stop - (high << 16), NONCE_BATCH_SIZE)):
+            _hash_builder = copy()
+            _hash_builder.update(suffix)
+            hash_value = _hash_builder.digest()
+            if hash_value <= threshold:
+                return (high << 16) | int.from_bytes(suffix, byteorder='big'), hash_value
+        nonce = (high + 1) << 16
+    return None
+
+
+def block_hash_payload(block: 'web_chain.blocks.BaseBlock') -> bytes:
+    """
+    Bytes hashed ahead of the nonce, sha256(payload) is equivalent to _init_hash_builder(block)
+    """
+    return block_hash_payload_root(block.previous_block.sha256_hash, block.merkle_tree.root, block.difficulty,
+                                   block.timestamp)
+
+
+def block_hash_payload_fields(previous_hash: bytes, entry_hashes: Iterable[bytes], difficulty: int,
+                              timestamp: int) -> bytes:
+    return block_hash_payload_root(previous_hash, merkle_root(list(entry_hashes)), difficulty, timestamp)
+
+
+def block_hash_payload_root(previous_hash: bytes, entries_root: bytes, difficulty: int, timestamp: int) -> bytes:
+    """
+    A block commits to its entries through the root of a Merkle tree over their hashes, so one entry can be shown to
+    be in the block with log2(entries) sibling hashes
+    """
+    # the header is hashed too so a block's recorded difficulty and time cannot be changed after it is mined
+    return b''.join((bytes(previous_hash), MERKLE_ROOT_KEY, entries_root,
+                     DIFFICULTY_KEY, difficulty.to_bytes(length=1, byteorder='big'),
+                     TIMESTAMP_KEY, timestamp.to_bytes(length=8, byteorder='big', signed=True)))
 
 
 def _init_hash_builder(block: 'web_chain.blocks.BaseBlock'):
-    hash_builder = sha256()
-    hash_builder.update(block.previous_block.sha256_hash)
-    for entry in block.entries:
-        hash_builder.update(BLOCK_SEPERATOR)
-        hash_builder.update(entry.sha256_hash)
-    return hash_builder
+    return sha256(block_hash_payload(block))
@@ -0,0 +1,155 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from itertools import islice
+from typing import Final, Iterator, List, Optional, Tuple
+
+from blocks import BaseBlock, RootBlock
+from chain_store import decode_block_body, encode_block_body, BlockRecord, EntryRecord, PUBLISH_ENTRY, UPDATE_ENTRY, \
+    HOST_LOCATION_ENTRY
+from chain_utils import sha256_hash_entry_fields, block_hash_payload_fields, validate_block_hash, \
+    MIN_BLOCK_HASH_LEADING_ZEROS, MAX_BLOCK_HASH_LEADING_ZEROS
+from mapped_chain import MappedBlock
+
+DEFAULT_CHUNK_SIZE: Final[int] = 64
+
+
+def _entry_record_hash(previous_hash: bytes, record: EntryRecord) -> bytes:
+    if record.kind == PUBLISH_ENTRY:
+        doc_id, public_key = record.fields
+        return sha256_hash_entry_fields(previous_hash, public_key=public_key, doc_id=doc_id)
+    if record.kind == UPDATE_ENTRY:
+        previous_doc_id, doc_id, public_key = record.fields
+        return sha256_hash_entry_fields(previous_hash, public_key=public_key, doc_id=doc_id,
+                                        previous_doc_id=previous_doc_id)
+    if record.kind == HOST_LOCATION_ENTRY:
+        ip_address, public_key = record.fields
+        return sha256_hash_entry_fields(previous_hash, public_key=public_key, ip_address=ip_address)
+    raise ValueError(f'Unknown entry kind {record.kind}')
+
+
+def verify_block_body(previous_hash: bytes, previous_entry_hash: bytes, body: bytes,
+                      min_difficulty: int = MIN_BLOCK_HASH_LEADING_ZEROS) -> Optional[str]:
+    """
+    Checks one encoded block against the hashes claimed by its predecessors, returns None if it is valid or the reason
+    it is not. Only the claimed hashes are used so every block can be checked independently of the others
+    """
+    return verify_block_record(previous_hash, previous_entry_hash, decode_block_body(body), min_difficulty)
+
+
+def verify_block_record(previous_hash: bytes, previous_entry_hash: bytes, record: BlockRecord,
+                        min_difficulty: int = MIN_BLOCK_HASH_LEADING_ZEROS) -> Optional[str]:
+    if record.previous_hash != previous_hash:
+        return 'does not extend the previous block'
+    if not min_difficulty <= record.difficulty <= MAX_BLOCK_HASH_LEADING_ZEROS:
+        return f'difficulty {record.difficulty} is out of range'
+    entry_hash = previous_entry_hash
+    for ix, entry in enumerate(record.entries):
+        if _entry_record_hash(entry_hash, entry) != entry.sha256_hash:
+            return f'entry {ix} hash mismatch'
+        entry_hash = entry.sha256_hash
+
+    hash_builder = sha256(block_hash_payload_fields(previous_hash, (e.sha256_hash for e in record.entries),
+                                                    record.difficulty, record.timestamp))
+    hash_builder.update(record.nonce.to_bytes(length=8, byteorder='big', signed=True))
+    if hash_builder.digest() != record.sha256_hash:
+        return 'block hash mismatch'
+    if not validate_block_hash(record.sha256_hash, record.difficulty):
+        return 'block hash does not meet the difficulty'
+    return None
+
+
+def _block_body(block: BaseBlock) -> bytes:
+    if isinstance(block, MappedBlock):
+        return bytes(block.record_body)
+    return encode_block_body(block)
+
+
+class ChainValidator:
+    """
+    Verifies every entry hash, block hash and block difficulty from the root block to a tail.
+
+    Blocks are walked and checked iteratively, never through the recursive hash properties, and the last verified
+    block is remembered so that validating a longer chain only checks the blocks added since. With more than one
+    worker the blocks are checked in a process pool.
+    """
+
+    def __init__(self, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        assert workers > 0
+        self.workers: Final[int] = workers
+        self.chunk_size: Final[int] = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._verified_block: BaseBlock = RootBlock.get_instance()
+        self._verified_hash: bytes = RootBlock.get_instance().sha256_hash
+        self._verified_height: int = 0
+
+    def __enter__(self) -> 'ChainValidator':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def verified_height(self) -> int:
+        return self._verified_height
+
+    @property
+    def verified_hash(self) -> bytes:
+        return self._verified_hash
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def validate(self, tail: BaseBlock) -> int:
+        """
+        Returns the height of tail once it is verified, raises ValueError naming the first invalid block
+        """
+        root = RootBlock.get_instance()
+        pending: List[BaseBlock] = []
+        block = tail
+        while block is not root and block is not self._verified_block and block.sha256_hash != self._verified_hash:
+            pending.append(block)
+            block = block.previous_block
+        if block is root:
+            # first run, or the tail is on a different fork than the verified block
+            self._set_verified(root, 0)
+        pending.reverse()
+
+        height = self._verified_height
+        for block, error in zip(pending, self._verify(pending)):
+            height += 1
+            if error is not None:
+                raise ValueError(f'block at height {height} is invalid: {error}')
+            self._set_verified(block, height)
+        return self._verified_height
+
+    def _set_verified(self, block: BaseBlock, height: int):
+        self._verified_block = block
+        self._verified_hash = bytes(block.sha256_hash)
+        self._verified_height = height
+
+    def _items(self, blocks: List[BaseBlock]) -> Iterator[Tuple[bytes, bytes, bytes]]:
+        previous = self._verified_block
+        for block in blocks:
+            yield bytes(previous.sha256_hash), bytes(previous.entries[-1].sha256_hash), _block_body(block)
+            previous = block
+
+    def _verify(self, blocks: List[BaseBlock]) -> Iterator[Optional[str]]:
+        items = self._items(blocks)
+        if self.workers == 1:
+            for item in items:
+                yield verify_block_body(*item)
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        # submit a bounded window at a time so the encoded blocks of a long chain are never all held in memory
+        window = self.workers * self.chunk_size * 4
+        while True:
+            batch = list(islice(items, window))
+            if not batch:
+                return
+            yield from self._executor.map(verify_block_body, *zip(*batch), chunksize=self.chunk_size)
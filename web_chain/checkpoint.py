@@ -0,0 +1,303 @@
+import os
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from struct import Struct
+from typing import BinaryIO, Final, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+from fastecdsa import ecdsa, keys
+from fastecdsa.curve import P256
+from fastecdsa.encoding.der import DEREncoder
+from fastecdsa.point import Point
+
+from blocks import BaseBlock, CheckpointBlock
+from document_db import DocumentDatabase, IndexSnapshot, LocationRow, SnapshotRow
+
+CHECKPOINT_MAGIC: Final[bytes] = b'WEBCHKPT'
+CHECKPOINT_VERSION: Final[int] = 1
+CHECKPOINT_SUFFIX: Final[str] = '.ckpt'
+# magic, version, height, tail hash, nonce, difficulty, timestamp ms, hash of the tail's last entry, chain work
+CHECKPOINT_HEADER: Final[Struct] = Struct('>8sHQ32sqBq32s32s')
+# number of locations, number of documents, offset of the first document
+CHECKPOINT_FOOTER: Final[Struct] = Struct('>QQQ')
+FIELD_LENGTH: Final[Struct] = Struct('>H')
+DOCUMENT_HEIGHT: Final[Struct] = Struct('>Q')
+
+DEFAULT_CHECKPOINT_INTERVAL: Final[int] = 10_000
+DEFAULT_KEEP: Final[int] = 2
+READ_CHUNK_SIZE: Final[int] = 2 ** 20
+
+
+class CheckpointHeader(NamedTuple):
+    height: int
+    block_hash: bytes
+    nonce: int
+    difficulty: int
+    timestamp: int
+    entry_hash: bytes
+    work: int
+
+
+def _field(value: Optional[bytes]) -> bytes:
+    # doc_ids, public keys and addresses are never empty, an empty field is a missing value
+    value = b'' if value is None else bytes(value)
+    return FIELD_LENGTH.pack(len(value)) + value
+
+
+def _read_field(f: BinaryIO) -> Optional[bytes]:
+    length, = FIELD_LENGTH.unpack(f.read(FIELD_LENGTH.size))
+    return f.read(length) if length else None
+
+
+def write_checkpoint(path: Path, tail: BaseBlock, height: int, work: int, snapshot: IndexSnapshot, private_key: int):
+    """
+    Writes the tail and a snapshot of the index at the tail's height, signed with private_key. The file is written
+    next to path and renamed once complete, so a crash never leaves a partial checkpoint behind
+    """
+    if snapshot.height != height:
+        raise ValueError(f'snapshot is at height {snapshot.height}, not {height}')
+    hasher = sha256()
+    partial = path.with_suffix('.partial')
+    with open(partial, 'wb') as f:
+        def write(data: bytes):
+            hasher.update(data)
+            f.write(data)
+
+        write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, height, bytes(tail.sha256_hash), tail.nonce,
+                                     tail.difficulty, tail.timestamp, bytes(tail.entries[-1].sha256_hash),
+                                     work.to_bytes(32, 'big')))
+        num_locations = 0
+        for public_key, ip_address in snapshot.locations():
+            write(_field(public_key) + _field(ip_address))
+            num_locations += 1
+        documents_offset = f.tell()
+        num_documents = 0
+        for doc_id, previous_doc_id, public_key, document_height in snapshot.documents():
+            write(_field(doc_id) + _field(previous_doc_id) + _field(public_key) + DOCUMENT_HEIGHT.pack(document_height))
+            num_documents += 1
+        write(CHECKPOINT_FOOTER.pack(num_locations, num_documents, documents_offset))
+        signature = DEREncoder.encode_signature(*ecdsa.sign(hasher.digest(), private_key))
+        f.write(signature + FIELD_LENGTH.pack(len(signature)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+class Checkpoint:
+    """
+    A signed checkpoint file. The header is read when it is opened, the index rows are streamed from the file so a
+    snapshot of any size is restored in constant memory
+    """
+
+    def __init__(self, path: Path):
+        self.path: Final[Path] = path
+        try:
+            self._read_header()
+        except (struct.error, OSError):
+            raise ValueError('truncated checkpoint')
+
+    def _read_header(self):
+        with open(self.path, 'rb') as f:
+            buffer = f.read(CHECKPOINT_HEADER.size)
+            if len(buffer) < CHECKPOINT_HEADER.size:
+                raise ValueError('truncated checkpoint')
+            magic, version, *fields, work = CHECKPOINT_HEADER.unpack(buffer)
+            if magic != CHECKPOINT_MAGIC:
+                raise ValueError('not a checkpoint')
+            if version != CHECKPOINT_VERSION:
+                raise ValueError(f'unsupported checkpoint version {version}')
+            self.header: CheckpointHeader = CheckpointHeader(*fields, int.from_bytes(work, 'big'))
+
+            f.seek(-FIELD_LENGTH.size, os.SEEK_END)
+            signature_length, = FIELD_LENGTH.unpack(f.read(FIELD_LENGTH.size))
+            self._signed_length: int = f.seek(-(FIELD_LENGTH.size + signature_length), os.SEEK_END)
+            self._signature: bytes = f.read(signature_length)
+            f.seek(self._signed_length - CHECKPOINT_FOOTER.size)
+            self.num_locations, self.num_documents, self._documents_offset = \
+                CHECKPOINT_FOOTER.unpack(f.read(CHECKPOINT_FOOTER.size))
+
+    @property
+    def height(self) -> int:
+        return self.header.height
+
+    @property
+    def work(self) -> int:
+        return self.header.work
+
+    def verify(self, public_keys: Sequence[Point]) -> bool:
+        """
+        True if the checkpoint was signed by one of public_keys and has not been modified since
+        """
+        hasher = sha256()
+        with open(self.path, 'rb') as f:
+            remaining = self._signed_length
+            while remaining:
+                chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return False
+                hasher.update(chunk)
+                remaining -= len(chunk)
+        try:
+            signature = DEREncoder.decode_signature(self._signature)
+        except Exception:
+            return False
+        return any(ecdsa.verify(signature, hasher.digest(), public_key, P256) for public_key in public_keys)
+
+    def extends(self, store: 'chain_store.ChainStore') -> bool:
+        """
+        True if a chain can continue from this checkpoint with the blocks in store: the store is empty or holds the
+        checkpoint's block. A store that switched to a fork since the checkpoint was written does not
+        """
+        if not store.segments():
+            return True
+        return store.block_hash(self.height) == self.header.block_hash
+
+    def block(self) -> CheckpointBlock:
+        header = self.header
+        return CheckpointBlock(header.block_hash, header.nonce, header.difficulty, header.timestamp, header.entry_hash)
+
+    def locations(self) -> Iterator[LocationRow]:
+        with open(self.path, 'rb') as f:
+            f.seek(CHECKPOINT_HEADER.size)
+            for _ in range(self.num_locations):
+                yield _read_field(f), _read_field(f)
+
+    def documents(self) -> Iterator[SnapshotRow]:
+        with open(self.path, 'rb') as f:
+            f.seek(self._documents_offset)
+            for _ in range(self.num_documents):
+                doc_id, previous_doc_id, public_key = _read_field(f), _read_field(f), _read_field(f)
+                height, = DOCUMENT_HEIGHT.unpack(f.read(DOCUMENT_HEIGHT.size))
+                yield doc_id, previous_doc_id, public_key, height
+
+
+def checkpoints(directory: Path) -> List[Path]:
+    """
+    Checkpoint files in directory, oldest first
+    """
+    if not directory.is_dir():
+        return []
+    return sorted(p for p in directory.iterdir() if p.suffix == CHECKPOINT_SUFFIX)
+
+
+def latest_checkpoint(directory: Path, public_keys: Sequence[Point],
+                      store: Optional['chain_store.ChainStore'] = None) -> Optional[Checkpoint]:
+    """
+    The highest checkpoint in directory signed by one of public_keys, corrupt or untrusted files are skipped. Given a
+    store, so are checkpoints the stored blocks do not extend
+    """
+    for path in reversed(checkpoints(directory)):
+        try:
+            checkpoint = Checkpoint(path)
+        except ValueError:
+            continue
+        if checkpoint.verify(public_keys) and (store is None or checkpoint.extends(store)):
+            return checkpoint
+    return None
+
+
+def load_signing_key(path: Path) -> Tuple[int, Point]:
+    """
+    The key checkpoints are signed with, generated and saved to path the first time. Its public key is saved next to it
+    for the nodes that trust this node's checkpoints
+    """
+    if path.exists():
+        return keys.import_key(str(path), curve=P256)
+    private_key, public_key = keys.gen_keypair(P256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    keys.export_key(private_key, P256, str(path))
+    keys.export_key(public_key, P256, str(path.with_suffix('.pub.pem')))
+    return private_key, public_key
+
+
+def download_checkpoint(url: str, directory: Path) -> Path:
+    """
+    Streams the latest checkpoint of the node at url into directory, it is only trusted once verified
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with httpx.stream('GET', f'{url.rstrip("/")}/checkpoint', timeout=30.0) as response:
+        response.raise_for_status()
+        height = int(response.headers['X-Checkpoint-Height'])
+        path = directory / f'{height:012d}{CHECKPOINT_SUFFIX}'
+        with open(path, 'wb') as f:
+            for chunk in response.iter_bytes(READ_CHUNK_SIZE):
+                f.write(chunk)
+    return path
+
+
+class Checkpointer:
+    """
+    Writes a checkpoint every interval blocks and keeps the newest keep of them.
+
+    The index snapshot is opened in the ordered database writes, right after the new block's, and written on a
+    background thread, so the chain lock is never held for it. Checkpoints of blocks removed when the chain switches
+    to a fork are deleted
+    """
+
+    def __init__(self, chain_state: 'chain_state.ChainState', directory: Path, private_key: int,
+                 interval: int = DEFAULT_CHECKPOINT_INTERVAL, keep: int = DEFAULT_KEEP):
+        if chain_state.database is None:
+            raise ValueError('checkpoints are taken from the document database')
+        assert interval > 0 and keep > 0
+        self.chain_state: Final['chain_state.ChainState'] = chain_state
+        self.directory: Final[Path] = directory
+        self.private_key: Final[int] = private_key
+        self.interval: Final[int] = interval
+        self.keep: Final[int] = keep
+        self._executor: Final[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=1,
+                                                                        thread_name_prefix='checkpointer')
+        directory.mkdir(parents=True, exist_ok=True)
+        chain_state.add_listener(self._on_append)
+        chain_state.add_rewind_listener(self._on_rewind)
+
+    def _on_append(self, block: BaseBlock, height: int):
+        if height % self.interval == 0:
+            self._submit(block, height)
+
+    def _on_rewind(self, height: int):
+        # checkpoints of the blocks being removed would bring them back on restart
+        for path in checkpoints(self.directory):
+            if int(path.stem) > height:
+                path.unlink()
+
+    def checkpoint(self) -> Future:
+        """
+        Checkpoints the current tail, the future completes with the checkpoint's path once it is written
+        """
+        with self.chain_state.lock:
+            if self.chain_state.height == self.chain_state.base_height:
+                raise ValueError('no blocks since the last checkpoint')
+            written = self._submit(self.chain_state.tail, self.chain_state.height)
+        self.chain_state.write_database()
+        return written
+
+    def _submit(self, block: BaseBlock, height: int) -> Future:
+        snapshot = Future()
+
+        def open_snapshot(database: DocumentDatabase):
+            try:
+                snapshot.set_result(database.snapshot())
+            except BaseException as e:
+                snapshot.set_exception(e)
+                raise
+        # opened between the database writes of this block and the next one, so it holds exactly the blocks up to it
+        self.chain_state.with_database(open_snapshot)
+        return self._executor.submit(self._write, block, height, self.chain_state.work, snapshot)
+
+    def _write(self, block: BaseBlock, height: int, work: int, snapshot: Future) -> Path:
+        path = self.directory / f'{height:012d}{CHECKPOINT_SUFFIX}'
+        with snapshot.result() as index_snapshot:
+            write_checkpoint(path, block, height, work, index_snapshot, self.private_key)
+        with self.chain_state.lock:
+            if self.chain_state.height_of(block.sha256_hash) != height:
+                # the chain switched to a fork while the checkpoint was written
+                path.unlink()
+                raise ValueError(f'block {height} was removed from the chain before it was checkpointed')
+        for old in checkpoints(self.directory)[:-self.keep]:
+            old.unlink()
+        return path
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,77 @@
+from abc import ABC, abstractmethod
+from math import log2
+from typing import Final, List
+
+from blocks import BaseBlock, RootBlock
+from chain_utils import BLOCK_HASH_LEADING_ZEROS, MIN_BLOCK_HASH_LEADING_ZEROS, MAX_BLOCK_HASH_LEADING_ZEROS
+
+DEFAULT_TARGET_INTERVAL_MS: Final[int] = 1_000
+DEFAULT_WINDOW: Final[int] = 16
+DEFAULT_MAX_STEP: Final[int] = 2
+
+
+class DifficultyController(ABC):
+    """
+    Chooses the difficulty of the block mined on top of a tail
+    """
+    # number of blocks, the tail included, that the difficulty on top of a tail is computed from
+    window: int = 0
+
+    @abstractmethod
+    def next_difficulty(self, tail: BaseBlock) -> int:
+        ...
+
+
+class FixedDifficulty(DifficultyController):
+
+    def __init__(self, difficulty: int = BLOCK_HASH_LEADING_ZEROS):
+        assert MIN_BLOCK_HASH_LEADING_ZEROS <= difficulty <= MAX_BLOCK_HASH_LEADING_ZEROS
+        self.difficulty: Final[int] = difficulty
+
+    def next_difficulty(self, tail: BaseBlock) -> int:
+        return self.difficulty
+
+
+class RetargetingDifficulty(DifficultyController):
+    """
+    Retargets the difficulty after every block so blocks are mined every target_interval_ms on average.
+
+    The hash rate is estimated from the last window blocks: a block of difficulty d takes 2 ** d hashes on average,
+    so the work of the window divided by the time between its first and last timestamps is the hashes per
+    millisecond, and log2(hash rate * target interval) is the difficulty that would have taken the target interval.
+    The difficulty moves at most max_step bits per block so a single slow or lucky block cannot swing it
+    """
+
+    def __init__(self, target_interval_ms: int = DEFAULT_TARGET_INTERVAL_MS, window: int = DEFAULT_WINDOW,
+                 initial: int = BLOCK_HASH_LEADING_ZEROS, minimum: int = MIN_BLOCK_HASH_LEADING_ZEROS,
+                 maximum: int = MAX_BLOCK_HASH_LEADING_ZEROS, max_step: int = DEFAULT_MAX_STEP):
+        assert target_interval_ms > 0 and window > 1 and max_step > 0
+        assert MIN_BLOCK_HASH_LEADING_ZEROS <= minimum <= initial <= maximum <= MAX_BLOCK_HASH_LEADING_ZEROS
+        self.target_interval_ms: Final[int] = target_interval_ms
+        self.window: Final[int] = window
+        self.initial: Final[int] = initial
+        self.minimum: Final[int] = minimum
+        self.maximum: Final[int] = maximum
+        self.max_step: Final[int] = max_step
+
+    def next_difficulty(self, tail: BaseBlock) -> int:
+        root = RootBlock.get_instance()
+        if tail is root:
+            return self.initial
+
+        blocks: List[BaseBlock] = []
+        block = tail
+        while block is not root and len(blocks) < self.window:
+            blocks.append(block)
+            block = block.previous_block
+        if len(blocks) < 2:
+            return self._clamp(tail.difficulty, tail.difficulty)
+
+        # a block is timestamped before it is mined, so the window ends where the work of the newest block begins
+        elapsed_ms = max(blocks[0].timestamp - blocks[-1].timestamp, 1)
+        work = sum(2 ** block.difficulty for block in blocks[1:])
+        return self._clamp(round(log2(work * self.target_interval_ms / elapsed_ms)), tail.difficulty)
+
+    def _clamp(self, difficulty: int, previous: int) -> int:
+        difficulty = min(max(difficulty, previous - self.max_step), previous + self.max_step)
+        return min(max(difficulty, self.minimum), self.maximum)
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Final, Optional
+
+DEFAULT_MAX_BYTES: Final[int] = 64 * 2 ** 20
+DEFAULT_MAX_ITEM_BYTES: Final[int] = 2 ** 20
+
+
+class ByteLRUCache:
+    """
+    Least recently used cache of document contents bounded by the total size of the cached documents.
+
+    Documents are immutable, so entries are only ever evicted, never invalidated
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_item_bytes: int = DEFAULT_MAX_ITEM_BYTES):
+        assert 0 <= max_item_bytes <= max_bytes
+        self.max_bytes: Final[int] = max_bytes
+        self.max_item_bytes: Final[int] = max_item_bytes
+        self._items: Final[OrderedDict] = OrderedDict()
+        self._lock: Final[Lock] = Lock()
+        self._size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._items
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: bytes) -> bool:
+        """
+        Returns False if the value is larger than max_item_bytes and was not cached
+        """
+        if len(value) > self.max_item_bytes:
+            return False
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+        return True
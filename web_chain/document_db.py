@@ -0,0 +1,261 @@
+import sqlite3
+from pathlib import Path
+from threading import local, Lock
+from typing import Final, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from blocks import BaseBlock
+from chain_index import MAX_VERSIONS, follow_versions
+from entries import BaseDocumentEntry, DocumentUpdateEntry, HostLocationEntry
+
+# the schema designed in research/document_db_benchmark.py, with the height of the block holding each document
+DDL: Final[str] = '''
+CREATE TABLE IF NOT EXISTS location (
+    public_key_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    public_key BLOB UNIQUE NOT NULL,
+    ip_address BLOB
+);
+CREATE TABLE IF NOT EXISTS document (
+    doc_id BLOB PRIMARY KEY NOT NULL,
+    previous_doc_id BLOB,
+    public_key_id INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    FOREIGN KEY(public_key_id) REFERENCES location(public_key_id)
+);
+CREATE INDEX IF NOT EXISTS document_previous_doc_id ON document(previous_doc_id);
+CREATE TABLE IF NOT EXISTS chain (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    height INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO chain (id, height) VALUES (0, 0);
+'''
+
+INSERT_PUBLIC_KEY: Final[str] = 'INSERT OR IGNORE INTO location (public_key) VALUES (?)'
+UPSERT_LOCATION: Final[str] = '''
+INSERT INTO location (public_key, ip_address) VALUES (?, ?)
+ON CONFLICT(public_key) DO UPDATE SET ip_address = excluded.ip_address
+'''
+INSERT_DOCUMENT: Final[str] = '''
+INSERT OR REPLACE INTO document (doc_id, previous_doc_id, public_key_id, height)
+SELECT ?, ?, public_key_id, ? FROM location WHERE public_key = ?
+'''
+UPDATE_HEIGHT: Final[str] = 'UPDATE chain SET height = ? WHERE id = 0'
+SELECT_HEIGHT: Final[str] = 'SELECT height FROM chain WHERE id = 0'
+
+SELECT_DOCUMENT: Final[str] = '''
+SELECT document.doc_id, document.previous_doc_id, location.public_key, location.ip_address, document.height
+FROM document
+JOIN location ON document.public_key_id = location.public_key_id
+WHERE document.doc_id = ?
+'''
+SELECT_LOCATION: Final[str] = 'SELECT ip_address FROM location WHERE public_key = ?'
+SELECT_ALL_LOCATIONS: Final[str] = 'SELECT public_key, ip_address FROM location ORDER BY public_key_id'
+SELECT_ALL_DOCUMENTS: Final[str] = '''
+SELECT document.doc_id, document.previous_doc_id, location.public_key, document.height
+FROM document
+JOIN location ON document.public_key_id = location.public_key_id
+WHERE document.height <= ?
+'''
+# the document followed by every version it replaced, newest first. Depth is bounded as nothing on the chain stops
+# an update from naming a later version, or itself, as its previous version
+SELECT_PREVIOUS_VERSIONS: Final[str] = '''
+WITH RECURSIVE versions(doc_id, previous_doc_id, depth) AS (
+    SELECT doc_id, previous_doc_id, 0 FROM document WHERE doc_id = ?
+    UNION ALL
+    SELECT document.doc_id, document.previous_doc_id, versions.depth + 1
+    FROM document JOIN versions ON document.doc_id = versions.previous_doc_id
+    WHERE versions.depth < ?
+)
+SELECT doc_id FROM versions ORDER BY depth
+'''
+# the version that replaced the document, the latest one if it was replaced more than once like in chain_index
+SELECT_NEXT_VERSION: Final[str] = '''
+SELECT doc_id FROM document WHERE previous_doc_id = ? ORDER BY height DESC, rowid DESC LIMIT 1
+'''
+
+
+class DocumentRow(NamedTuple):
+    doc_id: bytes
+    previous_doc_id: Optional[bytes]
+    public_key: bytes
+    ip_address: Optional[bytes]
+    height: int
+
+
+# public key and ip address
+LocationRow = Tuple[bytes, Optional[bytes]]
+# doc_id, previous_doc_id, public key and height
+SnapshotRow = Tuple[bytes, Optional[bytes], bytes, int]
+
+
+class IndexSnapshot:
+    """
+    A read transaction on its own connection, every row read from it is as of the height when it was opened however
+    many blocks are committed meanwhile
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection: Final[sqlite3.Connection] = connection
+        connection.execute('BEGIN')
+        # the first read starts the transaction's snapshot of the WAL
+        self.height: Final[int] = connection.execute(SELECT_HEIGHT).fetchone()[0]
+
+    def locations(self) -> Iterator[LocationRow]:
+        return self._connection.execute(SELECT_ALL_LOCATIONS)
+
+    def documents(self) -> Iterator[SnapshotRow]:
+        return self._connection.execute(SELECT_ALL_DOCUMENTS, (self.height,))
+
+    def close(self):
+        self._connection.execute('ROLLBACK')
+        self._connection.close()
+
+    def __enter__(self) -> 'IndexSnapshot':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DocumentDatabase:
+    """
+    SQLite index of the documents and host locations on the chain, written one transaction per block.
+
+    The database is in WAL mode so readers never wait for the writer, and every thread reads through its own
+    connection, which keeps the prepared statements of the queries it runs cached. Blocks at or below the recorded
+    height are skipped, so replaying a chain into an existing database only adds the blocks it is missing
+    """
+
+    def __init__(self, path: Union[Path, str], timeout: float = 5.0):
+        self.path: Final[str] = str(path)
+        self.timeout: Final[float] = timeout
+        self._local: local = local()
+        self._connections: Final[List[sqlite3.Connection]] = []
+        self._lock: Final[Lock] = Lock()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.executescript(DDL)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # autocommit, writes are grouped in explicit transactions
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False, cached_statements=64)
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('PRAGMA foreign_keys = ON')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @property
+    def height(self) -> int:
+        return self._connection().execute(SELECT_HEIGHT).fetchone()[0]
+
+    def add_block(self, block: BaseBlock, height: int):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if height <= connection.execute(SELECT_HEIGHT).fetchone()[0]:
+                connection.execute('ROLLBACK')
+                return
+            locations, public_keys, documents = [], [], []
+            for entry in block.entries:
+                if isinstance(entry, BaseDocumentEntry):
+                    previous_doc_id = bytes(entry.previous_doc_id) if isinstance(entry, DocumentUpdateEntry) else None
+                    public_keys.append((bytes(entry.public_key),))
+                    documents.append((bytes(entry.doc_id), previous_doc_id, height, bytes(entry.public_key)))
+                elif isinstance(entry, HostLocationEntry):
+                    locations.append((bytes(entry.public_key), bytes(entry.ipaddress)))
+            connection.executemany(UPSERT_LOCATION, locations)
+            connection.executemany(INSERT_PUBLIC_KEY, public_keys)
+            connection.executemany(INSERT_DOCUMENT, documents)
+            connection.execute(UPDATE_HEIGHT, (height,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def truncate(self, height: int):
+        """
+        Removes the documents of the blocks above height, used when the chain store lost blocks the database had
+        already committed. Host locations are not rolled back, a location is replaced by the next one published anyway
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM document WHERE height > ?', (height,))
+            connection.execute(UPDATE_HEIGHT, (height,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def snapshot(self) -> IndexSnapshot:
+        """
+        Opens a consistent view of the index, taken in ChainState.with_database it is the index as of the tail
+        """
+        return IndexSnapshot(sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                             check_same_thread=False))
+
+    def restore(self, height: int, locations: Iterable[LocationRow], documents: Iterable[SnapshotRow]):
+        """
+        Replaces the whole index with a snapshot of it at height, in one transaction. The locations include the public
+        key of every document's publisher
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM document')
+            connection.execute('DELETE FROM location')
+            connection.executemany(UPSERT_LOCATION, locations)
+            connection.executemany(INSERT_DOCUMENT, ((doc_id, previous_doc_id, document_height, public_key)
+                                                     for doc_id, previous_doc_id, public_key, document_height
+                                                     in documents))
+            connection.execute(UPDATE_HEIGHT, (height,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def lookup(self, doc_id: bytes) -> Optional[DocumentRow]:
+        row = self._connection().execute(SELECT_DOCUMENT, (doc_id,)).fetchone()
+        return None if row is None else DocumentRow(*row)
+
+    def location(self, public_key: bytes) -> Optional[bytes]:
+        row = self._connection().execute(SELECT_LOCATION, (public_key,)).fetchone()
+        return None if row is None else row[0]
+
+    def previous_versions(self, doc_id: bytes, max_versions: int = MAX_VERSIONS) -> List[bytes]:
+        """
+        doc_id followed by the doc_ids it replaced, newest first, empty if doc_id is not indexed
+        """
+        rows = self._connection().execute(SELECT_PREVIOUS_VERSIONS, (doc_id, max_versions - 1))
+        return [row[0] for row in rows]
+
+    def history(self, doc_id: bytes, max_versions: int = MAX_VERSIONS) -> List[bytes]:
+        """
+        Every version of the document, oldest first, the versions that replaced doc_id included. Read like
+        chain_index.ChainIndex.history, forward to the latest version and back, for processes that only have the
+        database
+        """
+        connection = self._connection()
+
+        def next_version(version: bytes) -> Optional[bytes]:
+            row = connection.execute(SELECT_NEXT_VERSION, (version,)).fetchone()
+            return None if row is None else row[0]
+        latest = follow_versions(doc_id, next_version, max_versions)[-1]
+        return self.previous_versions(latest, max_versions)[::-1]
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT count(*) FROM document').fetchone()[0]
+
+    def __contains__(self, doc_id: bytes) -> bool:
+        return self.lookup(doc_id) is not None
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = local()
@@ -0,0 +1,131 @@
+import os
+from hashlib import sha256
+from pathlib import Path
+from random import choice
+from typing import Final, Iterable, Iterator, List, Tuple, Union
+from uuid import uuid4
+
+TMP_SUFFIX: Final[str] = '.tmp'
+SHARD_DEPTH: Final[int] = 2
+
+
+class DocumentStore:
+    """
+    Documents stored under root in subdirectories named after the leading bytes of sha256(doc_id).
+
+    With two levels of 256 shards no directory holds more than a few thousand documents at millions of documents,
+    and a document is located without listing any directory.
+    """
+
+    def __init__(self, root: Path):
+        self.root: Final[Path] = root
+
+    def path(self, doc_id: bytes) -> Path:
+        digest = sha256(doc_id).hexdigest()
+        shards = (digest[2 * i:2 * i + 2] for i in range(SHARD_DEPTH))
+        return self.root.joinpath(*shards, doc_id.hex())
+
+    def put(self, doc_id: bytes, contents: Union[str, bytes], fsync: bool = False) -> Path:
+        """
+        Writes the document atomically, readers never observe a partially written document
+        """
+        if isinstance(contents, str):
+            contents = contents.encode('utf8')
+        path = self.path(doc_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{uuid4().hex}{TMP_SUFFIX}')
+        with open(tmp, 'wb') as f:
+            f.write(contents)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return path
+
+    def put_many(self, documents: Iterable[Tuple[bytes, Union[str, bytes]]]) -> List[Path]:
+        """
+        Durably writes a batch of documents: every temp file is written and fsync'd, renamed into place and then each
+        shard directory touched by the batch is fsync'd once so the renames survive a crash
+        """
+        staged = []
+        for doc_id, contents in documents:
+            if isinstance(contents, str):
+                contents = contents.encode('utf8')
+            path = self.path(doc_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'{path.name}.{uuid4().hex}{TMP_SUFFIX}')
+            with open(tmp, 'wb') as f:
+                f.write(contents)
+                f.flush()
+                os.fsync(f.fileno())
+            staged.append((tmp, path))
+
+        for tmp, path in staged:
+            os.replace(tmp, path)
+        for directory in {path.parent for _, path in staged}:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return [path for _, path in staged]
+
+    def get(self, doc_id: bytes) -> bytes:
+        """
+        Raises FileNotFoundError if there is no such document
+        """
+        return self.path(doc_id).read_bytes()
+
+    def exists(self, doc_id: bytes) -> bool:
+        return self.path(doc_id).is_file()
+
+    def __contains__(self, doc_id: bytes) -> bool:
+        return self.exists(doc_id)
+
+    def __iter__(self) -> Iterator[bytes]:
+        """
+        Yields every doc_id, one shard directory is listed at a time
+        """
+        for shard in self._shards(self.root, SHARD_DEPTH):
+            yield from self._doc_ids(shard)
+
+    def sample(self) -> bytes:
+        """
+        A random doc_id found by descending through random shards, raises IndexError if the store is empty.
+        Documents in sparsely filled shards are more likely to be picked
+        """
+        for _ in range(64):
+            directory = self.root
+            for _ in range(SHARD_DEPTH):
+                shards = self._list_dirs(directory)
+                if not shards:
+                    break
+                directory = choice(shards)
+            else:
+                doc_ids = list(self._doc_ids(directory))
+                if doc_ids:
+                    return choice(doc_ids)
+        raise IndexError('no documents in store')
+
+    @staticmethod
+    def _list_dirs(directory: Path) -> List[Path]:
+        try:
+            with os.scandir(directory) as it:
+                return [Path(e.path) for e in it if e.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    @classmethod
+    def _shards(cls, directory: Path, depth: int) -> Iterator[Path]:
+        if depth == 0:
+            yield directory
+            return
+        for shard in sorted(cls._list_dirs(directory)):
+            yield from cls._shards(shard, depth - 1)
+
+    @staticmethod
+    def _doc_ids(shard: Path) -> Iterator[bytes]:
+        with os.scandir(shard) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(TMP_SUFFIX):
+                    yield bytes.fromhex(e.name)
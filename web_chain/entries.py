@@ -1,11 +1,38 @@
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from typing import Final, Optional
 
 import chain_utils
 from chain_utils import bytes_32_validator, bytes_64_validator
 
+MAX_INTERNED: Final[int] = 4_096
+
+
+@lru_cache(maxsize=MAX_INTERNED)
+def intern_bytes(value: bytes) -> bytes:
+    """
+    The first copy seen of value. Every entry from a publisher carries the same public key, entries share a single
+    copy of it. Only the most recently used values are kept, so publishers that come and go do not grow the cache
+    """
+    return value
+
+
+def _hash_predecessors(entry: 'BaseEntry'):
+    """
+    Hashes the predecessors that have not been hashed yet, oldest first, so hashing an entry only ever looks one
+    entry back instead of recursing through previous_entry for the length of a freshly loaded chain
+    """
+    pending = []
+    previous = entry.previous_entry
+    while getattr(previous, '_sha256_hash', False) is None:
+        pending.append(previous)
+        previous = previous.previous_entry
+    for previous in reversed(pending):
+        previous.sha256_hash
+
 
 class BaseEntry(ABC):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -19,6 +46,7 @@ class BaseEntry(ABC):
 
 
 class RootEntry(BaseEntry):
+    __slots__ = ()
     _INSTANCE: Optional['RootEntry'] = None
     _SHA_256_HASH: Final[bytes] = (0).to_bytes(length=8, byteorder='big')
 
@@ -46,7 +74,27 @@ class RootEntry(BaseEntry):
         return RootEntry._SHA_256_HASH
 
 
+class CheckpointEntry(BaseEntry):
+    __slots__ = ('_sha256_hash',)
+
+    """
+    Stands in for the last entry of a checkpointed chain, only its hash is known
+    """
+
+    def __init__(self, sha256_hash: bytes):
+        self._sha256_hash: Final[bytes] = bytes_32_validator(sha256_hash)
+
+    @property
+    def previous_entry(self) -> 'CheckpointEntry':
+        return self
+
+    @property
+    def sha256_hash(self) -> bytes:
+        return self._sha256_hash
+
+
 class BaseDocumentEntry(BaseEntry, ABC):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -60,16 +108,19 @@ class BaseDocumentEntry(BaseEntry, ABC):
 
 
 class DocumentPublishEntry(BaseDocumentEntry):
+    __slots__ = ('_previous_entry', '_doc_id', '_public_key', '_sha256_hash')
 
-    def __init__(self, previous_entry: BaseEntry, doc_id: bytes, public_key: bytes):
+    def __init__(self, previous_entry: BaseEntry, doc_id: bytes, public_key: bytes,
+                 sha256_hash: Optional[bytes] = None):
         self._previous_entry: Final[BaseEntry] = previous_entry
         self._doc_id: Final[bytes] = doc_id
-        self._public_key: Final[bytes] = public_key
-        self._sha256_hash: Optional[bytes] = None
+        self._public_key: Final[bytes] = intern_bytes(public_key)
+        self._sha256_hash: Optional[bytes] = sha256_hash
 
     @property
     def sha256_hash(self) -> bytes:
         if self._sha256_hash is None:
+            _hash_predecessors(self)
             self._sha256_hash = chain_utils.sha256_hash_entry(self)
         return self._sha256_hash
 
@@ -87,18 +138,21 @@ class DocumentPublishEntry(BaseDocumentEntry):
 
 
 class DocumentUpdateEntry(BaseDocumentEntry):
+    __slots__ = ('_previous_entry', 'previous_doc_id', '_doc_id', '_public_key', '_sha256_hash')
     PREV_DOC_ID_KEY: Final[bytes] = 'previous_doc_id'.encode('utf8')
 
-    def __init__(self, previous_entry: BaseEntry, previous_doc_id: bytes, doc_id: bytes, public_key: bytes):
+    def __init__(self, previous_entry: BaseEntry, previous_doc_id: bytes, doc_id: bytes, public_key: bytes,
+                 sha256_hash: Optional[bytes] = None):
         self._previous_entry: Final[BaseEntry] = previous_entry
         self.previous_doc_id: Final[bytes] = bytes_32_validator(previous_doc_id)
         self._doc_id: Final[bytes] = bytes_32_validator(doc_id)
-        self._public_key: Final[bytes] = bytes_32_validator(public_key)
-        self._sha256_hash: Optional[bytes] = None
+        self._public_key: Final[bytes] = intern_bytes(bytes_32_validator(public_key))
+        self._sha256_hash: Optional[bytes] = sha256_hash
 
     @property
     def sha256_hash(self) -> bytes:
         if self._sha256_hash is None:
+            _hash_predecessors(self)
             self._sha256_hash = chain_utils.sha256_hash_entry(self)
         return self._sha256_hash
 
@@ -116,18 +170,21 @@ class DocumentUpdateEntry(BaseDocumentEntry):
 
 
 class HostLocationEntry(BaseEntry):
+    __slots__ = ('_previous_entry', '_sha256_hash', 'ipaddress', 'public_key')
 
-    def __init__(self, previous_entry: BaseEntry, ipaddress: bytes, public_key: bytes):
+    def __init__(self, previous_entry: BaseEntry, ipaddress: bytes, public_key: bytes,
+                 sha256_hash: Optional[bytes] = None):
         self._previous_entry: Final[BaseEntry] = previous_entry
-        self._sha256_entry: Optional[bytes] = None
-        self.ipaddress: Final[bytes] = ipaddress
-        self.public_key: Final[bytes] = bytes_64_validator(public_key)
+        self._sha256_hash: Optional[bytes] = sha256_hash
+        self.ipaddress: Final[bytes] = intern_bytes(ipaddress)
+        self.public_key: Final[bytes] = intern_bytes(bytes_64_validator(public_key))
 
     @property
     def sha256_hash(self) -> bytes:
-        if self._sha256_entry is None:
-            self._sha256_entry = chain_utils.sha256_hash_entry(self)
-        return self._sha256_entry
+        if self._sha256_hash is None:
+            _hash_predecessors(self)
+            self._sha256_hash = chain_utils.sha256_hash_entry(self)
+        return self._sha256_hash
 
     @property
     def previous_entry(self) -> 'BaseEntry':
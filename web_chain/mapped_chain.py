@@ -0,0 +1,309 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Final, Iterator, List, Optional, Tuple
+
+from blocks import BaseBlock, RootBlock
+from chain_store import SEGMENT_HEADER, SEGMENT_MAGIC, SEGMENT_VERSION, SEGMENT_SUFFIX, RECORD_LENGTH, RECORD_CRC, \
+    BLOCK_HEADER, ENTRY_HEADER, FIELD_LENGTH, PUBLISH_ENTRY, UPDATE_ENTRY, HOST_LOCATION_ENTRY, read_base_block
+from entries import BaseEntry, BaseDocumentEntry
+
+_HASH_SIZE: Final[int] = 32
+
+
+def _stat(path: Path, field: str) -> Optional[int]:
+    """
+    A field of the file's stat, None if the writer has removed the file
+    """
+    try:
+        return getattr(path.stat(), field)
+    except FileNotFoundError:
+        return None
+
+
+class MappedEntry(BaseEntry):
+    """
+    Entry whose fields are memoryview slices of a mapped segment, nothing is copied or re-hashed
+    """
+    __slots__ = ('_block', '_position', '_view', '_fields')
+
+    def __init__(self, block: 'MappedBlock', position: int, view: memoryview, fields: Tuple[memoryview, ...]):
+        self._block: Final[MappedBlock] = block
+        self._position: Final[int] = position
+        self._view: Final[memoryview] = view
+        self._fields: Final[Tuple[memoryview, ...]] = fields
+
+    @property
+    def sha256_hash(self) -> memoryview:
+        return self._view[1:1 + _HASH_SIZE]
+
+    @property
+    def previous_entry(self) -> BaseEntry:
+        if self._position > 0:
+            return self._block.entries[self._position - 1]
+        return self._block.previous_block.entries[-1]
+
+
+class MappedDocumentPublishEntry(MappedEntry, BaseDocumentEntry):
+    __slots__ = ()
+
+    @property
+    def doc_id(self) -> memoryview:
+        return self._fields[0]
+
+    @property
+    def public_key(self) -> memoryview:
+        return self._fields[1]
+
+
+class MappedDocumentUpdateEntry(MappedEntry, BaseDocumentEntry):
+    __slots__ = ()
+
+    @property
+    def previous_doc_id(self) -> memoryview:
+        return self._fields[0]
+
+    @property
+    def doc_id(self) -> memoryview:
+        return self._fields[1]
+
+    @property
+    def public_key(self) -> memoryview:
+        return self._fields[2]
+
+
+class MappedHostLocationEntry(MappedEntry):
+    __slots__ = ()
+
+    @property
+    def ipaddress(self) -> memoryview:
+        return self._fields[0]
+
+    @property
+    def public_key(self) -> memoryview:
+        return self._fields[1]
+
+
+_ENTRY_TYPES: Final = {
+    PUBLISH_ENTRY: (MappedDocumentPublishEntry, 2),
+    UPDATE_ENTRY: (MappedDocumentUpdateEntry, 3),
+    HOST_LOCATION_ENTRY: (MappedHostLocationEntry, 2),
+}
+
+
+class MappedBlock(BaseBlock):
+    """
+    Block backed by one record of a mapped segment, entries are parsed the first time they are accessed
+    """
+    __slots__ = ('_chain', '_height', '_body', '_entries')
+
+    def __init__(self, chain: 'MappedChain', height: int, body: memoryview):
+        self._chain: Final[MappedChain] = chain
+        self._height: Final[int] = height
+        self._body: Final[memoryview] = body
+        self._entries: Optional[Tuple[MappedEntry, ...]] = None
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def record_body(self) -> memoryview:
+        return self._body
+
+    @property
+    def sha256_hash(self) -> memoryview:
+        return self._body[:_HASH_SIZE]
+
+    @property
+    def previous_block(self) -> BaseBlock:
+        return self._chain.block(self._height - 1)
+
+    @property
+    def nonce(self) -> int:
+        return BLOCK_HEADER.unpack_from(self._body, 0)[2]
+
+    @property
+    def difficulty(self) -> int:
+        return BLOCK_HEADER.unpack_from(self._body, 0)[3]
+
+    @property
+    def timestamp(self) -> int:
+        return BLOCK_HEADER.unpack_from(self._body, 0)[4]
+
+    @property
+    def entries(self) -> Tuple[MappedEntry, ...]:
+        if self._entries is None:
+            self._entries = tuple(self._parse_entries())
+        return self._entries
+
+    def _parse_entries(self) -> Iterator[MappedEntry]:
+        body = self._body
+        num_entries = BLOCK_HEADER.unpack_from(body, 0)[5]
+        offset = BLOCK_HEADER.size
+        for position in range(num_entries):
+            start = offset
+            kind = body[offset]
+            entry_type, num_fields = _ENTRY_TYPES[kind]
+            offset += ENTRY_HEADER.size
+            fields = []
+            for _ in range(num_fields):
+                length, = FIELD_LENGTH.unpack_from(body, offset)
+                offset += FIELD_LENGTH.size
+                fields.append(body[offset:offset + length])
+                offset += length
+            yield entry_type(self, position, body[start:offset], tuple(fields))
+
+
+class MappedChain:
+    """
+    Read-only view of the segment files written by chain_store.ChainStore.
+
+    Segments are memory-mapped, so processes reading the same chain share the page cache rather than each holding
+    their own copy of the blocks. Only the offset of every block is kept in memory, blocks and entries are views
+    created on access. refresh picks up blocks appended since the segments were mapped. A store continued from a
+    checkpoint starts above the root block, blocks up to base_height are not in its segments. The block at base_height
+    is the checkpoint's tail block, recorded in the segment headers, so the first stored block links back to it.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory: Final[Path] = directory
+        self._maps: Final[List[mmap.mmap]] = []
+        self._segments: Final[List[Path]] = []
+        # the file each segment was mapped from, a segment truncated by the writer is a new file under the same name
+        self._inodes: Final[List[int]] = []
+        self._block_segment: Final[array] = array('I')
+        self._block_offset: Final[array] = array('Q')
+        self._scanned: List[int] = []
+        self._base_height: int = 0
+        self._base_block: BaseBlock = RootBlock.get_instance()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self._block_offset)
+
+    @property
+    def base_height(self) -> int:
+        return self._base_height
+
+    @property
+    def height(self) -> int:
+        return self._base_height + len(self._block_offset)
+
+    @property
+    def tail(self) -> BaseBlock:
+        return self.block(self.height)
+
+    def block(self, height: int) -> BaseBlock:
+        if height == 0:
+            return RootBlock.get_instance()
+        if height == self._base_height:
+            return self._base_block
+        if not self._base_height < height <= self.height:
+            raise IndexError(f'no block at height {height}')
+        segment = self._maps[self._block_segment[height - self._base_height - 1]]
+        offset = self._block_offset[height - self._base_height - 1]
+        length, = RECORD_LENGTH.unpack_from(segment, offset)
+        start = offset + RECORD_LENGTH.size
+        return MappedBlock(self, height, memoryview(segment)[start:start + length])
+
+    def blocks(self, start: Optional[int] = None, stop: Optional[int] = None) -> Iterator[BaseBlock]:
+        start = self._base_height + 1 if start is None else start
+        stop = self.height + 1 if stop is None else stop
+        for height in range(start, stop):
+            yield self.block(height)
+
+    def refresh(self):
+        """
+        Maps the blocks appended since the last refresh. Segments the writer has only just created, or removed while
+        they are listed, are left for a later refresh, as is the whole chain while its directory does not exist
+        """
+        try:
+            segments = sorted(p for p in self.directory.iterdir() if p.suffix == SEGMENT_SUFFIX)
+        except FileNotFoundError:
+            segments = []
+        for ix, segment in enumerate(self._segments):
+            if ix >= len(segments) or segments[ix] != segment or _stat(segment, 'st_ino') != self._inodes[ix]:
+                # the chain switched to a fork and the writer replaced or removed the segment, its blocks are read again
+                self._forget(ix)
+                break
+        for ix, segment in enumerate(segments):
+            if ix < len(self._segments) and _stat(segment, 'st_size') == len(self._maps[ix]):
+                continue
+            # mmap cannot grow, a segment is mapped again to see the appended records
+            segment_map = self._map(segment)
+            if segment_map is None:
+                break
+            mapped, inode = segment_map
+            if ix < len(self._segments) and inode != self._inodes[ix]:
+                self._forget(ix)  # replaced since it was checked above
+            if ix < len(self._segments):
+                self._maps[ix] = mapped
+            else:
+                self._segments.append(segment)
+                self._inodes.append(inode)
+                self._maps.append(mapped)
+                self._scanned.append(SEGMENT_HEADER.size)
+                if ix == 0:
+                    self._base_height = SEGMENT_HEADER.unpack_from(mapped, 0)[3] - 1
+                    self._base_block = read_base_block(mapped)
+            self._scan(ix)
+
+    def _forget(self, ix: int):
+        """
+        Drops segment ix, the segments after it and their blocks. Blocks already obtained keep their old maps
+        """
+        keep = bisect_left(self._block_segment, ix)
+        del self._block_segment[keep:]
+        del self._block_offset[keep:]
+        del self._segments[ix:]
+        del self._inodes[ix:]
+        del self._maps[ix:]
+        del self._scanned[ix:]
+
+    def close(self):
+        """
+        Unmaps the segments, every block or entry obtained from this chain must have been released
+        """
+        for m in self._maps:
+            m.close()
+        self._maps.clear()
+
+    @staticmethod
+    def _map(segment: Path) -> Optional[Tuple[mmap.mmap, int]]:
+        """
+        The mapped segment and the inode of the file mapped, None if the writer has removed the segment or not written
+        its header yet
+        """
+        try:
+            with open(segment, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                # the size is read from the file that is mapped, an empty file cannot be mapped at all
+                if stat.st_size < SEGMENT_HEADER.size:
+                    return None
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        magic, version = SEGMENT_HEADER.unpack_from(mapped, 0)[:2]
+        if magic == bytes(len(SEGMENT_MAGIC)):
+            # the file was extended before the header reached it
+            mapped.close()
+            return None
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f'{segment} is not a version {SEGMENT_VERSION} chain segment')
+        return mapped, stat.st_ino
+
+    def _scan(self, ix: int):
+        mapped = self._maps[ix]
+        offset = self._scanned[ix]
+        while offset + RECORD_LENGTH.size <= len(mapped):
+            length, = RECORD_LENGTH.unpack_from(mapped, offset)
+            end = offset + RECORD_LENGTH.size + length + RECORD_CRC.size
+            if end > len(mapped):
+                break  # record still being written
+            self._block_segment.append(ix)
+            self._block_offset.append(offset)
+            offset = end
+        self._scanned[ix] = offset
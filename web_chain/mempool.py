@@ -0,0 +1,148 @@
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, Condition
+from time import monotonic
+from typing import Callable, Deque, Final, Iterable, List, Optional, Tuple
+
+from blocks import Block
+from chain_state import ChainState, mine_and_commit
+from entries import BaseEntry
+
+# entries are linked to their predecessor, so a pending entry is a factory that builds it once its position is known
+EntryFactory = Callable[[BaseEntry], BaseEntry]
+
+DEFAULT_MAX_ENTRIES: Final[int] = 256
+DEFAULT_MAX_WAIT_MS: Final[int] = 1_000
+DEFAULT_MAX_PENDING: Final[int] = 4_096
+
+
+class Mempool:
+    """
+    Pending entries from all publishers waiting to be sealed into a block.
+
+    A batch is released once max_entries entries are pending or the oldest pending entry has waited max_wait_ms.
+    submit blocks while max_pending entries are already waiting so publishers cannot outrun the miner.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_wait_ms: int = DEFAULT_MAX_WAIT_MS,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        assert 0 < max_entries <= max_pending
+        assert max_wait_ms >= 0
+        self.max_entries: Final[int] = max_entries
+        self.max_wait: Final[float] = max_wait_ms / 1_000
+        self.max_pending: Final[int] = max_pending
+        self._pending: Final[Deque[Tuple[EntryFactory, Future, float]]] = deque()
+        self._condition: Final[Condition] = Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def submit(self, factory: EntryFactory) -> Future:
+        """
+        Returns a future resolved with the committed block that contains the entry
+        """
+        return self.submit_many([factory])[0]
+
+    def submit_many(self, factories: Iterable[EntryFactory]) -> List[Future]:
+        """
+        Entries submitted together stay contiguous, they only span several blocks when there are more than max_entries
+        """
+        factories = list(factories)
+        futures = [Future() for _ in factories]
+        with self._condition:
+            # an oversized batch would never fit, it is admitted as soon as it is submitted instead
+            if len(factories) <= self.max_pending:
+                self._condition.wait_for(lambda: self._closed or
+                                         len(self._pending) + len(factories) <= self.max_pending)
+            if self._closed:
+                raise RuntimeError('mempool is closed')
+            now = monotonic()
+            self._pending.extend((factory, future, now) for factory, future in zip(factories, futures))
+            self._condition.notify_all()
+        return futures
+
+    def take(self) -> List[Tuple[EntryFactory, Future]]:
+        """
+        Blocks until a batch is ready, an empty list means the mempool was closed and has been drained
+        """
+        with self._condition:
+            while True:
+                if len(self._pending) >= self.max_entries or (self._closed and self._pending):
+                    break
+                if self._closed:
+                    return []
+                if self._pending:
+                    remaining = self._pending[0][2] + self.max_wait - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+
+            batch = []
+            while self._pending and len(batch) < self.max_entries:
+                factory, future, _ = self._pending.popleft()
+                batch.append((factory, future))
+            self._condition.notify_all()
+            return batch
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class BlockSealer(Thread):
+    """
+    Seals batches taken from the mempool into blocks until the mempool is closed and drained
+    """
+
+    def __init__(self, chain_state: ChainState, mempool: Mempool, miner: Optional['mining.ParallelMiner'] = None):
+        super().__init__()
+        self.chain_state: Final[ChainState] = chain_state
+        self.mempool: Final[Mempool] = mempool
+        self.miner: Final[Optional['mining.ParallelMiner']] = miner
+        self.retries: int = 0
+        self.blocks_sealed: int = 0
+        self.entries_sealed: int = 0
+
+    def run(self) -> None:
+        super().run()
+        while True:
+            batch = self.mempool.take()
+            if not batch:
+                break
+            try:
+                block = self.seal(factory for factory, _ in batch)
+            except Exception as e:
+                # only this batch is lost, the entries queued after it are still sealed
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                raise
+            for _, future in batch:
+                future.set_result(block)
+
+    def seal(self, factories: Iterable[EntryFactory]) -> Block:
+        factories = list(factories)
+
+        def build_entries(previous: BaseEntry) -> List[BaseEntry]:
+            entries = []
+            for factory in factories:
+                previous = factory(previous)
+                entries.append(previous)
+            return entries
+
+        block, retries = mine_and_commit(self.chain_state, build_entries, self.miner)
+        self.retries += retries
+        self.blocks_sealed += 1
+        self.entries_sealed += len(factories)
+        return block
@@ -0,0 +1,81 @@
+from hashlib import sha256
+from typing import Final, List, Optional, Sequence, Tuple
+
+# leaves and internal nodes are hashed with different prefixes so an internal node can never pass as a leaf
+LEAF_PREFIX: Final[bytes] = b'\x00'
+NODE_PREFIX: Final[bytes] = b'\x01'
+EMPTY_ROOT: Final[bytes] = sha256(b'').digest()
+
+# sibling hash and whether the sibling is on the left
+ProofStep = Tuple[bytes, bool]
+
+
+def leaf_hash(value: bytes) -> bytes:
+    return sha256(LEAF_PREFIX + value).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleTree:
+    """
+    Binary Merkle tree over a sequence of values, the entry hashes of a block.
+
+    Levels are built the first time the root or a proof is requested and kept, so every proof after the first only
+    reads cached nodes. A node without a sibling is carried up to the next level unchanged rather than paired with a
+    copy of itself, so two different sequences of values never share a root
+    """
+    __slots__ = ('_values', '_levels')
+
+    def __init__(self, values: Sequence[bytes]):
+        self._values: Final[Sequence[bytes]] = values
+        self._levels: Optional[List[List[bytes]]] = None
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _build(self) -> List[List[bytes]]:
+        if self._levels is None:
+            level = [leaf_hash(bytes(v)) for v in self._values]
+            levels = [level]
+            while len(level) > 1:
+                level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                         for i in range(0, len(level), 2)]
+                levels.append(level)
+            self._levels = levels
+        return self._levels
+
+    @property
+    def root(self) -> bytes:
+        if not self._values:
+            return EMPTY_ROOT
+        return self._build()[-1][0]
+
+    def proof(self, index: int) -> List[ProofStep]:
+        """
+        The sibling hashes from the leaf at index up to the root, log2(n) steps
+        """
+        if not 0 <= index < len(self._values):
+            raise IndexError(f'no leaf at index {index}')
+        steps = []
+        for level in self._build()[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                steps.append((level[sibling], sibling < index))
+            index //= 2
+        return steps
+
+
+def merkle_root(values: Sequence[bytes]) -> bytes:
+    return MerkleTree(values).root
+
+
+def proof_root(value: bytes, proof: Sequence[ProofStep]) -> bytes:
+    """
+    The root reached from a leaf value through its proof, the value is included if this equals the tree's root
+    """
+    node = leaf_hash(value)
+    for sibling, sibling_is_left in proof:
+        node = node_hash(sibling, node) if sibling_is_left else node_hash(node, sibling)
+    return node
@@ -0,0 +1,241 @@
+import sys
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter as _StackCounter
+from threading import Lock, Thread, Event
+from time import perf_counter
+from typing import Final, Dict, Iterator, List, Optional, Tuple, Callable
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, LabelValues, float]
+
+# seconds, from a fast lock acquisition to a slow fsync
+DEFAULT_BUCKETS: Final[Tuple[float, ...]] = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+DEFAULT_SAMPLE_INTERVAL: Final[float] = 0.005
+
+
+class Metric(ABC):
+    type: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name: Final[str] = name
+        self.documentation: Final[str] = documentation
+        self.label_names: Final[Tuple[str, ...]] = label_names
+        self._lock: Final[Lock] = Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        ...
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        for name, labels, value in self.samples():
+            yield f'{name}{self._format_labels(labels)} {value!r}'
+
+    def _format_labels(self, labels: LabelValues) -> str:
+        if not labels:
+            return ''
+        # the le label of histogram buckets follows the metric's own labels
+        names = self.label_names + ('le',) if len(labels) > len(self.label_names) else self.label_names
+        pairs = (f'{n}="{_escape(v)}"' for n, v in zip(names, labels))
+        return '{' + ','.join(pairs) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Final[Dict[LabelValues, float]] = {}
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    """
+    Value read when the metrics are rendered, so nothing is done on the hot path
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self._read: Final[Callable[[], float]] = read
+
+    def samples(self) -> Iterator[Sample]:
+        yield self.name, (), float(self._read())
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets: Final[Tuple[float, ...]] = tuple(sorted(buckets))
+        # per label values: a count per bucket plus one for +Inf, and the sum of the observations
+        self._counts: Final[Dict[LabelValues, List[int]]] = {}
+        self._sums: Final[Dict[LabelValues, float]] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        ix = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[ix] += 1
+            self._sums[labels] += value
+
+    def time(self, labels: LabelValues = ()) -> '_Timer':
+        return _Timer(self, labels)
+
+    def count(self, labels: LabelValues = ()) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            snapshot = [(labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items()]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + ('+Inf' if bound == float('inf') else repr(bound),), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_labels', '_start')
+
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(perf_counter() - self._start, self._labels)
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Final[Dict[str, Metric]] = {}
+        self._lock: Final[Lock] = Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registering a metric under a name that is already taken replaces the previous metric
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY: Final[Registry] = Registry()
+
+
+def counter(name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+
+def histogram(name: str, documentation: str, label_names: Tuple[str, ...] = (),
+              buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+
+def gauge(name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, read))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread each interval seconds while it is running and counts identical stacks.
+
+    Only the sampling thread does any work, the profiled threads are not traced, so it can be switched on in a
+    running server. report returns the stacks in the collapsed format read by flamegraph.pl and speedscope
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval: float = interval
+        self._stacks: Final[_StackCounter] = _StackCounter()
+        self._lock: Final[Lock] = Lock()
+        self._stopped: Final[Event] = Event()
+        self._thread: Optional[Thread] = None
+        self.samples: int = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: Optional[float] = None):
+        if self._thread is not None:
+            return
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        return self.report()
+
+    def report(self) -> str:
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def _run(self):
+        own_id = self._thread.ident
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id != own_id:
+                        self._stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
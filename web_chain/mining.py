@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from hashlib import sha256
+from typing import Final, Optional, Tuple, Dict
+
+from chain_utils import search_nonce, MIN_INT, MAX_INT, BLOCK_HASH_LEADING_ZEROS
+
+DEFAULT_CHUNK_SIZE: Final[int] = 2 ** 15
+
+
+def _search_chunk(payload: bytes, start: int, stop: int, difficulty: int) -> Optional[Tuple[int, bytes]]:
+    return search_nonce(sha256(payload), start, stop, difficulty)
+
+
+class ParallelMiner:
+    """
+    Splits the nonce space into fixed size chunks that are searched by a pool of worker processes.
+
+    Chunks are handed out in nonce order and the lowest valid nonce is returned, so the result is identical to the
+    serial search in chain_utils.sha256_hash_block. Once a valid nonce is found no further chunks are started and
+    queued chunks are cancelled, at most one chunk per worker is still in flight.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        assert chunk_size > 0
+        self.workers: Final[int] = workers if workers is not None else os.cpu_count() or 1
+        assert self.workers > 0
+        self.chunk_size: Final[int] = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'ParallelMiner':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn rather than fork, the pool is usually created while other threads hold ChainState.lock
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def search(self, payload: bytes, start: int = MIN_INT, stop: int = MAX_INT,
+               difficulty: int = BLOCK_HASH_LEADING_ZEROS) -> Optional[Tuple[int, bytes]]:
+        """
+        Same contract as chain_utils.search_nonce with the hash builder given as the bytes it was initialised with
+        """
+        executor = self.executor
+        pending: Dict[Future, int] = {}
+        next_start = start
+        found: Optional[Tuple[int, bytes]] = None
+
+        def submit():
+            nonlocal next_start
+            chunk_stop = min(next_start + self.chunk_size, stop)
+            pending[executor.submit(_search_chunk, payload, next_start, chunk_stop, difficulty)] = next_start
+            next_start = chunk_stop
+
+        try:
+            # keep one extra chunk queued per worker so workers never idle waiting on this thread
+            while next_start < stop and len(pending) < 2 * self.workers:
+                submit()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    result = future.result()
+                    if result is not None and (found is None or result[0] < found[0]):
+                        found = result
+
+                if found is not None:
+                    # chunks after the found nonce are no longer needed, earlier ones may still hold a lower nonce
+                    for future, chunk_start in list(pending.items()):
+                        if chunk_start > found[0]:
+                            future.cancel()
+                            del pending[future]
+                else:
+                    while next_start < stop and len(pending) < 2 * self.workers:
+                        submit()
+        finally:
+            for future in pending:
+                future.cancel()
+        return found
@@ -1,132 +1,352 @@
+import asyncio
+import multiprocessing
 import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from threading import Thread, Lock
-from typing import Optional, Literal, Final
-from uuid import uuid4
+from typing import Optional, Final, Callable, Iterator, List, Sequence
 
-from fastapi import FastAPI, Response
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, FileResponse
 from fastecdsa import keys, curve
 from fastecdsa.curve import P256
-from fastecdsa.keys import export_key
+from fastecdsa.keys import export_key, import_key
 
-from blocks import RootBlock, BaseBlock, Block
-from chain_utils import doc_id
-from entries import HostLocationEntry, DocumentPublishEntry, BaseDocumentEntry, BaseEntry
+from api import ChainHead, InclusionProof, PublishedDocument, PublishRequest, PublishResponse, VersionHistory, \
+    METRICS_CONTENT_TYPE, STREAM_CHUNK_SIZE, document_response, inclusion_proof, not_found
+from blocks import BaseBlock
+from chain_state import ChainState
+from chain_store import ChainStore
+from chain_utils import doc_ids
+from checkpoint import Checkpointer, DEFAULT_CHECKPOINT_INTERVAL, checkpoints, download_checkpoint, \
+    latest_checkpoint, load_signing_key
+from difficulty import RetargetingDifficulty, DEFAULT_TARGET_INTERVAL_MS
+from document_cache import ByteLRUCache, DEFAULT_MAX_BYTES
+from document_db import DocumentDatabase
+from document_store import DocumentStore
+from entries import DocumentPublishEntry, DocumentUpdateEntry
+from mempool import Mempool, BlockSealer
+from metrics import REGISTRY, SamplingProfiler, counter, gauge, histogram
+from mining import ParallelMiner
+from producer import Producer, ProducerGroup
+from shared_head import SharedHead, HeadPublisher, HEAD_FILE
+from sync import PeerSync, PEER_HEADER, DEFAULT_POLL_INTERVAL
+from wire import STREAM_CONTENT_TYPE, coalesce, encode_stream
+from write_behind import DocumentWriter
 
-INDIANESS: Final[Literal["little"]] = 'little'
+MAX_BULK_DOCUMENTS: Final[int] = 100_000
+SIGNING_CHUNK_SIZE: Final[int] = 256
 
-DOC_TEMPLATE: Final[str] = '''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <title>Example Document</title>
-    <p>This is an example document</p>
-    <p>{}</p>
-</head>
-<body>
+INDEX_LOOKUPS: Final = counter('webchain_index_lookups_total', 'Document lookups in the chain index', ('result',))
+DOCUMENT_READ_SECONDS: Final = histogram('webchain_document_read_seconds', 'Time spent reading a document file')
 
-</body>
-</html>'''
 
+class Node:
+    """
+    A node's chain, documents and the services running next to them. The server builds one from the environment when
+    it starts, nothing is created on disk when poc is imported, tests build one from their own parts
+    """
 
-class ChainState:
+    def __init__(self, state: ChainState, document_store: DocumentStore, document_cache: Optional[ByteLRUCache] = None,
+                 mempool: Optional[Mempool] = None, writer: Optional[DocumentWriter] = None,
+                 peer_sync: Optional[PeerSync] = None, signing_pool: Optional[Executor] = None,
+                 checkpoint_dir: Optional[Path] = None, on_startup: Sequence[Callable] = (),
+                 on_shutdown: Sequence[Callable] = ()):
+        self.state: Final[ChainState] = state
+        self.document_store: Final[DocumentStore] = document_store
+        self.document_cache: Final[ByteLRUCache] = document_cache if document_cache is not None else ByteLRUCache()
+        self.mempool: Final[Optional[Mempool]] = mempool
+        self.writer: Final[Optional[DocumentWriter]] = writer
+        self.peer_sync: Final[Optional[PeerSync]] = peer_sync
+        self.signing_pool: Final[Executor] = signing_pool if signing_pool is not None else ThreadPoolExecutor()
+        self.checkpoint_dir: Final[Optional[Path]] = checkpoint_dir
+        self.profiler: Final[SamplingProfiler] = SamplingProfiler()
+        # documents published through the bulk API are signed by the server's own key
+        self.publisher_private_key, publisher_public_key = keys.gen_keypair(curve.P256)
+        self.publisher_public_key_pem: Final[bytes] = export_key(publisher_public_key, P256).encode('utf8')
+        self.on_startup: Final[List[Callable]] = list(on_startup)
+        self.on_shutdown: Final[List[Callable]] = [self.profiler.stop, *on_shutdown]
 
-    def __init__(self):
-        self._lock: Final[Lock] = Lock()
-        self._tail: BaseBlock = RootBlock.get_instance()
+    @classmethod
+    def from_environment(cls) -> 'Node':
+        """
+        The node configured by the WEBCHAIN_ environment variables, WEBCHAIN_CHAIN_DIR names the directory it is kept in
+        """
+        chain_dir = Path(os.environ['WEBCHAIN_CHAIN_DIR'])
+        document_store = DocumentStore(Path(os.environ.get('WEBCHAIN_DOCUMENT_DIR', chain_dir / 'documents')))
+        store = ChainStore(chain_dir)
+        database = DocumentDatabase(Path(os.environ.get('WEBCHAIN_INDEX_DB', chain_dir / 'index.sqlite3')))
+        checkpoint_dir = chain_dir / 'checkpoints'
+        checkpoint_private_key, checkpoint_public_key = load_signing_key(
+            Path(os.environ.get('WEBCHAIN_CHECKPOINT_KEY', chain_dir / 'checkpoint_key.pem')))
+        # checkpoints are trusted when signed by this node or by one of the public keys listed
+        trusted_checkpoint_keys = [checkpoint_public_key] + [
+            import_key(p, curve=P256, public=True)[1]
+            for p in os.environ.get('WEBCHAIN_CHECKPOINT_TRUSTED_KEYS', '').split(',') if p]
+        if store.height == 0 and os.environ.get('WEBCHAIN_BOOTSTRAP_URL'):
+            # a new node starts from a peer's checkpoint and only verifies the blocks after it
+            download_checkpoint(os.environ['WEBCHAIN_BOOTSTRAP_URL'], checkpoint_dir)
+        state = ChainState(store, RetargetingDifficulty(
+            target_interval_ms=int(os.environ.get('WEBCHAIN_TARGET_BLOCK_MS', DEFAULT_TARGET_INTERVAL_MS))), database,
+            latest_checkpoint(checkpoint_dir, trusted_checkpoint_keys, store))
+        checkpointer = Checkpointer(state, checkpoint_dir, checkpoint_private_key,
+                                    interval=int(os.environ.get('WEBCHAIN_CHECKPOINT_INTERVAL',
+                                                                DEFAULT_CHECKPOINT_INTERVAL)))
+        # read workers, reader.py, follow the tail through this file and read blocks straight from the segments
+        head = SharedHead(chain_dir / HEAD_FILE, writable=True)
+        HeadPublisher(state, store, head)
+        document_cache = ByteLRUCache(max_bytes=int(os.environ.get('WEBCHAIN_CACHE_BYTES', DEFAULT_MAX_BYTES)))
+        miner = ParallelMiner(workers=int(os.environ.get('WEBCHAIN_MINING_WORKERS', os.cpu_count())))
+        mempool = Mempool(max_entries=int(os.environ.get('WEBCHAIN_BLOCK_MAX_ENTRIES', 256)),
+                          max_wait_ms=int(os.environ.get('WEBCHAIN_BLOCK_MAX_WAIT_MS', 1_000)))
+        sealer = BlockSealer(state, mempool, miner)
+        writer = DocumentWriter(document_store)
+        # other nodes are listed in configuration, host location entries do not record the port a node serves on
+        peer_sync = PeerSync(state, [p for p in os.environ.get('WEBCHAIN_PEERS', '').split(',') if p],
+                             node_url=os.environ.get('WEBCHAIN_NODE_URL'),
+                             poll_interval=float(os.environ.get('WEBCHAIN_SYNC_INTERVAL', DEFAULT_POLL_INTERVAL)))
+        # documents are signed in processes so signing is parallel
+        signing_pool = ProcessPoolExecutor(max_workers=int(os.environ.get('WEBCHAIN_SIGNING_WORKERS', os.cpu_count())),
+                                           mp_context=multiprocessing.get_context('spawn'))
+        # the example document producers run on the server's event loop and share its signing processes
+        producers = ProducerGroup([Producer(document_store, mempool, signing_pool, writer)
+                                   for _ in range(int(os.environ.get('WEBCHAIN_PUBLISHERS', 3)))])
+        return cls(state, document_store, document_cache, mempool, writer, peer_sync, signing_pool, checkpoint_dir,
+                   on_startup=[peer_sync.start, writer.start, sealer.start, producers.start],
+                   on_shutdown=[producers.stop, peer_sync.close, writer.close, mempool.close, sealer.join, miner.close,
+                                checkpointer.close, store.close, head.close, signing_pool.shutdown, database.close])
 
-    @property
-    def lock(self):
-        return self._lock
+    async def start(self):
+        await _call_all(self.on_startup)
 
-    @property
-    def tail(self) -> BaseBlock:
-        return self._tail
+    async def stop(self):
+        await _call_all(self.on_shutdown)
 
-    @tail.setter
-    def tail(self, block: BaseBlock):
-        assert block.previous_block is self.tail
-        self._tail = block
+    def register_gauges(self):
+        gauge('webchain_chain_height', 'Number of blocks after the root block', lambda: self.state.height)
+        gauge('webchain_chain_conflicts', 'Blocks mined on a stale tail and re-mined', lambda: self.state.conflicts)
+        gauge('webchain_document_cache_hits', 'Documents served from the cache', lambda: self.document_cache.hits)
+        gauge('webchain_document_cache_misses', 'Documents not found in the cache',
+              lambda: self.document_cache.misses)
+        gauge('webchain_document_cache_bytes', 'Size of the cached documents', lambda: self.document_cache.size)
+        if self.writer is not None:
+            gauge('webchain_document_writer_queue_depth', 'Documents waiting to be written',
+                  lambda: self.writer.queue_depth)
 
 
-class WebChainThread(Thread):
+async def _call_all(callbacks: Sequence[Callable]):
+    for callback in callbacks:
+        result = callback()
+        if asyncio.iscoroutine(result):
+            await result
 
-    def __init__(self, chain_state: ChainState, storage_dir: Path, num_blocks_to_gen: Optional[int] = None) -> None:
-        super().__init__()
-        self.chain_state: Final[ChainState] = chain_state
-        self.storage_dir: Final[Path] = storage_dir
-        self.private_key, self.public_key = keys.gen_keypair(curve.P256)
-        self.public_key_bytes: Final[bytes] = self.private_key.to_bytes(64, INDIANESS)
-        self.ip_address: Final[bytes] = bytes([127, 0, 0, 1])
-        self.num_blocks_to_gen: Optional[int] = num_blocks_to_gen
-        self.hault = False
 
-    def stop(self):
-        self.hault = True
+def _node(request: Request) -> Node:
+    return request.app.state.node
 
-    def run(self) -> None:
-        super().run()
 
-        with self.chain_state.lock:
-            host_location = HostLocationEntry(self.chain_state.tail.entries[-1], self.ip_address,
-                                              self.public_key_bytes)
-            block = Block(self.chain_state.tail, [host_location])
-            assert block.nonce is not None
-            self.chain_state.tail = block
+router = APIRouter()
 
-        while not self.hault and (self.num_blocks_to_gen is None or self.num_blocks_to_gen > 0):
 
-            with self.chain_state.lock:
-                doc_contents = DOC_TEMPLATE.format(str(uuid4()))
-                _doc_id = doc_id(doc_contents, self.private_key)
-                entry = DocumentPublishEntry(self.chain_state.tail.entries[-1], _doc_id,
-                                             export_key(self.public_key, P256).encode('utf8'))
-                block = Block(self.chain_state.tail, [entry])
-                assert block.nonce is not None
-                self.chain_state.tail = block
-                with open(self.storage_dir / _doc_id.hex(), 'w+') as f:
-                    f.write(doc_contents)
+def create_app(node: Optional[Node] = None) -> FastAPI:
+    """
+    The web app serving node, or the node built from the environment when the server starts if none is given
+    """
+    async def start():
+        if app.state.node is None:
+            app.state.node = Node.from_environment()
+            app.state.node.register_gauges()
+        await app.state.node.start()
 
-            if self.num_blocks_to_gen is not None:
-                self.num_blocks_to_gen -= 1
+    async def stop():
+        await app.state.node.stop()
 
+    app = FastAPI(on_startup=[start], on_shutdown=[stop])
+    app.state.node = node
+    if node is not None:
+        node.register_gauges()
+    app.include_router(router)
+    return app
 
-def cleanup_files(_dir: Path):
-    for f in os.listdir(_dir):
-        os.remove(_dir / f)
 
+@router.get('/', response_class=HTMLResponse)
+async def get_document(doc_id: str, request: Request, node: Node = Depends(_node)):
+    try:
+        # the database is read from a worker thread, never on the event loop
+        record = await run_in_threadpool(node.state.lookup, bytes.fromhex(doc_id))
+    except ValueError:
+        record = None
+    if record is None:
+        INDEX_LOOKUPS.inc(labels=('miss',))
+        return not_found(doc_id)
+    # the index finds a document without walking any entries, so hits and misses are what there is to count
+    INDEX_LOOKUPS.inc(labels=('hit',))
+    return await document_response(doc_id, record.doc_id, record.public_key, request, node.document_store,
+                                   node.document_cache, DOCUMENT_READ_SECONDS)
+
+
+@router.post('/documents', response_model=PublishResponse)
+async def publish_documents(request: PublishRequest, node: Node = Depends(_node)):
+    """
+    Signs, stores and publishes a batch of documents. The entries go through the mempool together, so they are sealed
+    into as few blocks as the mempool's block size allows rather than one block per document
+    """
+    documents = request.documents
+    if len(documents) > MAX_BULK_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f'at most {MAX_BULK_DOCUMENTS} documents per request')
+    if not documents:
+        return PublishResponse(documents=[])
+    if node.mempool is None:
+        raise HTTPException(status_code=503, detail='this node does not publish documents')
+
+    loop = asyncio.get_running_loop()
+    signed = await asyncio.gather(*(
+        loop.run_in_executor(node.signing_pool, doc_ids, documents[i:i + SIGNING_CHUNK_SIZE],
+                             node.publisher_private_key)
+        for i in range(0, len(documents), SIGNING_CHUNK_SIZE)))
+    ids = [d for chunk in signed for d in chunk]
 
-document_dir = Path('/home/hunter/bin/cs6675_project/files')
-state = ChainState()
-threads = [WebChainThread(state, document_dir), WebChainThread(state, document_dir),
-           WebChainThread(state, document_dir)]
-app = FastAPI(on_startup=[lambda: [t.start() for t in threads]],
-              on_shutdown=[lambda: [t.stop() for t in threads], lambda: [t.join() for t in threads],
-                           lambda: cleanup_files(document_dir)])
+    # durable before the entries are submitted so every document is on disk once get_document can find it
+    await run_in_threadpool(node.document_store.put_many, list(zip(ids, documents)))
+    futures = await run_in_threadpool(node.mempool.submit_many, [
+        lambda previous, _doc_id=_doc_id: DocumentPublishEntry(previous, _doc_id, node.publisher_public_key_pem)
+        for _doc_id in ids])
+    blocks = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+    # the sealed blocks give the heights without an index lookup per document on the event loop
+    heights = [node.state.height_of(block.sha256_hash) for block in blocks]
+    if None in heights:
+        raise HTTPException(status_code=409, detail='a chain reorganization dropped the documents, publish them again')
+    return PublishResponse(documents=[PublishedDocument(doc_id=d.hex(), height=height)
+                                      for d, height in zip(ids, heights)])
 
 
-@app.get('/', response_class=HTMLResponse)
-def get_document(doc_id: str, response: Response):
+def _history(doc_id: str, state: ChainState) -> List[PublishedDocument]:
     try:
-        with open(document_dir / doc_id) as f:
-            contents = f.read()
-        response.headers['Cache-Control'] = 'public, max-age=31557600, immutable'
-        response.headers['ETag'] = doc_id
-        tail_entry: BaseEntry = state.tail.entries[-1]
-        doc_id_bytes = bytes.fromhex(doc_id)
-        while True:
-            if tail_entry is tail_entry.previous_entry:
-                raise Exception("Cannot find entry")
-            if isinstance(tail_entry, BaseDocumentEntry) and tail_entry.doc_id == doc_id_bytes:
-                break
-            tail_entry = tail_entry.previous_entry
-        response.headers['X-Public-Key'] = tail_entry.public_key.hex()
-        return contents
-    except FileNotFoundError:
-        response.status_code = 404
-        return f'''<!DOCTYPE html>
-        <html lang=en>
-        <title>404 Unable to locate document</title>
-        <p>The requested document id <code>{doc_id}</code> was not found in WebChain</p>
-        '''
+        versions = state.history(bytes.fromhex(doc_id))
+    except ValueError:
+        versions = ()
+    if not versions:
+        raise HTTPException(status_code=404, detail='document not found')
+    return [PublishedDocument(doc_id=v.hex(), height=state.lookup(v).height) for v in versions]
+
+
+@router.get('/versions', response_model=VersionHistory)
+def get_versions(doc_id: str, node: Node = Depends(_node)):
+    """
+    Every version of the document, oldest first, found through the version links of the index
+    """
+    versions = _history(doc_id, node.state)
+    return VersionHistory(doc_id=doc_id, latest=versions[-1], versions=versions)
+
+
+@router.get('/versions/latest', response_model=PublishedDocument)
+def get_latest_version(doc_id: str, node: Node = Depends(_node)):
+    return _history(doc_id, node.state)[-1]
+
+
+@router.get('/proof', response_model=InclusionProof)
+def get_proof(doc_id: str, node: Node = Depends(_node)):
+    """
+    Proof that the document's entry is in its block: the entry's fields, the sibling hashes from the entry up to the
+    block's Merkle root and the block header. validate.verify_inclusion checks it without the rest of the block
+    """
+    try:
+        record = node.state.index.lookup(bytes.fromhex(doc_id))
+    except ValueError:
+        record = None
+    if record is None:
+        raise HTTPException(status_code=404, detail='document not found')
+    entry = record.entry
+    previous_doc_id = entry.previous_doc_id if isinstance(entry, DocumentUpdateEntry) else None
+    return inclusion_proof(doc_id, entry, previous_doc_id, record.block, record.position, record.height)
+
+
+@router.get('/chain/head', response_model=ChainHead)
+def get_chain_head(node: Node = Depends(_node)):
+    state = node.state
+    with state.lock:
+        height, tail, work = state.height, state.tail, state.work
+    return ChainHead(height=height, hash=tail.sha256_hash.hex(), work=work)
+
+
+def _chain_blocks(state: ChainState, start: int, stop: Optional[int]) -> Iterator[BaseBlock]:
+    """
+    Blocks [start, stop) read one at a time, the chain lock is only held to read each block. The range ends early if
+    the chain ends, or switches to another fork, while it is read
+    """
+    previous = None
+    height = start
+    while stop is None or height < stop:
+        with state.lock:
+            if height > state.height:
+                return
+            block = state.block(height)
+        if previous is not None and block.previous_block is not previous:
+            return
+        yield block
+        previous = block
+        height += 1
+
+
+@router.get('/chain/blocks')
+def get_blocks(start: int = 1, stop: Optional[int] = None, node: Node = Depends(_node)):
+    """
+    Streams the blocks [start, stop) as a block stream, to the tail if stop is not given. Blocks are encoded as the
+    response is sent, so a range of any length is served in constant memory
+    """
+    if start < 1 or (stop is not None and stop < start):
+        raise HTTPException(status_code=400, detail='start must be positive and stop at least start')
+    if start <= node.state.base_height:
+        raise HTTPException(status_code=404,
+                            detail=f'blocks up to the checkpoint at {node.state.base_height} are not kept')
+    return StreamingResponse(coalesce(encode_stream(_chain_blocks(node.state, start, stop), start)),
+                             media_type=STREAM_CONTENT_TYPE)
+
+
+@router.get('/checkpoint')
+def get_checkpoint(node: Node = Depends(_node)):
+    """
+    The latest checkpoint written by this node, a new node bootstraps from it and syncs the blocks after it
+    """
+    paths = checkpoints(node.checkpoint_dir) if node.checkpoint_dir is not None else []
+    if not paths:
+        raise HTTPException(status_code=404, detail='no checkpoint has been written')
+    return FileResponse(paths[-1], media_type=STREAM_CONTENT_TYPE,
+                        headers={'X-Checkpoint-Height': str(int(paths[-1].stem))})
+
+
+@router.post('/chain/blocks', response_class=PlainTextResponse)
+async def post_blocks(request: Request, node: Node = Depends(_node)):
+    """
+    Blocks gossiped by a peer, appended when they extend the tail. Otherwise the peer's chain is fetched and adopted
+    if it has more work
+    """
+    if node.peer_sync is None:
+        raise HTTPException(status_code=503, detail='this node does not sync with peers')
+    return await run_in_threadpool(node.peer_sync.receive, await request.body(), request.headers.get(PEER_HEADER))
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@router.post('/profiler/start', response_class=PlainTextResponse)
+def start_profiler(interval_ms: float = 5.0, node: Node = Depends(_node)):
+    """
+    Starts sampling every thread's stack every interval_ms milliseconds
+    """
+    node.profiler.start(interval_ms / 1_000)
+    return f'sampling every {node.profiler.interval * 1_000:g} ms\n'
+
+
+@router.post('/profiler/stop', response_class=PlainTextResponse)
+def stop_profiler(node: Node = Depends(_node)):
+    """
+    Stops the profiler and returns the sampled stacks in the collapsed format read by flamegraph.pl
+    """
+    return node.profiler.stop()
+
+
+# uvicorn poc:app, the node is built when the server starts
+app = create_app()
@@ -0,0 +1,167 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from typing import Final, List, Optional, Set
+from uuid import uuid4
+
+from fastecdsa import keys, curve
+from fastecdsa.curve import P256
+from fastecdsa.keys import export_key
+
+from blocks import Block
+from chain_utils import doc_id, public_key_bytes
+from document_store import DocumentStore
+from entries import HostLocationEntry, DocumentPublishEntry
+from mempool import Mempool, EntryFactory
+from metrics import counter
+from write_behind import DocumentWriter
+
+DEFAULT_MAX_IN_FLIGHT: Final[int] = 64
+DEFAULT_SHUTDOWN_TIMEOUT: Final[float] = 30.0
+
+DOCUMENTS_PUBLISHED: Final = counter('webchain_producer_documents_total', 'Documents published by the producers')
+
+DOC_TEMPLATE: Final[str] = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Example Document</title>
+    <p>This is an example document</p>
+    <p>{}</p>
+</head>
+<body>
+
+</body>
+</html>'''
+
+
+class Producer:
+    """
+    Publishes generated example documents as an asyncio task.
+
+    Documents are signed in the signing executor, a process pool so signing never holds the event loop's GIL, and
+    handed to the write-behind writer and the mempool, whose blocks are mined by the sealer's process pool. At most
+    max_in_flight documents are between signing and being committed, the producer waits for the chain to catch up
+    beyond that, so it slows down to the rate blocks are mined at instead of queueing without bound
+    """
+
+    def __init__(self, document_store: DocumentStore, mempool: Mempool, signing_executor: Executor,
+                 writer: Optional[DocumentWriter] = None, num_documents: Optional[int] = None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        assert max_in_flight > 0
+        self.document_store: Final[DocumentStore] = document_store
+        self.mempool: Final[Mempool] = mempool
+        self.signing_executor: Final[Executor] = signing_executor
+        self.writer: Final[Optional[DocumentWriter]] = writer
+        self.num_documents: Optional[int] = num_documents
+        self.max_in_flight: Final[int] = max_in_flight
+        self.private_key, self.public_key = keys.gen_keypair(curve.P256)
+        self.public_key_bytes: Final[bytes] = public_key_bytes(self.public_key)
+        self.public_key_pem: Final[bytes] = export_key(self.public_key, P256).encode('utf8')
+        self.ip_address: Final[bytes] = bytes([127, 0, 0, 1])
+        self.published: int = 0
+        self._stopping: Final[asyncio.Event] = asyncio.Event()
+        self._submitting: Final[asyncio.Lock] = asyncio.Lock()
+
+    def stop(self):
+        """
+        Stops producing documents, run returns once the documents already produced are committed
+        """
+        self._stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        pending: Set[asyncio.Future] = set()
+        errors: List[BaseException] = []
+
+        def on_committed(committed: asyncio.Future):
+            pending.discard(committed)
+            in_flight.release()
+            if committed.exception() is not None:
+                errors.append(committed.exception())
+
+        await in_flight.acquire()
+        hosted = await self._hand_off(lambda previous: HostLocationEntry(previous, self.ip_address,
+                                                                         self.public_key_bytes))
+        pending.add(hosted)
+        hosted.add_done_callback(on_committed)
+        while not errors and not self._stopping.is_set() and \
+                (self.num_documents is None or self.published < self.num_documents):
+            await in_flight.acquire()
+            contents = DOC_TEMPLATE.format(str(uuid4()))
+            try:
+                _doc_id = await loop.run_in_executor(self.signing_executor, doc_id, contents, self.private_key)
+                committed = await self._hand_off(
+                    lambda previous, _doc_id=_doc_id: DocumentPublishEntry(previous, _doc_id, self.public_key_pem),
+                    _doc_id, contents)
+            except BaseException:
+                in_flight.release()
+                raise
+            pending.add(committed)
+            committed.add_done_callback(on_committed)
+            self.published += 1
+            DOCUMENTS_PUBLISHED.inc()
+        # everything produced is on the chain before a graceful stop returns. wait, unlike gather, leaves the futures
+        # alone when run is cancelled, the sealer still commits entries whose producer stopped waiting for them
+        if pending:
+            await asyncio.wait(pending)
+        if errors:
+            raise errors[0]
+
+    async def _hand_off(self, factory: EntryFactory, _doc_id: Optional[bytes] = None,
+                        contents: Optional[str] = None) -> asyncio.Future:
+        """
+        Stores the document, if any, and submits its entry, returns a future resolved with the block it is committed
+        in. Both hand-offs block while their queue is full, so they are made from a worker thread. With a writer the
+        entry is submitted by a task once the document is durable, the writer's thread never waits for the mempool
+        """
+        loop = asyncio.get_running_loop()
+        if _doc_id is None or self.writer is None:
+            return asyncio.wrap_future(await loop.run_in_executor(None, self._submit, factory, _doc_id, contents))
+        written = await loop.run_in_executor(None, self.writer.submit, _doc_id, contents)
+        return loop.create_task(self._submit_when_written(asyncio.wrap_future(written), factory))
+
+    async def _submit_when_written(self, written: asyncio.Future, factory: EntryFactory) -> Block:
+        await written
+        # one submission at a time, a full mempool holds a single worker thread per producer
+        async with self._submitting:
+            submitted = await asyncio.get_running_loop().run_in_executor(None, self.mempool.submit, factory)
+        return await asyncio.wrap_future(submitted)
+
+    def _submit(self, factory: EntryFactory, _doc_id: Optional[bytes], contents: Optional[str]) -> Future:
+        if _doc_id is not None:
+            # written before the entry is submitted so the document is on disk once get_document can find it
+            self.document_store.put(_doc_id, contents)
+        return self.mempool.submit(factory)
+
+
+class ProducerGroup:
+    """
+    Runs producers as tasks of the running event loop, started and stopped from the web server's lifecycle hooks
+    """
+
+    def __init__(self, producers: List[Producer], shutdown_timeout: float = DEFAULT_SHUTDOWN_TIMEOUT):
+        self.producers: Final[List[Producer]] = producers
+        self.shutdown_timeout: Final[float] = shutdown_timeout
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(p.run(), name=f'producer-{ix}') for ix, p in enumerate(self.producers)]
+
+    async def stop(self):
+        """
+        Asks every producer to stop and waits for what they produced to be committed. Producers still running after
+        shutdown_timeout are cancelled
+        """
+        for producer in self.producers:
+            producer.stop()
+        if not self._tasks:
+            return
+        done, running = await asyncio.wait(self._tasks, timeout=self.shutdown_timeout)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        self._tasks = []
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
@@ -0,0 +1,104 @@
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Deque, Final, Optional, Tuple
+from uuid import uuid4
+
+from fastecdsa import keys, curve
+from fastecdsa.curve import P256
+from fastecdsa.keys import export_key
+
+from chain_state import ChainState, mine_and_commit
+from chain_utils import doc_id, public_key_bytes
+from document_store import DocumentStore
+from entries import HostLocationEntry, DocumentPublishEntry, BaseEntry
+from mempool import Mempool
+from mining import ParallelMiner
+from producer import DOC_TEMPLATE
+from write_behind import DocumentWriter
+
+
+class WebChainThread(Thread):
+    """
+    Publishes generated example documents from a thread, mining a block per entry or through the mempool. The node
+    runs producers instead, this publishes into a chain without an event loop
+    """
+
+    def __init__(self, chain_state: ChainState, storage_dir: Path, num_blocks_to_gen: Optional[int] = None,
+                 miner: Optional[ParallelMiner] = None, mempool: Optional[Mempool] = None,
+                 writer: Optional[DocumentWriter] = None) -> None:
+        super().__init__()
+        self.chain_state: Final[ChainState] = chain_state
+        self.storage_dir: Final[Path] = storage_dir
+        self.document_store: Final[DocumentStore] = DocumentStore(storage_dir)
+        self.private_key, self.public_key = keys.gen_keypair(curve.P256)
+        self.public_key_bytes: Final[bytes] = public_key_bytes(self.public_key)
+        self.ip_address: Final[bytes] = bytes([127, 0, 0, 1])
+        self.num_blocks_to_gen: Optional[int] = num_blocks_to_gen
+        self.miner: Final[Optional[ParallelMiner]] = miner
+        self.mempool: Final[Optional[Mempool]] = mempool
+        self.writer: Final[Optional[DocumentWriter]] = writer
+        self.public_key_pem: Final[bytes] = export_key(self.public_key, P256).encode('utf8')
+        self.retries: int = 0
+        self.hault = False
+
+    def stop(self):
+        self.hault = True
+
+    def run(self) -> None:
+        super().run()
+
+        last_published = self.publish(lambda previous: HostLocationEntry(previous, self.ip_address,
+                                                                         self.public_key_bytes))
+        written: Deque[Tuple[Future, Callable[[BaseEntry], BaseEntry]]] = deque()
+
+        while not self.hault and (self.num_blocks_to_gen is None or self.num_blocks_to_gen > 0):
+            doc_contents = DOC_TEMPLATE.format(str(uuid4()))
+            _doc_id = doc_id(doc_contents, self.private_key)
+            # _doc_id is bound now, with a mempool the factory runs after this loop has moved on
+            factory = lambda previous, _doc_id=_doc_id: DocumentPublishEntry(previous, _doc_id, self.public_key_pem)
+
+            # written before the block is committed so the document is on disk once get_document can find it
+            if self.writer is None:
+                self.document_store.put(_doc_id, doc_contents)
+                last_published = self.publish(factory)
+            else:
+                written.append((self.writer.submit(_doc_id, doc_contents), factory))
+                last_published = self.publish_written(written) or last_published
+
+            if self.num_blocks_to_gen is not None:
+                self.num_blocks_to_gen -= 1
+
+        # the thread only finishes once everything it published is on the chain
+        last_published = self.publish_written(written, wait=True) or last_published
+        last_published.result()
+
+    def publish(self, factory: Callable[[BaseEntry], BaseEntry]) -> Future:
+        """
+        Queues the entry in the mempool when there is one, otherwise mines a block containing only this entry
+        """
+        if self.mempool is not None:
+            return self.mempool.submit(factory)
+
+        block, retries = mine_and_commit(self.chain_state, lambda previous: [factory(previous)], self.miner)
+        self.retries += retries
+        future = Future()
+        future.set_result(block)
+        return future
+
+    def publish_written(self, written: Deque[Tuple[Future, Callable[[BaseEntry], BaseEntry]]],
+                        wait: bool = False) -> Optional[Future]:
+        """
+        Publishes, in order, the entries whose documents the write-behind writer has made durable, waiting for the
+        remaining writes too if wait is set. Returns the future of the last entry published, None if there was none.
+
+        Entries are published from this thread, never from the writer's callbacks, so a full mempool blocks this
+        thread, not the writer and every other document waiting to be written
+        """
+        published = None
+        while written and (wait or written[0][0].done()):
+            done, factory = written.popleft()
+            done.result()
+            published = self.publish(factory)
+        return published
@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+from typing import Final, List, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+
+from api import ChainHead, InclusionProof, PublishedDocument, VersionHistory, METRICS_CONTENT_TYPE, document_response, \
+    not_found
+from chain_reader import ChainReader
+from document_cache import ByteLRUCache, DEFAULT_MAX_BYTES
+from document_db import DocumentDatabase
+from document_store import DocumentStore
+from metrics import REGISTRY, counter, gauge, histogram
+from shared_head import SharedHead, HEAD_FILE
+from wire import STREAM_CONTENT_TYPE, coalesce, encode_record_stream
+
+INDEX_LOOKUPS: Final = counter('webchain_reader_index_lookups_total', 'Document lookups by a read worker', ('result',))
+DOCUMENT_READ_SECONDS: Final = histogram('webchain_reader_document_read_seconds',
+                                         'Time spent reading a document file in a read worker')
+
+
+class ReadWorker:
+    """
+    A read worker for a node, run as uvicorn reader:app --workers N next to the node's own poc:app, which owns the
+    chain, mines and accepts writes. Every worker maps the same segments and database, so reads scale with the workers
+    """
+
+    def __init__(self, reader: ChainReader, document_store: DocumentStore,
+                 document_cache: Optional[ByteLRUCache] = None):
+        self.reader: Final[ChainReader] = reader
+        self.document_store: Final[DocumentStore] = document_store
+        self.document_cache: Final[ByteLRUCache] = document_cache if document_cache is not None else ByteLRUCache()
+
+    @classmethod
+    def from_environment(cls) -> 'ReadWorker':
+        """
+        The worker reading the chain in WEBCHAIN_CHAIN_DIR, started after the node owning the chain, poc, which creates
+        the head, the database and the segments
+        """
+        chain_dir = Path(os.environ['WEBCHAIN_CHAIN_DIR'])
+        database = DocumentDatabase(Path(os.environ.get('WEBCHAIN_INDEX_DB', chain_dir / 'index.sqlite3')))
+        return cls(ChainReader(chain_dir, database, SharedHead(chain_dir / HEAD_FILE)),
+                   DocumentStore(Path(os.environ.get('WEBCHAIN_DOCUMENT_DIR', chain_dir / 'documents'))),
+                   ByteLRUCache(max_bytes=int(os.environ.get('WEBCHAIN_CACHE_BYTES', DEFAULT_MAX_BYTES))))
+
+    def register_gauges(self):
+        gauge('webchain_chain_height', 'Number of blocks after the root block', lambda: self.reader.head.read().height)
+        gauge('webchain_document_cache_hits', 'Documents served from the cache', lambda: self.document_cache.hits)
+        gauge('webchain_document_cache_misses', 'Documents not found in the cache',
+              lambda: self.document_cache.misses)
+
+
+def _worker(request: Request) -> ReadWorker:
+    return request.app.state.worker
+
+
+router = APIRouter()
+
+
+def create_app(worker: Optional[ReadWorker] = None) -> FastAPI:
+    """
+    The web app serving worker, or the worker built from the environment when the server starts if none is given
+    """
+    def start():
+        if app.state.worker is None:
+            app.state.worker = ReadWorker.from_environment()
+            app.state.worker.register_gauges()
+
+    def stop():
+        app.state.worker.reader.close()
+
+    app = FastAPI(on_startup=[start], on_shutdown=[stop])
+    app.state.worker = worker
+    if worker is not None:
+        worker.register_gauges()
+    app.include_router(router)
+    return app
+
+
+@router.get('/', response_class=HTMLResponse)
+async def get_document(doc_id: str, request: Request, worker: ReadWorker = Depends(_worker)):
+    try:
+        # the database is read from a worker thread, never on the event loop
+        row = await run_in_threadpool(worker.reader.lookup, bytes.fromhex(doc_id))
+    except ValueError:
+        row = None
+    if row is None:
+        INDEX_LOOKUPS.inc(labels=('miss',))
+        return not_found(doc_id)
+    INDEX_LOOKUPS.inc(labels=('hit',))
+    return await document_response(doc_id, row.doc_id, row.public_key, request, worker.document_store,
+                                   worker.document_cache, DOCUMENT_READ_SECONDS)
+
+
+def _history(doc_id: str, reader: ChainReader) -> List[PublishedDocument]:
+    try:
+        versions = reader.history(bytes.fromhex(doc_id))
+    except ValueError:
+        versions = []
+    if not versions:
+        raise HTTPException(status_code=404, detail='document not found')
+    return versions
+
+
+@router.get('/versions', response_model=VersionHistory)
+def get_versions(doc_id: str, worker: ReadWorker = Depends(_worker)):
+    versions = _history(doc_id, worker.reader)
+    return VersionHistory(doc_id=doc_id, latest=versions[-1], versions=versions)
+
+
+@router.get('/versions/latest', response_model=PublishedDocument)
+def get_latest_version(doc_id: str, worker: ReadWorker = Depends(_worker)):
+    return _history(doc_id, worker.reader)[-1]
+
+
+@router.get('/proof', response_model=InclusionProof)
+def get_proof(doc_id: str, worker: ReadWorker = Depends(_worker)):
+    try:
+        proof = worker.reader.proof(doc_id)
+    except ValueError:
+        proof = None  # not a hex doc_id
+    if proof is None:
+        raise HTTPException(status_code=404, detail='document not found')
+    return proof
+
+
+@router.get('/chain/head', response_model=ChainHead)
+def get_chain_head(worker: ReadWorker = Depends(_worker)):
+    head = worker.reader.head.read()
+    return ChainHead(height=head.height, hash=head.block_hash.hex(), work=head.work)
+
+
+@router.get('/chain/blocks')
+def get_blocks(start: int = 1, stop: Optional[int] = None, worker: ReadWorker = Depends(_worker)):
+    if start < 1 or (stop is not None and stop < start):
+        raise HTTPException(status_code=400, detail='start must be positive and stop at least start')
+    reader = worker.reader
+    _, chain = reader.view()
+    if start <= chain.base_height:
+        raise HTTPException(status_code=404, detail=f'blocks up to the checkpoint at {chain.base_height} are not kept')
+    return StreamingResponse(coalesce(encode_record_stream(reader.record_bodies(start, stop), start)),
+                             media_type=STREAM_CONTENT_TYPE)
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# uvicorn reader:app, the worker is built when the server starts
+app = create_app()
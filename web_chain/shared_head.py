@@ -0,0 +1,97 @@
+import mmap
+import os
+from pathlib import Path
+from struct import Struct
+from typing import Final, NamedTuple
+
+from blocks import BaseBlock
+
+# sequence, generation, height, tail hash, chain work
+HEAD_RECORD: Final[Struct] = Struct('>QQQ32s32s')
+SEQUENCE: Final[Struct] = Struct('>Q')
+HEAD_FILE: Final[str] = 'head'
+
+
+class Head(NamedTuple):
+    # changes whenever blocks are removed from the chain, the segments must be mapped again
+    generation: int
+    height: int
+    block_hash: bytes
+    work: int
+
+
+class SharedHead:
+    """
+    The tail of the chain owned by another process, in a small memory-mapped file next to the segments.
+
+    The owner is the only writer. A write makes the sequence odd, updates the fields and makes it even again, a reader
+    retries until it reads the same even sequence before and after the fields, so it never sees a torn head and never
+    takes a lock
+    """
+
+    def __init__(self, path: Path, writable: bool = False):
+        self.path: Final[Path] = path
+        self.writable: Final[bool] = writable
+        if writable:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < HEAD_RECORD.size:
+                    os.ftruncate(fd, HEAD_RECORD.size)
+                self._map: Final[mmap.mmap] = mmap.mmap(fd, HEAD_RECORD.size)
+            finally:
+                os.close(fd)
+            sequence, = SEQUENCE.unpack_from(self._map, 0)
+            if sequence % 2:
+                # the previous owner was killed in the middle of a write, readers would retry forever
+                SEQUENCE.pack_into(self._map, 0, sequence + 1)
+        else:
+            with open(path, 'rb') as f:
+                self._map: Final[mmap.mmap] = mmap.mmap(f.fileno(), HEAD_RECORD.size, access=mmap.ACCESS_READ)
+
+    def read(self) -> Head:
+        while True:
+            sequence, generation, height, block_hash, work = HEAD_RECORD.unpack_from(self._map, 0)
+            if sequence % 2 == 0 and SEQUENCE.unpack_from(self._map, 0)[0] == sequence:
+                return Head(generation, height, block_hash, int.from_bytes(work, 'big'))
+
+    def write(self, head: Head):
+        sequence, = SEQUENCE.unpack_from(self._map, 0)
+        SEQUENCE.pack_into(self._map, 0, sequence + 1)
+        HEAD_RECORD.pack_into(self._map, 0, sequence + 1, head.generation, head.height, bytes(head.block_hash),
+                              head.work.to_bytes(32, 'big'))
+        SEQUENCE.pack_into(self._map, 0, sequence + 2)
+
+    def close(self):
+        self._map.close()
+
+
+class HeadPublisher:
+    """
+    Publishes the tail of chain_state to a SharedHead after every block. Appends are flushed from the store first, so
+    a reader mapping the segments finds every block up to the published height
+    """
+
+    def __init__(self, chain_state: 'chain_state.ChainState', store: 'chain_store.ChainStore', head: SharedHead):
+        self.chain_state: Final['chain_state.ChainState'] = chain_state
+        self.store: Final['chain_store.ChainStore'] = store
+        self.head: Final[SharedHead] = head
+        with chain_state.lock:
+            # the store may have dropped blocks since the last owner stopped
+            self._generation: int = head.read().generation + 1
+            self._height: int = chain_state.height
+            self._publish(chain_state.tail, chain_state.height)
+            chain_state.add_listener(self._on_append)
+
+    def _on_append(self, block: BaseBlock, height: int):
+        if height <= self._height:
+            # the chain switched to a fork, the blocks above it were removed
+            self._generation += 1
+        self._height = height
+        self.store.flush()
+        head = Head(self._generation, height, bytes(block.sha256_hash), self.chain_state.work)
+        # written after the block's documents are in the database, so a reader finds them once it sees the head
+        self.chain_state.with_database(lambda _: self.head.write(head))
+
+    def _publish(self, block: BaseBlock, height: int):
+        self.store.flush()
+        self.head.write(Head(self._generation, height, bytes(block.sha256_hash), self.chain_state.work))
@@ -0,0 +1,190 @@
+import asyncio
+from threading import Thread
+from typing import Final, List, Optional, Sequence, Tuple
+
+import httpx
+
+from blocks import BaseBlock
+from chain_state import ChainState
+from chain_store import materialize_block, BlockRecord
+from metrics import counter, histogram
+from wire import adecode_stream, decode_stream, encode_stream, STREAM_CONTENT_TYPE
+
+DEFAULT_BATCH_SIZE: Final[int] = 512
+DEFAULT_POLL_INTERVAL: Final[float] = 5.0
+DEFAULT_MAX_CONNECTIONS: Final[int] = 32
+PEER_HEADER: Final[str] = 'X-Webchain-Peer'
+
+BLOCKS_RECEIVED: Final = counter('webchain_sync_blocks_received_total', 'Blocks received from peers', ('result',))
+BLOCKS_GOSSIPED: Final = counter('webchain_sync_blocks_gossiped_total', 'Blocks sent to peers')
+SYNC_SECONDS: Final = histogram('webchain_sync_seconds', 'Time spent fetching and adopting a fork from a peer')
+
+
+def materialize_fork(chain_state: ChainState, records: Sequence[BlockRecord], previous: Optional[BaseBlock] = None,
+                     parent_height: int = 0) -> List[BaseBlock]:
+    """
+    Rebuilds and verifies blocks received from a peer, the first must extend a block of the current chain, or previous
+    at parent_height when a fork is materialized in batches.
+    Raises ValueError if the blocks do not link up, any hash or proof of work is invalid or a difficulty is not the one
+    chain_state's difficulty controller chooses
+    """
+    if previous is None:
+        parent_height = chain_state.height_of(records[0].previous_hash)
+        if parent_height is None:
+            raise ValueError('fork does not extend the current chain')
+        previous = chain_state.block(parent_height)
+    blocks = []
+    for height, record in enumerate(records, start=parent_height + 1):
+        expected = chain_state.expected_difficulty(previous, height)
+        if expected is not None and record.difficulty != expected:
+            raise ValueError(f'block {height} has difficulty {record.difficulty}, {expected} was expected')
+        previous = materialize_block(record, previous)
+        blocks.append(previous)
+    return blocks
+
+
+class PeerSync(Thread):
+    """
+    Keeps the chain in step with a set of peers over pooled async HTTP connections.
+
+    Every block appended to the local chain is gossiped to all peers. A received block that extends the tail is
+    appended, any other new block makes the node fetch the peer's fork in batches of batch_size blocks and adopt it if
+    it has more accumulated work. Peers are also polled every poll_interval seconds so a node that missed gossip, or
+    was just started, catches up. The event loop runs in this thread, nothing here blocks the web server
+    """
+
+    def __init__(self, chain_state: ChainState, peers: Sequence[str], node_url: Optional[str] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        super().__init__(name='peer-sync', daemon=True)
+        self.chain_state: Final[ChainState] = chain_state
+        self.peers: Final[Tuple[str, ...]] = tuple(p.rstrip('/') for p in peers if p.rstrip('/') != node_url)
+        self.node_url: Final[Optional[str]] = node_url
+        self.batch_size: Final[int] = batch_size
+        self.poll_interval: Final[float] = poll_interval
+        self.max_connections: Final[int] = max_connections
+        self.loop: Final[asyncio.AbstractEventLoop] = asyncio.new_event_loop()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._syncing: Final[set] = set()
+        chain_state.add_listener(self._on_append)
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self._client = httpx.AsyncClient(
+            timeout=30.0, headers={PEER_HEADER: self.node_url} if self.node_url else None,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+        poller = self.loop.create_task(self._poll())
+        try:
+            self.loop.run_forever()
+        finally:
+            poller.cancel()
+            self.loop.run_until_complete(self._client.aclose())
+            self.loop.close()
+
+    def close(self):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join()
+
+    def _on_append(self, block: BaseBlock, height: int):
+        # called with the chain lock held, the block is only handed to the event loop here
+        if self.peers and self.is_alive():
+            self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.gossip([block], height)))
+
+    async def gossip(self, blocks: Sequence[BaseBlock], start: int):
+        body = b''.join(encode_stream(blocks, start))
+        await asyncio.gather(*(self._post(peer, body) for peer in self.peers))
+        BLOCKS_GOSSIPED.inc(len(blocks))
+
+    async def _post(self, peer: str, body: bytes):
+        try:
+            await self._client.post(f'{peer}/chain/blocks', content=body,
+                                    headers={'Content-Type': STREAM_CONTENT_TYPE})
+        except httpx.HTTPError:
+            pass  # the peer catches up when it next polls
+
+    async def _poll(self):
+        while True:
+            # a peer whose replies cannot be handled must not stop the others from being polled
+            await asyncio.gather(*(self.sync_with(peer) for peer in self.peers), return_exceptions=True)
+            await asyncio.sleep(self.poll_interval)
+
+    def receive(self, body: bytes, peer: Optional[str] = None) -> str:
+        """
+        Handles blocks posted by a peer, called from the web server's threads. Returns what was done with them
+        """
+        try:
+            records = list(decode_stream([body]))
+            if not records:
+                return 'empty'
+            if self.chain_state.height_of(records[-1].sha256_hash) is not None:
+                result = 'known'
+            elif self.chain_state.height_of(records[0].previous_hash) is not None:
+                tail = self.chain_state.tail
+                blocks = materialize_fork(self.chain_state, records)
+                if blocks[0].previous_block is tail and self.chain_state.compare_and_swap(tail, blocks[0]) and \
+                        all(self.chain_state.compare_and_swap(a, b) for a, b in zip(blocks, blocks[1:])):
+                    result = 'appended'
+                else:
+                    result = 'adopted' if self.chain_state.adopt(blocks) else 'ignored'
+            else:
+                result = 'unknown parent'
+                # the header is set by whoever posts, only peers from the configuration are ever fetched from
+                if peer is not None and peer.rstrip('/') in self.peers and self.is_alive():
+                    asyncio.run_coroutine_threadsafe(self.sync_with(peer.rstrip('/')), self.loop)
+        except ValueError:
+            result = 'invalid'
+        BLOCKS_RECEIVED.inc(labels=(result,))
+        return result
+
+    async def sync_with(self, peer: str) -> bool:
+        """
+        Fetches the peer's chain from where it forks from the local chain and adopts it if it has more work
+        """
+        if peer in self._syncing:
+            return False
+        self._syncing.add(peer)
+        try:
+            with SYNC_SECONDS.time():
+                return await self._sync_with(peer)
+        except (httpx.HTTPError, ValueError):
+            return False
+        finally:
+            self._syncing.discard(peer)
+
+    async def _sync_with(self, peer: str) -> bool:
+        response = await self._client.get(f'{peer}/chain/head')
+        response.raise_for_status()
+        head = response.json()
+        if head['work'] <= self.chain_state.work:
+            return False
+
+        # step back from the common height, doubling the step, until the peer's blocks attach to the local chain
+        start, step = min(self.chain_state.height, head['height']) + 1, 1
+        while True:
+            records = await self._fetch(peer, start, min(start + self.batch_size, head['height'] + 1))
+            if self.chain_state.height_of(records[0].previous_hash) is not None:
+                break
+            if start == 1:
+                raise ValueError(f'{peer} does not share the root block')
+            start, step = max(1, start - step), step * 2
+
+        # every batch is materialized as it arrives and its records dropped, only the fork's blocks are kept until it
+        # is adopted, as the chain would keep them once it is
+        blocks: List[BaseBlock] = []
+        while True:
+            blocks += await self.loop.run_in_executor(None, materialize_fork, self.chain_state, records,
+                                                      blocks[-1] if blocks else None, start - 1)
+            start += len(records)
+            if start > head['height']:
+                break
+            records = await self._fetch(peer, start, min(start + self.batch_size, head['height'] + 1))
+        return await self.loop.run_in_executor(None, self.chain_state.adopt, blocks)
+
+    async def _fetch(self, peer: str, start: int, stop: int) -> List[BlockRecord]:
+        async with self._client.stream('GET', f'{peer}/chain/blocks', params={'start': start, 'stop': stop}) as response:
+            response.raise_for_status()
+            records = [record async for record in adecode_stream(response.aiter_bytes())]
+        if not records:
+            raise ValueError(f'{peer} returned no blocks from height {start}')
+        return records
@@ -1,27 +1,141 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from functools import lru_cache
 from hashlib import sha256
-from os import listdir
+from itertools import islice
 from pathlib import Path
-from random import choice
 from tempfile import mkstemp
+from threading import local
+from time import perf_counter
+from typing import Dict, Iterable, Optional, Tuple
 
 import requests
 from fastecdsa.curve import P256
 from fastecdsa.ecdsa import verify
-from fastecdsa.encoding.der import DEREncoder
+from fastecdsa.encoding.der import DEREncoder, InvalidDerSignature
+from fastecdsa.encoding.pem import PEMEncoder
 from fastecdsa.keys import import_key
 from fastecdsa.point import Point
 
-if __name__ == '__main__':
-    documents_dir = Path('/home/hunter/bin/cs6675_project/files')
+from chain_utils import sha256_hash_entry_fields, block_hash_payload_root, validate_block_hash, \
+    MIN_BLOCK_HASH_LEADING_ZEROS, MAX_BLOCK_HASH_LEADING_ZEROS
+from document_store import DocumentStore
+from entries import MAX_INTERNED
+from merkle import proof_root
+
+_thread_local = local()
+
+
+@lru_cache(maxsize=MAX_INTERNED)
+def parse_public_key(key: bytes) -> Point:
+    """
+    Parses the PEM public key sent in X-Public-Key, every document from the same publisher shares one parsed Point.
+    Only the most recently used keys are kept, as many as the entries intern
+    """
+    return PEMEncoder.decode_public_key(key.decode('utf8'), P256)
+
+
+def verify_signature(d: str, contents: str, x: int, y: int) -> bool:
+    try:
+        r, s = DEREncoder.decode_signature(bytes.fromhex(d))
+    except (InvalidDerSignature, ValueError):
+        return False
+    return verify((r, s), sha256(contents.encode('utf8')).digest(), Q=Point(x, y, curve=P256))
+
+
+def fetch_document(url: str, d: str) -> Tuple[str, str, bytes]:
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+    response = _thread_local.session.get(url, params={'doc_id': d})
+    if response.status_code != 200:
+        raise ValueError(f'doc_id={d} returned {response.status_code}')
+    return d, response.text, bytes.fromhex(response.headers['X-Public-Key'])
+
+
+def verify_batch(url: str, doc_ids: Iterable[str], concurrency: int, workers: int,
+                 max_in_flight: Optional[int] = None) -> Tuple[int, int, float]:
+    """
+    Fetches documents with concurrency connections and verifies their signatures in a pool of workers processes,
+    returns the number of verified and failed documents and the elapsed seconds.
+
+    At most max_in_flight documents, twice what the pools work on at once by default, are being fetched or verified,
+    doc_ids is drawn from as they complete so a batch of any size is verified in constant memory
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * (concurrency + workers)
+    assert max_in_flight > 0
+    doc_ids = iter(doc_ids)
+    verified = failed = 0
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as fetch_pool, ProcessPoolExecutor(max_workers=workers) as pool:
+        fetches: Dict[Future, str] = {}
+        verifications: Dict[Future, str] = {}
+        while True:
+            for d in islice(doc_ids, max_in_flight - len(fetches) - len(verifications)):
+                fetches[fetch_pool.submit(fetch_document, url, d)] = d
+            if not fetches and not verifications:
+                break
+            done, _ = wait(fetches.keys() | verifications.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetches:
+                    d = fetches.pop(future)
+                    try:
+                        _, contents, key = future.result()
+                        public_key = parse_public_key(key)
+                    except Exception as e:
+                        # one unreachable document or unreadable key fails that document, not the batch
+                        failed += 1
+                        print(f'failed to fetch doc_id={d}: {e!r}')
+                        continue
+                    verifications[pool.submit(verify_signature, d, contents, public_key.x, public_key.y)] = d
+                else:
+                    d = verifications.pop(future)
+                    if future.result():
+                        verified += 1
+                    else:
+                        failed += 1
+                        print(f'failed to validate doc_id={d}')
+    return verified, failed, perf_counter() - start
 
-    for _ in range(10):
-        documents = listdir(documents_dir)
-        d = choice(documents)
-        assert isinstance(d, str)
-        response = requests.get(f'http://localhost:8000?doc_id={d}')
+
+def verify_inclusion(proof: dict, d: str) -> bool:
+    """
+    Checks a proof from /proof: the entry for d must hash into the block's Merkle root and the block hash built on
+    that root must carry the proof of work. Only the entry and log2(entries) sibling hashes are needed, not the block
+    """
+    if proof['doc_id'] != d or not MIN_BLOCK_HASH_LEADING_ZEROS <= proof['difficulty'] <= MAX_BLOCK_HASH_LEADING_ZEROS:
+        return False
+    previous_doc_id = None if proof['previous_doc_id'] is None else bytes.fromhex(proof['previous_doc_id'])
+    entry_hash = sha256_hash_entry_fields(bytes.fromhex(proof['previous_entry_hash']),
+                                          public_key=bytes.fromhex(proof['public_key']), doc_id=bytes.fromhex(d),
+                                          previous_doc_id=previous_doc_id)
+    root = proof_root(entry_hash, [(bytes.fromhex(step['hash']), step['left']) for step in proof['proof']])
+    hash_builder = sha256(block_hash_payload_root(bytes.fromhex(proof['previous_block_hash']), root,
+                                                  proof['difficulty'], proof['timestamp']))
+    hash_builder.update(proof['nonce'].to_bytes(length=8, byteorder='big', signed=True))
+    block_hash = hash_builder.digest()
+    return block_hash == bytes.fromhex(proof['block_hash']) and validate_block_hash(block_hash, proof['difficulty'])
+
+
+def validate_proof(url: str, d: str) -> bool:
+    response = requests.get(f'{url}/proof', params={'doc_id': d})
+    assert response.status_code == 200, f'doc_id={d} returned {response.status_code}'
+    proof = response.json()
+    if not verify_inclusion(proof, d):
+        print(f'failed to verify inclusion of doc_id={d}')
+        return False
+    print(f'verified doc_id={d} is entry {proof["position"]} of block {proof["block_hash"]} at height '
+          f'{proof["height"]} with {len(proof["proof"])} sibling hashes')
+    return True
+
+
+def validate_samples(url: str, document_store: DocumentStore, samples: int):
+    for _ in range(samples):
+        d = document_store.sample().hex()
+        response = requests.get(f'{url}?doc_id={d}')
         assert response.status_code == 200
         key = response.headers['X-Public-Key']
         try:
@@ -38,3 +152,29 @@ if __name__ == '__main__':
 
         finally:
             os.remove(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate the authenticity and integrity of WebChain documents')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--documents-dir', type=Path, help='documents to validate, required unless --proof is given')
+    parser.add_argument('--samples', type=int, default=10, help='number of random documents to validate')
+    parser.add_argument('--batch', action='store_true', help='validate every document in documents-dir')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent requests in batch mode')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='verification processes in batch mode')
+    parser.add_argument('--proof', metavar='DOC_ID', help='verify the Merkle inclusion proof of one document')
+    args = parser.parse_args()
+
+    if args.proof is not None:
+        exit(0 if validate_proof(args.url, args.proof) else 1)
+
+    if args.documents_dir is None:
+        parser.error('--documents-dir is required to validate documents')
+    store = DocumentStore(args.documents_dir)
+    if args.batch:
+        num_verified, num_failed, elapsed = verify_batch(args.url, (d.hex() for d in store), args.concurrency,
+                                                         args.workers)
+        print(f'validated {num_verified} documents, {num_failed} failed, '
+              f'{(num_verified + num_failed) / elapsed:.1f} docs/sec')
+        exit(1 if num_failed else 0)
+    validate_samples(args.url, store, args.samples)
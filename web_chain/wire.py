@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+from pathlib import Path
+from struct import Struct, error as StructError
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Final, Iterable, Iterator, List, Optional, Tuple
+from zlib import crc32
+
+import httpx
+
+from blocks import BaseBlock, RootBlock
+from chain_store import ChainStore, BlockRecord, decode_block_body, encode_block, frame_record, RECORD_CRC, \
+    RECORD_LENGTH
+from chain_validator import verify_block_record
+
+# a stream is a header followed by the records of consecutive blocks, in the chain store's record format
+STREAM_MAGIC: Final[bytes] = b'WCSTREAM'
+# versioned apart from the segments, the store's on-disk format can change without breaking the peers of a node.
+# Streams started out at the segment version of the time, 3
+STREAM_VERSION: Final[int] = 3
+# magic, version, height of the first block
+STREAM_HEADER: Final[Struct] = Struct('>8sHQ')
+STREAM_CONTENT_TYPE: Final[str] = 'application/octet-stream'
+STREAM_CHUNK_SIZE: Final[int] = 64 * 2 ** 10
+# a record is buffered whole before it is decoded, a peer cannot make a node buffer more than this
+MAX_RECORD_SIZE: Final[int] = 16 * 2 ** 20
+
+
+def encode_stream(blocks: Iterable[BaseBlock], start: int) -> Iterator[bytes]:
+    """
+    Encodes blocks as they are drawn from blocks, start is the height of the first one
+    """
+    yield STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, start)
+    for block in blocks:
+        yield encode_block(block)
+
+
+def encode_record_stream(bodies: Iterable[bytes], start: int) -> Iterator[bytes]:
+    """
+    Same as encode_stream for blocks that are already encoded, as read from a chain store
+    """
+    yield STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, start)
+    for body in bodies:
+        yield frame_record(body)
+
+
+def coalesce(parts: Iterable[bytes], size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Joins small parts into chunks of about size bytes so a stream is not sent one block at a time
+    """
+    chunk, length = [], 0
+    for part in parts:
+        chunk.append(part)
+        length += len(part)
+        if length >= size:
+            yield b''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+class StreamDecoder:
+    """
+    Splits a stream fed in chunks of any size into block bodies. Only the current partial record is buffered, so the
+    memory used does not grow with the length of the stream, and a record longer than max_record_size is rejected
+    """
+
+    def __init__(self, max_record_size: int = MAX_RECORD_SIZE):
+        self.max_record_size: Final[int] = max_record_size
+        self._buffer: Final[bytearray] = bytearray()
+        self.start: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """
+        Returns the bodies of the records completed by chunk, raises ValueError if the stream is corrupt
+        """
+        buffer = self._buffer
+        buffer += chunk
+        offset = 0
+        if self.start is None:
+            if len(buffer) < STREAM_HEADER.size:
+                return []
+            magic, version, self.start = STREAM_HEADER.unpack_from(buffer, 0)
+            if magic != STREAM_MAGIC:
+                raise ValueError('not a block stream')
+            if version != STREAM_VERSION:
+                raise ValueError(f'unsupported stream version {version}')
+            offset = STREAM_HEADER.size
+        bodies = []
+        while offset + RECORD_LENGTH.size <= len(buffer):
+            length, = RECORD_LENGTH.unpack_from(buffer, offset)
+            if length > self.max_record_size:
+                raise ValueError(f'record of {length} bytes exceeds {self.max_record_size}')
+            start = offset + RECORD_LENGTH.size
+            end = start + length
+            if end + RECORD_CRC.size > len(buffer):
+                break
+            body = bytes(buffer[start:end])
+            if crc32(body) != RECORD_CRC.unpack_from(buffer, end)[0]:
+                raise ValueError('record checksum mismatch')
+            bodies.append(body)
+            offset = end + RECORD_CRC.size
+        del buffer[:offset]
+        return bodies
+
+    def close(self):
+        """
+        Raises ValueError if the stream ended in the middle of a record
+        """
+        if self.start is None or self._buffer:
+            raise ValueError('truncated stream')
+
+
+def decode_record(body: bytes) -> BlockRecord:
+    """
+    Decodes a record body received from elsewhere, raises ValueError if it is shorter than its fields say
+    """
+    try:
+        return decode_block_body(body)
+    except StructError as e:
+        raise ValueError(f'malformed block record: {e}') from None
+
+
+def decode_stream(chunks: Iterable[bytes]) -> Iterator[BlockRecord]:
+    decoder = StreamDecoder()
+    for chunk in chunks:
+        for body in decoder.feed(chunk):
+            yield decode_record(body)
+    decoder.close()
+
+
+async def adecode_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[BlockRecord]:
+    decoder = StreamDecoder()
+    async for chunk in chunks:
+        for body in decoder.feed(chunk):
+            yield decode_record(body)
+    decoder.close()
+
+
+def _stored_tail(store: ChainStore) -> Tuple[bytes, bytes]:
+    """
+    Hash and last entry hash of the newest stored block
+    """
+    if store.height == 0:
+        root = RootBlock.get_instance()
+        return root.sha256_hash, root.entries[-1].sha256_hash
+    *_, body = store.record_bodies(store.height)
+    record = decode_block_body(body)
+    return record.sha256_hash, record.entries[-1].sha256_hash
+
+
+def import_stream(chunks: Iterable[bytes], store: ChainStore) -> int:
+    """
+    Verifies the streamed blocks and appends them to store, which must end just before the first of them.
+    Blocks are checked against the hashes of the block before them only, nothing else of the chain is kept in memory.
+    Returns the number of blocks imported, raises ValueError at the first invalid block, the ones before it are kept
+    """
+    previous_hash, previous_entry_hash = _stored_tail(store)
+    expected_start = store.height + 1
+    decoder = StreamDecoder()
+    imported = 0
+    for chunk in chunks:
+        bodies = decoder.feed(chunk)
+        if decoder.start not in (None, expected_start):
+            raise ValueError(f'stream starts at height {decoder.start}, the store ends at {store.height}')
+        for body in bodies:
+            record = decode_record(body)
+            error = verify_block_record(previous_hash, previous_entry_hash, record)
+            if error is not None:
+                raise ValueError(f'block at height {store.height + 1} is invalid: {error}')
+            store.append_record(frame_record(body))
+            previous_hash, previous_entry_hash = record.sha256_hash, record.entries[-1].sha256_hash
+            imported += 1
+    decoder.close()
+    store.sync()
+    return imported
+
+
+def export_store(store: ChainStore, out: BinaryIO, start: int = 1, stop: Optional[int] = None) -> int:
+    """
+    Writes the stored blocks [start, stop) to out as a stream, returns the number of blocks written
+    """
+    exported = 0
+
+    def counted(bodies: Iterable[bytes]) -> Iterator[bytes]:
+        nonlocal exported
+        for body in bodies:
+            exported += 1
+            yield body
+
+    for chunk in coalesce(encode_record_stream(counted(store.record_bodies(start, stop)), start)):
+        out.write(chunk)
+    return exported
+
+
+def fetch_stream(url: str, store: ChainStore, stop: Optional[int] = None) -> int:
+    """
+    Imports the blocks of the node at url that come after the blocks in store, streamed from its range endpoint
+    """
+    params = {'start': store.height + 1}
+    if stop is not None:
+        params['stop'] = stop
+    with httpx.stream('GET', f'{url.rstrip("/")}/chain/blocks', params=params, timeout=None) as response:
+        response.raise_for_status()
+        return import_stream(response.iter_bytes(), store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export and import WebChain blocks as a stream')
+    parser.add_argument('command', choices=('export', 'import', 'fetch'))
+    parser.add_argument('chain_dir', type=Path)
+    parser.add_argument('--start', type=int, default=1, help='first height to export')
+    parser.add_argument('--stop', type=int, help='height to stop before')
+    parser.add_argument('--url', default='http://localhost:8000', help='node to fetch blocks from')
+    args = parser.parse_args()
+
+    chain_store = ChainStore(args.chain_dir)
+    try:
+        if args.command == 'export':
+            export_store(chain_store, sys.stdout.buffer, args.start, args.stop)
+        elif args.command == 'import':
+            count = import_stream(iter(lambda: sys.stdin.buffer.read(STREAM_CHUNK_SIZE), b''), chain_store)
+            print(f'imported {count} blocks, height {chain_store.height}', file=sys.stderr)
+        else:
+            count = fetch_stream(args.url, chain_store, args.stop)
+            print(f'fetched {count} blocks, height {chain_store.height}', file=sys.stderr)
+    finally:
+        chain_store.close()
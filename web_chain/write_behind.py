@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Thread
+from time import perf_counter
+from typing import Final, Union
+
+from document_store import DocumentStore
+from metrics import histogram
+
+DEFAULT_MAX_QUEUE: Final[int] = 1_024
+DEFAULT_MAX_BATCH: Final[int] = 64
+
+FLUSH_SECONDS: Final = histogram('webchain_document_flush_seconds', 'Time spent durably writing a batch of documents')
+
+
+class DocumentWriter(Thread):
+    """
+    Background writer that takes document writes off the publishing threads.
+
+    Writes are queued in a bounded queue, submit blocks once it is full, and written in batches that share their
+    directory fsyncs. The future returned by submit is resolved only once the document is durable, so the entry for a
+    document should be committed after that future is done.
+    """
+
+    def __init__(self, document_store: DocumentStore, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_batch: int = DEFAULT_MAX_BATCH):
+        super().__init__(daemon=True)
+        self.document_store: Final[DocumentStore] = document_store
+        self.max_batch: Final[int] = max_batch
+        self._queue: Final[Queue] = Queue(maxsize=max_queue)
+        self.documents_written: int = 0
+        self.flushes: int = 0
+        self.last_flush_latency: float = 0.0
+        self.max_flush_latency: float = 0.0
+        self.total_flush_latency: float = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def mean_flush_latency(self) -> float:
+        return self.total_flush_latency / self.flushes if self.flushes else 0.0
+
+    def submit(self, doc_id: bytes, contents: Union[str, bytes]) -> Future:
+        """
+        Returns a future resolved with the path of the document once it has been fsync'd
+        """
+        future = Future()
+        self._queue.put((doc_id, contents, future))
+        return future
+
+    def close(self):
+        """
+        Writes everything already submitted and stops the writer
+        """
+        self._queue.put(None)
+        self.join()
+
+    def run(self) -> None:
+        super().run()
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list):
+        start = perf_counter()
+        try:
+            paths = self.document_store.put_many((doc_id, contents) for doc_id, contents, _ in batch)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        latency = perf_counter() - start
+        FLUSH_SECONDS.observe(latency)
+        self.flushes += 1
+        self.documents_written += len(batch)
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+        for (_, _, future), path in zip(batch, paths):
+            future.set_result(path)